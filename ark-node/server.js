@@ -33,6 +33,8 @@ const app = express();
 // mount static assets under /assets
 app.use('/assets', express.static(path.join(distPath, 'assets')));
 
+app.use(express.json());
+
 app.use(cors({
   origin: 'http://localhost:5173',
   methods: ['GET','POST','OPTIONS'],
@@ -60,21 +62,39 @@ app.post('/ksplats/:splatUuid', (req, res) => {
     return res.status(404).json({ error: `Directory ${splatUuid} not found` });
   }
 
-  // 2) hard-coded filename inside each splat_storage/<splatUuid>
-  const inputFilename = `${splatUuid}.ply`;
+  // 2) <splatUuid>.ply inside each splat_storage/<splatUuid>, or
+  //    <splatUuid>.<variant>.ply for e.g. training previews
+  const { variant } = req.body || {};
+  if (variant !== undefined && !/^[A-Za-z0-9_-]+$/.test(String(variant))) {
+    return res.status(400).json({ error: `Invalid variant ${variant}` });
+  }
+  const baseName = variant !== undefined ? `${splatUuid}.${variant}` : splatUuid;
+  const inputFilename = `${baseName}.ply`;
   const inputPath     = path.join(targetDir, inputFilename);
   if (!fs.existsSync(inputPath)) {
     return res.status(404).json({ error: `File ${inputFilename} not found in ${splatUuid}` });
   }
 
   // 3) output name: same dir, different extension
-  const outputFilename = `${splatUuid}.ksplat`;
+  const outputFilename = `${baseName}.ksplat`;
   const outputPath     = path.join(targetDir, outputFilename);
 
-  // 4) run the script
+  // 4) run the script; optional knobs come from the pruning preset
+  const {
+    compressionLevel = 0,
+    alphaRemovalThreshold = 1,
+    sceneCenter = '0,0,0',
+    blockSize = 5.0,
+    bucketSize = 256,
+    sphericalHarmonicsDegree = 0,
+  } = req.body || {};
   const result = spawnSync(
     process.execPath,                         // your Node.js binary
-    [KSPLAT_SCRIPT, inputPath, outputPath],   // args: [input, output]
+    [
+      KSPLAT_SCRIPT, inputPath, outputPath,   // args: [input, output, ...]
+      String(compressionLevel), String(alphaRemovalThreshold), String(sceneCenter),
+      String(blockSize), String(bucketSize), String(sphericalHarmonicsDegree),
+    ],
     { stdio: 'inherit' }                      // pipe stdio so you see logs
   );
 
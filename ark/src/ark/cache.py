@@ -0,0 +1,171 @@
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+import anyio
+
+from src.ark.serving import make_etag
+
+
+@dataclass
+class CacheEntry:
+    """A cached file, or just its metadata if it is too large to hold in memory."""
+
+    stat_result: os.stat_result
+    etag: str
+    headers: Dict[str, str]
+    data: Optional[bytes] = None
+    checked_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else 0
+
+
+class FileCache:
+    """LRU cache of small, hot files held in memory under a total byte budget.
+
+    Every entry keeps the file contents together with its stat result, ETag and
+    response headers. Entries are revalidated with a single stat at most every
+    `revalidate_after` seconds and reloaded when the file's mtime, size or inode
+    changed. Files larger than `max_entry_bytes` are never held in memory; their
+    metadata is still cached so they can be served from disk without extra stats.
+    Such entries hold no bytes, so the number of entries, and of keys remembered
+    as missing, is capped at `max_entries` as well.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entry_bytes: Optional[int] = None,
+        revalidate_after: float = 1.0,
+        max_entries: int = 4096,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_entry_bytes = min(max_entry_bytes or max_bytes, max_bytes)
+        self.revalidate_after = revalidate_after
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # keys whose file was missing, so absent variants don't cost a stat per hit
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def invalidate(self, key: str):
+        """Forgets `key`, including that its file was missing."""
+        with self._lock:
+            self._missing.pop(key, None)
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry.size
+
+    async def get(
+        self, key: str, path: Path, headers: Optional[Mapping[str, str]] = None
+    ) -> Optional[CacheEntry]:
+        """Returns the cache entry for `key`, loading `path` on a miss.
+
+        Args:
+            key: Cache key, e.g. the splat UUID.
+            path: Path of the file backing the key.
+            headers: Extra response headers to store with a newly loaded entry.
+
+        Returns:
+            The entry, or None if the file does not exist.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if (
+                now - self._missing.get(key, -self.revalidate_after)
+                < self.revalidate_after
+            ):
+                return None
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.checked_at < self.revalidate_after:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, path)
+        except FileNotFoundError:
+            self._mark_missing(key, now)
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            self._mark_missing(key, now)
+            return None
+
+        if entry is not None and _same_file(entry.stat_result, stat_result):
+            with self._lock:
+                entry.checked_at = now
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+        with self._lock:
+            self.misses += 1
+        entry = CacheEntry(
+            stat_result=stat_result,
+            etag=make_etag(stat_result),
+            headers={
+                "Accept-Ranges": "bytes",
+                "ETag": make_etag(stat_result),
+                "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+                **(headers or {}),
+            },
+        )
+        if stat_result.st_size <= self.max_entry_bytes:
+            entry.data = await anyio.to_thread.run_sync(path.read_bytes)
+            if len(entry.data) != stat_result.st_size:
+                # modified while reading; serve it but don't cache it
+                return entry
+        self._insert(key, entry)
+        return entry
+
+    def _mark_missing(self, key: str, now: float):
+        self.invalidate(key)
+        with self._lock:
+            self._missing.pop(key, None)
+            self._missing[key] = now
+            while len(self._missing) > self.max_entries:
+                self._missing.popitem(last=False)
+
+    def _insert(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._missing.pop(key, None)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            self._entries[key] = entry
+            self.total_bytes += entry.size
+            while (
+                self.total_bytes > self.max_bytes
+                or len(self._entries) > self.max_entries
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+                self.evictions += 1
+
+
+def _same_file(a: os.stat_result, b: os.stat_result) -> bool:
+    return (a.st_ino, a.st_size, a.st_mtime_ns) == (b.st_ino, b.st_size, b.st_mtime_ns)
@@ -1,12 +1,20 @@
 from pathlib import Path
 
-from fastapi import FastAPI, Request, HTTPException, Header, Response, status
+from fastapi import FastAPI, Request, HTTPException
 import os
-import re
-from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
+from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-import aiofiles
+
+from src.ark.cache import FileCache
+from src.ark.static import StaticIndex
+from src.ark.serving import (
+    AccessRecorder,
+    CachedFile,
+    JsonFileCache,
+    file_response,
+    memory_response,
+    precompressed_variants,
+)
 
 app = FastAPI()
 
@@ -21,7 +29,15 @@ app.add_middleware(
 VIDEO_PATH = Path(os.getenv("VIDEO_PATH"))
 SPLAT_STORAGE_DIR = Path(os.getenv("SPLAT_STORAGE_DIR", "splat_storage"))
 SPLAT_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
-CHUNK_SIZE = 1024 * 1024  # 1 MiB per chunk
+SPLAT_CACHE = FileCache(
+    max_bytes=int(os.getenv("SPLAT_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+    max_entry_bytes=int(os.getenv("SPLAT_CACHE_MAX_ENTRY_BYTES", 128 * 1024 * 1024)),
+    max_entries=int(os.getenv("SPLAT_CACHE_MAX_ENTRIES", 4096)),
+)
+# Parsed LOD manifests, so chunk requests don't re-read them.
+LOD_MANIFESTS = JsonFileCache()
+# Downloads delay the eviction of a job by the splats storage sweep.
+ACCESS = AccessRecorder(SPLAT_STORAGE_DIR)
 
 # 1) Allow an override so you can set FRONTEND_DIST in prod (e.g. Docker)
 landing_page_dist = os.getenv("LANDING_PAGE_FRONTEND_DIST")
@@ -32,7 +48,9 @@ else:
     #    └── project/
     #        ├─ src/ark/main.py    <- this file
     #        └─ src/scantrix-api-web/dist/
-    LANDING_PAGE_DIST = Path(__file__).parent.parent.parent.parent / "scantrix-api-web" / "dist"
+    LANDING_PAGE_DIST = (
+        Path(__file__).parent.parent.parent.parent / "scantrix-api-web" / "dist"
+    )
 
 print(LANDING_PAGE_DIST)
 
@@ -40,11 +58,13 @@ print(LANDING_PAGE_DIST)
 if not LANDING_PAGE_DIST.exists():
     raise RuntimeError(f"Could not find frontend dist folder at {LANDING_PAGE_DIST!r}")
 
-app.mount(
-    "/landing_page",
-    StaticFiles(directory=LANDING_PAGE_DIST),
-    name="landing page",
-)
+LANDING_PAGE_STATIC = StaticIndex(LANDING_PAGE_DIST)
+
+
+@app.api_route("/landing_page/{path:path}", methods=["GET", "HEAD"])
+async def serve_landing_page_asset(path: str, request: Request):
+    return LANDING_PAGE_STATIC.response(request, path)
+
 
 demo_app_dist = os.getenv("DEMO_APP_FRONTEND_DIST")
 if demo_app_dist:
@@ -54,7 +74,9 @@ else:
     #    └── project/
     #        ├─ src/ark/main.py    <- this file
     #        └─ src/scantrix-ui-web/dist/
-    DEMO_APP_DIST = Path(__file__).parent.parent.parent.parent / "scantrix-ui-web" / "dist"
+    DEMO_APP_DIST = (
+        Path(__file__).parent.parent.parent.parent / "scantrix-ui-web" / "dist"
+    )
 
 print(DEMO_APP_DIST)
 
@@ -62,119 +84,120 @@ print(DEMO_APP_DIST)
 if not DEMO_APP_DIST.exists():
     raise RuntimeError(f"Could not find frontend dist folder at {DEMO_APP_DIST!r}")
 
-app.mount(
-    "/demo_app",
-    StaticFiles(directory=DEMO_APP_DIST),
-    name="demo app",
+DEMO_APP_STATIC = StaticIndex(DEMO_APP_DIST)
+
+
+@app.api_route("/demo_app/{path:path}", methods=["GET", "HEAD"])
+async def serve_demo_app_asset(path: str, request: Request):
+    return DEMO_APP_STATIC.response(request, path)
+
+
+@app.api_route("/", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def serve_spa(request: Request):
+    return LANDING_PAGE_STATIC.response(request, "index.html")
+
+
+@app.api_route("/demo", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def serve_spa_demo(request: Request):
+    return DEMO_APP_STATIC.response(request, "index.html")
+
+
+VIDEO_FILE = CachedFile(VIDEO_PATH)
+# Browsers scrub with open-ended `bytes=N-` ranges; answer each with at most this
+# much and let them ask for more instead of streaming the rest of the file.
+MAX_OPEN_ENDED_RANGE_BYTES = int(
+    os.getenv("VIDEO_MAX_OPEN_ENDED_RANGE_BYTES", 8 * 1024 * 1024)
 )
 
-@app.get("/", response_class=HTMLResponse)
-async def serve_spa():
-    return FileResponse(LANDING_PAGE_DIST / "index.html")
-
-@app.get("/demo", response_class=HTMLResponse)
-async def serve_spa_demo():
-    return FileResponse(DEMO_APP_DIST / "index.html")
-
-
-def get_file_size(path: str) -> int:
-    return os.stat(path).st_size
-
-def iter_file(path: str, start: int = 0, end: int = None):
-    """Yield file bytes from start to end (inclusive)."""
-    with open(path, "rb") as f:
-        f.seek(start)
-        bytes_to_read = (end - start + 1) if end is not None else None
-        while True:
-            chunk = f.read(CHUNK_SIZE if bytes_to_read is None else min(CHUNK_SIZE, bytes_to_read))
-            if not chunk:
-                break
-            yield chunk
-            if bytes_to_read is not None:
-                bytes_to_read -= len(chunk)
-                if bytes_to_read <= 0:
-                    break
 
 @app.get("/video")
-async def stream_video(range: str = Header(None)):
-    file_size = get_file_size(VIDEO_PATH)
-
-    if range is None:
-        # No Range header: client wants the whole file
-        return StreamingResponse(
-            iter_file(VIDEO_PATH),
-            media_type="video/mp4",
-            headers={
-                "Accept-Ranges": "bytes",
-                "Content-Length": str(file_size),
-            },
-        )
-
-    # Parse Range header: e.g. "bytes=0-1023"
-    m = re.match(r"bytes=(\d*)-(\d*)", range)
-    if not m:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Range header")
-
-    start_str, end_str = m.groups()
-    start = int(start_str) if start_str else 0
-    end = int(end_str) if end_str else file_size - 1
-    if start >= file_size or end >= file_size or start > end:
-        # Unsatisfiable range
-        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
-
-    chunk_size = end - start + 1
-
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(chunk_size),
-    }
-
-    return StreamingResponse(
-        iter_file(VIDEO_PATH, start, end),
-        status_code=status.HTTP_206_PARTIAL_CONTENT,
+async def stream_video(request: Request):
+    try:
+        f, stat_result = VIDEO_FILE.get()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_response(
+        request,
+        VIDEO_PATH,
         media_type="video/mp4",
-        headers=headers,
+        stat_result=stat_result,
+        file=f,
+        open_ended_limit=MAX_OPEN_ENDED_RANGE_BYTES,
     )
 
 
-async def file_chunk_generator(
-    path: Path,
-    chunk_size: int = 1024 * 1024,  # 1 MB per chunk,
-    start: int = 0,
-    end: int = None
-):
-    """
-    Async generator that reads a slice [start,end] of the file in CHUNK_SIZE pieces.
-    """
-    file_size = path.stat().st_size
-    end = end if end is not None else file_size - 1
-    bytes_to_read = end - start + 1
-
-    async with aiofiles.open(path, "rb") as f:
-        await f.seek(start)
-        while bytes_to_read > 0:
-            read_size = min(chunk_size, bytes_to_read)
-            data = await f.read(read_size)
-            if not data:
-                break
-            bytes_to_read -= len(data)
-            yield data
-
-
 @app.get("/splats/{splat_uuid}")
-async def read_item(splat_uuid: str):
+async def read_item(splat_uuid: str, request: Request):
     file_path = SPLAT_STORAGE_DIR / splat_uuid / f"{splat_uuid}.ksplat"
-    if not file_path.exists() or not file_path.is_file():
+    for variant_path, encoding in precompressed_variants(request, file_path):
+        headers = {
+            "Content-Disposition": f'attachment; filename="{splat_uuid}.ksplat"',
+            "Vary": "Accept-Encoding",
+        }
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        entry = await SPLAT_CACHE.get(variant_path.name, variant_path, headers)
+        if entry is not None:
+            break
+    if entry is None:
+        # serve the latest training checkpoint until the final splat lands
+        variant_path = file_path.with_name(f"{splat_uuid}.preview.ksplat")
+        headers = {
+            "Content-Disposition": f'attachment; filename="{variant_path.name}"',
+            "Cache-Control": "no-cache",
+            "X-Splat-Preview": "true",
+        }
+        entry = await SPLAT_CACHE.get(variant_path.name, variant_path, headers)
+    if entry is None:
         raise HTTPException(status_code=404, detail="File not found")
-    file_size = file_path.stat().st_size
-    headers = {
-        "Content-Length": str(file_size),
-        "Accept-Ranges": "bytes",
-        "Content-Disposition": f'attachment; filename="{splat_uuid}.ksplat"',
-    }
-    return StreamingResponse(
-        file_chunk_generator(file_path),
-        media_type="application/octet-stream",
-        headers=headers,
+    if "X-Splat-Preview" not in entry.headers:
+        ACCESS.record(splat_uuid)
+    if entry.data is None:
+        return file_response(
+            request, variant_path, headers=entry.headers, stat_result=entry.stat_result
+        )
+    return memory_response(
+        request,
+        entry.data,
+        entry.etag,
+        entry.stat_result.st_mtime,
+        headers=entry.headers,
+    )
+
+
+@app.get("/metrics/splat-cache")
+async def read_splat_cache_metrics():
+    return SPLAT_CACHE.stats()
+
+
+@app.get("/splats/{splat_uuid}/lod")
+async def read_lod_manifest(splat_uuid: str, request: Request):
+    manifest_path = SPLAT_STORAGE_DIR / splat_uuid / f"{splat_uuid}.lod.json"
+    if not manifest_path.is_file():
+        raise HTTPException(status_code=404, detail="LOD manifest not found")
+    ACCESS.record(splat_uuid)
+    return file_response(request, manifest_path, media_type="application/json")
+
+
+@app.get("/splats/{splat_uuid}/lod/{chunk_id}")
+async def read_lod_chunk(splat_uuid: str, chunk_id: int, request: Request):
+    splat_dir = SPLAT_STORAGE_DIR / splat_uuid
+    try:
+        manifest = LOD_MANIFESTS.get(splat_dir / f"{splat_uuid}.lod.json")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="LOD manifest not found")
+    if not 0 <= chunk_id < len(manifest["chunks"]):
+        raise HTTPException(status_code=404, detail="Chunk not found")
+
+    chunk = manifest["chunks"][chunk_id]
+    ACCESS.record(splat_uuid)
+    return file_response(
+        request,
+        splat_dir / manifest["file"],
+        headers={
+            "X-Splat-Count": str(chunk["count"]),
+            "X-LOD-Level": str(chunk["level"]),
+        },
+        offset=chunk["offset"],
+        length=chunk["length"],
     )
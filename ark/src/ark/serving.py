@@ -0,0 +1 @@
+../../../splats/src/serving.py
\ No newline at end of file
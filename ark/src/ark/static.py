@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict
+
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+
+from src.ark.serving import acceptable_encodings, memory_response
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip variants are built
+    brotli = None
+
+LOGGER = logging.getLogger(__name__)
+
+# Vite emits content-hashed names such as assets/index-B3x_9aQf.js: an 8 character
+# base64url hash after the last "-", only under assets/. Files copied from public/
+# (favicons, images) keep their names at the root and must stay revalidated. A
+# word rather than a hash (all lowercase) is not taken as one.
+FINGERPRINTED_NAME = re.compile(
+    r"^assets/(?:[^/]+/)*[^/]+-(?=[a-z-]{0,7}[A-Z0-9_])[A-Za-z0-9_-]{8}(?:\.[A-Za-z0-9]+)+$"
+)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+HTML_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/wasm",
+    "application/xml",
+    "image/svg+xml",
+    "text/javascript",
+}
+MIN_COMPRESS_BYTES = 1024
+BROTLI_QUALITY = 9
+GZIP_LEVEL = 9
+
+
+@dataclass
+class StaticAsset:
+    content_type: str
+    cache_control: str
+    digest: str
+    mtime: float
+    # encoded bodies keyed by content coding, "identity" for the original bytes
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+
+def _cache_control(relative_path: str) -> str:
+    if relative_path.endswith(".html"):
+        return HTML_CACHE_CONTROL
+    if FINGERPRINTED_NAME.search(relative_path):
+        return IMMUTABLE_CACHE_CONTROL
+    return DEFAULT_CACHE_CONTROL
+
+
+def load_asset(path: Path, relative_path: str) -> StaticAsset:
+    data = path.read_bytes()
+    content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    asset = StaticAsset(
+        content_type=content_type,
+        cache_control=_cache_control(relative_path),
+        digest=hashlib.blake2b(data, digest_size=12).hexdigest(),
+        mtime=path.stat().st_mtime,
+        variants={"identity": data},
+    )
+    if len(data) >= MIN_COMPRESS_BYTES and _is_compressible(content_type):
+        if brotli is not None:
+            asset.variants["br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+        asset.variants["gzip"] = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+        # keep only the encodings that actually save bytes
+        for coding in [c for c in asset.variants if c != "identity"]:
+            if len(asset.variants[coding]) >= len(data):
+                del asset.variants[coding]
+    return asset
+
+
+class StaticIndex:
+    """Serves a built frontend from an in-memory table.
+
+    Every file under `directory` is read once at startup together with its gzip
+    (and, if brotli is installed, br) variants and a content ETag, so requests are
+    answered without touching the disk. Fingerprinted assets are sent with an
+    immutable one-year Cache-Control, HTML with a short TTL. HEAD requests get
+    the headers of the matching GET only.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.assets: Dict[str, StaticAsset] = {}
+        for path in sorted(directory.rglob("*")):
+            if path.is_file():
+                relative_path = path.relative_to(directory).as_posix()
+                self.assets[relative_path] = load_asset(path, relative_path)
+        LOGGER.info(
+            "Indexed %d static files (%d bytes) from %s",
+            len(self.assets),
+            sum(len(a.variants["identity"]) for a in self.assets.values()),
+            directory,
+        )
+
+    def response(self, request: Request, relative_path: str) -> Response:
+        asset = self.assets.get(relative_path.lstrip("/"))
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+
+        offered = [c for c in ("br", "gzip") if c in asset.variants]
+        codings = acceptable_encodings(request.headers.get("accept-encoding"), offered)
+        coding = codings[0] if codings else "identity"
+        headers = {"Cache-Control": asset.cache_control}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        etag = (
+            f'"{asset.digest}"'
+            if coding == "identity"
+            else f'"{asset.digest}-{coding}"'
+        )
+        response = memory_response(
+            request,
+            asset.variants[coding],
+            etag,
+            asset.mtime,
+            media_type=asset.content_type,
+            headers=headers,
+        )
+        if request.method == "HEAD":
+            # the same headers, Content-Length included, without the body
+            return Response(status_code=response.status_code, headers=response.headers)
+        return response
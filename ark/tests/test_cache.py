@@ -0,0 +1,156 @@
+import os
+import time
+
+import anyio
+import pytest
+
+from src.ark.cache import FileCache
+
+REVALIDATE_AFTER = 0.05
+
+
+def get(cache: FileCache, key: str, path):
+    return anyio.run(cache.get, key, path)
+
+
+def write(path, size: int, fill: bytes = b"x"):
+    path.write_bytes(fill * size)
+    return path
+
+
+@pytest.fixture()
+def files(tmp_path):
+    return {name: write(tmp_path / f"{name}.ksplat", 40) for name in "abc"}
+
+
+def test_least_recently_used_file_is_evicted_over_budget(files):
+    """GIVEN a cache with room for two of three equally sized files
+    WHEN the first two are loaded, the first read again and the third loaded
+    THEN the second, least recently used, is evicted and the budget holds."""
+    cache = FileCache(max_bytes=100, revalidate_after=60)
+
+    get(cache, "a", files["a"])
+    get(cache, "b", files["b"])
+    get(cache, "a", files["a"])
+    get(cache, "c", files["c"])
+
+    assert cache.stats() == {
+        "entries": 2,
+        "bytes": 80,
+        "max_bytes": 100,
+        "hits": 1,
+        "misses": 3,
+        "evictions": 1,
+    }
+    assert set(cache._entries) == {"a", "c"}
+
+
+def test_large_files_are_not_held_in_memory(files, tmp_path):
+    """GIVEN a file above the per-entry limit
+    WHEN it is requested
+    THEN its metadata is returned without its bytes, and nothing counts against the budget.
+    """
+    cache = FileCache(max_bytes=100, max_entry_bytes=50, revalidate_after=60)
+    large = write(tmp_path / "large.ksplat", 60)
+
+    entry = get(cache, "large", large)
+
+    assert entry.data is None and entry.stat_result.st_size == 60
+    assert entry.etag == entry.headers["ETag"]
+    assert cache.stats()["bytes"] == 0
+
+
+def test_entry_count_is_capped_for_large_files(tmp_path):
+    """GIVEN a cache capped at two entries
+    WHEN three files above the per-entry limit are requested
+    THEN the least recently used metadata entry is evicted even though no bytes are held.
+    """
+    cache = FileCache(
+        max_bytes=100, max_entry_bytes=10, revalidate_after=60, max_entries=2
+    )
+
+    for name in "abc":
+        get(cache, name, write(tmp_path / f"{name}.ksplat", 20))
+
+    assert list(cache._entries) == ["b", "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_missing_keys_are_capped(tmp_path):
+    """GIVEN a cache capped at two entries
+    WHEN three missing files are requested
+    THEN only the two most recent are remembered as missing."""
+    cache = FileCache(max_bytes=100, revalidate_after=60, max_entries=2)
+
+    for name in "abc":
+        assert get(cache, name, tmp_path / f"{name}.ksplat") is None
+
+    assert list(cache._missing) == ["b", "c"]
+
+
+def test_changed_file_is_reloaded_after_revalidation(files):
+    """GIVEN a cached file
+    WHEN it is rewritten with a different size, then with the same size but a new mtime
+    THEN each version is served once the entry is revalidated."""
+    cache = FileCache(max_bytes=1000, revalidate_after=REVALIDATE_AFTER)
+    first = get(cache, "a", files["a"])
+
+    write(files["a"], 30, b"y")
+    assert get(cache, "a", files["a"]) is first
+    time.sleep(REVALIDATE_AFTER)
+    second = get(cache, "a", files["a"])
+    assert second.data == b"y" * 30 and second.etag != first.etag
+
+    write(files["a"], 30, b"z")
+    os.utime(files["a"], ns=(0, second.stat_result.st_mtime_ns + 1_000_000))
+    time.sleep(REVALIDATE_AFTER)
+    third = get(cache, "a", files["a"])
+    assert third.data == b"z" * 30 and third.etag != second.etag
+    assert cache.stats()["bytes"] == 30
+
+
+def test_unchanged_file_revalidates_as_a_hit(files):
+    """GIVEN a cached file that does not change
+    WHEN it is requested after its revalidation interval
+    THEN the same entry is returned and counted as a hit."""
+    cache = FileCache(max_bytes=1000, revalidate_after=REVALIDATE_AFTER)
+    entry = get(cache, "a", files["a"])
+
+    time.sleep(REVALIDATE_AFTER)
+
+    assert get(cache, "a", files["a"]) is entry
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_missing_file_is_found_once_it_appears(tmp_path):
+    """GIVEN a file that was requested while missing
+    WHEN it appears
+    THEN it is served after the revalidation interval, or at once when invalidated."""
+    cache = FileCache(max_bytes=1000, revalidate_after=REVALIDATE_AFTER)
+    path = tmp_path / "late.ksplat"
+
+    assert get(cache, "late", path) is None
+    write(path, 10)
+    assert get(cache, "late", path) is None
+    time.sleep(REVALIDATE_AFTER)
+    assert get(cache, "late", path).data == b"x" * 10
+
+    other = tmp_path / "other.ksplat"
+    assert get(cache, "other", other) is None
+    write(other, 10)
+    cache.invalidate("other")
+    assert get(cache, "other", other).data == b"x" * 10
+
+
+def test_deleted_file_is_dropped(files):
+    """GIVEN a cached file
+    WHEN it is deleted
+    THEN it is no longer served once revalidated, and its bytes are released."""
+    cache = FileCache(max_bytes=1000, revalidate_after=REVALIDATE_AFTER)
+    get(cache, "a", files["a"])
+
+    files["a"].unlink()
+    time.sleep(REVALIDATE_AFTER)
+
+    assert get(cache, "a", files["a"]) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
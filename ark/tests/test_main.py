@@ -0,0 +1,101 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.ark.serving import ACCESS_MARKER_FILENAME
+
+
+@pytest.fixture()
+def storage_dir(tmp_path, monkeypatch):
+    """Imports the app against a scratch storage directory and frontends."""
+    for name in ("landing_page", "demo_app"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "index.html").write_text("<!doctype html>")
+    monkeypatch.setenv("LANDING_PAGE_FRONTEND_DIST", str(tmp_path / "landing_page"))
+    monkeypatch.setenv("DEMO_APP_FRONTEND_DIST", str(tmp_path / "demo_app"))
+    monkeypatch.setenv("VIDEO_PATH", str(tmp_path / "video.mp4"))
+    monkeypatch.setenv("SPLAT_STORAGE_DIR", str(tmp_path / "storage"))
+    if "src.ark.main" in sys.modules:
+        importlib.reload(sys.modules["src.ark.main"])
+    return tmp_path / "storage"
+
+
+@pytest.fixture()
+def client(storage_dir):
+    from src.ark.main import app
+
+    return TestClient(app)
+
+
+def write_lod(storage_dir, splat_uuid):
+    job_dir = storage_dir / splat_uuid
+    job_dir.mkdir()
+    data = bytes(range(256)) * 4
+    (job_dir / f"{splat_uuid}.lod.splat").write_bytes(data)
+    chunks = [
+        {"level": 0, "offset": 0, "length": 256, "count": 8},
+        {"level": 1, "offset": 256, "length": 768, "count": 24},
+    ]
+    manifest = {"file": f"{splat_uuid}.lod.splat", "chunks": chunks}
+    (job_dir / f"{splat_uuid}.lod.json").write_text(json.dumps(manifest))
+    return data, chunks
+
+
+def test_lod_manifest_and_chunks_are_served(client, storage_dir):
+    """GIVEN a job with LOD chunks
+    WHEN its manifest and chunks are requested, in part and conditionally
+    THEN each chunk is served as its own file with its own ETag."""
+    data, chunks = write_lod(storage_dir, "job")
+
+    assert client.get("/splats/job/lod").json()["chunks"] == chunks
+    response = client.get("/splats/job/lod/1")
+    assert response.status_code == 200
+    assert response.content == data[256:]
+    assert response.headers["x-splat-count"] == "24"
+    etag = response.headers["etag"]
+    assert etag != client.get("/splats/job/lod/0").headers["etag"]
+
+    response = client.get("/splats/job/lod/1", headers={"Range": "bytes=4-11"})
+    assert response.status_code == 206
+    assert response.content == data[260:268]
+    assert response.headers["content-range"] == "bytes 4-11/768"
+    assert (
+        client.get("/splats/job/lod/1", headers={"If-None-Match": etag}).status_code
+        == 304
+    )
+    assert client.get("/splats/job/lod/2").status_code == 404
+    assert client.get("/splats/missing/lod/0").status_code == 404
+
+
+def test_downloads_are_recorded_for_eviction(client, storage_dir):
+    """GIVEN a done job and a job still training
+    WHEN their splat and LOD chunks are downloaded
+    THEN the access marker is touched for the done job only."""
+    write_lod(storage_dir, "job")
+    (storage_dir / "job" / "job.ksplat").write_bytes(b"ksplat")
+    (storage_dir / "training").mkdir()
+    (storage_dir / "training" / "training.preview.ksplat").write_bytes(b"preview")
+
+    assert client.get("/splats/training").status_code == 200
+    assert not (storage_dir / "training" / ACCESS_MARKER_FILENAME).exists()
+    assert client.get("/splats/job/lod/0").status_code == 200
+    marker = storage_dir / "job" / ACCESS_MARKER_FILENAME
+    assert marker.is_file()
+
+    os.utime(marker, (1.0, 1.0))
+    assert client.get("/splats/job").content == b"ksplat"
+    assert marker.stat().st_mtime == 1.0  # recorded at most once a minute
+
+
+def test_frontend_pages_answer_head(client):
+    """GIVEN the landing page and the demo app
+    WHEN their pages are requested with HEAD
+    THEN they answer with headers instead of 405."""
+    for path in ("/", "/demo", "/landing_page/index.html", "/demo_app/index.html"):
+        response = client.head(path)
+        assert response.status_code == 200 and response.content == b""
+        assert response.headers["content-length"] == str(len("<!doctype html>"))
@@ -0,0 +1,118 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from src.ark.static import (
+    DEFAULT_CACHE_CONTROL,
+    HTML_CACHE_CONTROL,
+    IMMUTABLE_CACHE_CONTROL,
+    StaticIndex,
+)
+
+SCRIPT = b"console.log('splats');\n" * 200
+
+
+@pytest.fixture()
+def client(tmp_path):
+    files = {
+        "index.html": b"<!doctype html><title>splats</title>",
+        "assets/index-B3x_9aQf.js": SCRIPT,
+        "assets/vendor-a1b2c3d4.js.map": b"{}",
+        "assets/hero-background.jpg": b"\xff\xd8",
+        "assets/logo-squirrel.png": b"\x89PNG",
+        "apple-touch-icon.png": b"\x89PNG",
+        "android-chrome-192x192.png": b"\x89PNG",
+        "images/hero-background.jpg": b"\xff\xd8",
+        "images/team-B3x_9aQf.jpg": b"\xff\xd8",
+    }
+    for name, data in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    index = StaticIndex(tmp_path)
+    app = FastAPI()
+
+    @app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+    async def serve(path: str, request: Request):
+        return index.response(request, path)
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "path, cache_control",
+    [
+        ("index.html", HTML_CACHE_CONTROL),
+        ("assets/index-B3x_9aQf.js", IMMUTABLE_CACHE_CONTROL),
+        ("assets/vendor-a1b2c3d4.js.map", IMMUTABLE_CACHE_CONTROL),
+        ("assets/hero-background.jpg", DEFAULT_CACHE_CONTROL),
+        ("assets/logo-squirrel.png", DEFAULT_CACHE_CONTROL),
+        ("apple-touch-icon.png", DEFAULT_CACHE_CONTROL),
+        ("android-chrome-192x192.png", DEFAULT_CACHE_CONTROL),
+        ("images/hero-background.jpg", DEFAULT_CACHE_CONTROL),
+        ("images/team-B3x_9aQf.jpg", DEFAULT_CACHE_CONTROL),
+    ],
+)
+def test_only_hashed_bundler_output_is_immutable(client, path, cache_control):
+    """GIVEN a built frontend with hashed bundles and plainly named public files
+    WHEN each file is requested
+    THEN only the hashed files under assets/ are cached for a year."""
+    response = client.get(f"/static/{path}")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == cache_control
+
+
+def test_compressed_variant_is_negotiated(client):
+    """GIVEN a compressible script
+    WHEN it is requested with and without gzip
+    THEN the matching encoding is sent, with its own ETag and Vary."""
+    compressed = client.get(
+        "/static/assets/index-B3x_9aQf.js", headers={"Accept-Encoding": "gzip"}
+    )
+    identity = client.get(
+        "/static/assets/index-B3x_9aQf.js", headers={"Accept-Encoding": "identity"}
+    )
+
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert int(compressed.headers["content-length"]) < len(SCRIPT)
+    assert compressed.content == SCRIPT
+    assert "content-encoding" not in identity.headers
+    assert identity.content == SCRIPT
+    assert compressed.headers["vary"] == identity.headers["vary"] == "Accept-Encoding"
+    assert compressed.headers["etag"] != identity.headers["etag"]
+
+
+def test_conditional_request_and_missing_file(client):
+    """GIVEN an indexed file
+    WHEN it is requested again with its ETag, and an unknown file is requested
+    THEN a 304 and a 404 are returned."""
+    etag = client.get("/static/index.html").headers["etag"]
+
+    revalidated = client.get("/static/index.html", headers={"If-None-Match": etag})
+
+    assert revalidated.status_code == 304
+    assert revalidated.headers["cache-control"] == HTML_CACHE_CONTROL
+    assert client.get("/static/missing.js").status_code == 404
+
+
+def test_head_request_gets_headers_only(client):
+    """GIVEN an indexed script
+    WHEN it is requested with HEAD
+    THEN the GET headers, Content-Length included, are sent without a body."""
+    get = client.get(
+        "/static/assets/index-B3x_9aQf.js", headers={"Accept-Encoding": "gzip"}
+    )
+    head = client.head(
+        "/static/assets/index-B3x_9aQf.js", headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert head.status_code == 200
+    assert head.content == b""
+    for name in (
+        "content-length",
+        "content-encoding",
+        "etag",
+        "cache-control",
+        "content-type",
+    ):
+        assert head.headers[name] == get.headers[name]
@@ -0,0 +1,297 @@
+"""Offline batch processing of local videos and image archives.
+
+Runs the same stages as `POST /splats` directly on files already on disk, with
+the stages of consecutive inputs overlapping:
+
+    python -m src.batch /archive/scans --report backfill.json
+
+The ksplat conversion service must be running, as for the API.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from src.config import SPLAT_STORAGE_DIR
+from src.dependencies import validate_zip_archive
+from src.events import JobEvents
+from src.jobs import read_job, update_job
+from src.pipeline import (
+    extract_upload,
+    postprocess_splat,
+    reconstruct_cameras,
+    reconstruct_summary,
+    timed_stage,
+    train_splat,
+)
+from src.post_processing import (
+    MESH_EXPORT_ENABLED,
+    fail_stale_meshes,
+    submit_mesh_export,
+)
+from src.pruning import DEFAULT_PRUNE_PRESET, PRUNE_PRESETS
+
+LOGGER = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {".mp4", ".webm", ".mov", ".avi", ".flv", ".wmv"}
+ARCHIVE_EXTENSIONS = {".zip"}
+# Job UUIDs derive from the input's absolute path, so a rerun finds its outputs.
+BATCH_NAMESPACE = uuid.UUID("6f1c2a4e-93d5-4b8e-8a51-0c7e2f9b3d10")
+# How many inputs may run each stage at once. COLMAP and brush share the GPU.
+DEFAULT_STAGE_SLOTS = {"frames": 2, "colmap": 1, "brush": 1, "postprocess": 2}
+
+
+@dataclass
+class BatchItem:
+    source: str
+    uuid: str
+    kind: str
+    status: str = "pending"
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    result: Optional[dict] = None
+
+
+def input_kind(path: Path) -> Optional[str]:
+    suffix = path.suffix.lower()
+    if suffix in VIDEO_EXTENSIONS:
+        return "video"
+    if suffix in ARCHIVE_EXTENSIONS:
+        return "images_archive"
+    return None
+
+
+def collect_inputs(
+    paths: Iterable[Path], manifest: Optional[Path] = None
+) -> List[Path]:
+    """Lists the videos and ZIP archives to process, in order and without duplicates.
+
+    Args:
+        paths: Input files, or directories whose supported files are taken.
+        manifest: A text file listing one input path per line; blank lines and
+            lines starting with "#" are skipped. Relative paths are resolved
+            against the manifest's directory.
+    """
+    candidates: List[Path] = []
+    if manifest is not None:
+        for line in manifest.read_text().splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                candidates.append(manifest.parent / line)
+    candidates += paths
+
+    inputs: List[Path] = []
+    seen = set()
+    for path in candidates:
+        if path.is_dir():
+            files = [f for f in sorted(path.iterdir()) if f.is_file() and input_kind(f)]
+        elif not path.is_file():
+            LOGGER.warning("Skipping missing input %s", path)
+            continue
+        elif input_kind(path) is None:
+            LOGGER.warning("Skipping unsupported input %s", path)
+            continue
+        else:
+            files = [path]
+        for file in files:
+            file = file.resolve()
+            if file not in seen:
+                seen.add(file)
+                inputs.append(file)
+    return inputs
+
+
+def link_input(source: Path, job_dir: Path) -> Path:
+    """Hard-links an input into its job directory, or symlinks it across devices."""
+    target = job_dir / source.name
+    if not target.exists():
+        try:
+            os.link(source, target)
+        except OSError:
+            target.symlink_to(source)
+    return target
+
+
+def is_done(job_dir: Path, request_uuid: str) -> bool:
+    job = read_job(job_dir) or {}
+    return (
+        job.get("status") == "done" and (job_dir / f"{request_uuid}.ksplat").is_file()
+    )
+
+
+class BatchRunner:
+    """Runs the pipeline for many inputs, overlapping their stages.
+
+    Each input runs its stages in order, but only `stage_slots[stage]` inputs run
+    a stage at once, so one input's frame extraction proceeds while another
+    trains. At most one input per slot is in flight, which bounds the
+    intermediates on disk.
+    """
+
+    def __init__(
+        self,
+        storage_dir: Path,
+        preset: str,
+        stage_slots: Optional[Dict[str, int]] = None,
+        force: bool = False,
+    ):
+        self.storage_dir = storage_dir
+        self.preset = preset
+        self.stage_slots = {**DEFAULT_STAGE_SLOTS, **(stage_slots or {})}
+        self.force = force
+        self._slots = {
+            stage: threading.BoundedSemaphore(count)
+            for stage, count in self.stage_slots.items()
+        }
+
+    def run(self, inputs: List[Path]) -> List[BatchItem]:
+        items = [
+            BatchItem(
+                source=str(path),
+                uuid=str(uuid.uuid5(BATCH_NAMESPACE, str(path))),
+                kind=input_kind(path),
+            )
+            for path in inputs
+        ]
+        in_flight = sum(self.stage_slots.values())
+        with ThreadPoolExecutor(
+            max_workers=in_flight, thread_name_prefix="batch"
+        ) as executor:
+            for item in items:
+                executor.submit(self._process, item)
+        return items
+
+    @contextmanager
+    def _stage(self, item: BatchItem, stage: str, events: JobEvents):
+        """Holds one of the stage's slots while timing it."""
+        with self._slots[stage], timed_stage(item.timings, stage, events):
+            yield
+
+    def _process(self, item: BatchItem):
+        job_dir = self.storage_dir / item.uuid
+        if not self.force and is_done(job_dir, item.uuid):
+            item.status = "skipped"
+            LOGGER.info("Skipping %s, already done as %s", item.source, item.uuid)
+            return
+
+        job_dir.mkdir(parents=True, exist_ok=True)
+        events = JobEvents(job_dir)
+        start = time.time()
+        update_job(
+            job_dir, status="running", started_at=start, source=item.source, batch=True
+        )
+        LOGGER.info("Processing %s as %s", item.source, item.uuid)
+        try:
+            upload_path = link_input(Path(item.source), job_dir)
+            if item.kind == "images_archive":
+                validate_zip_archive(upload_path)
+            with self._stage(item, "frames", events):
+                mask_path = extract_upload(job_dir, upload_path, item.kind)
+            with self._stage(item, "colmap", events):
+                reconstruct_cameras(job_dir, mask_path, events)
+            with self._stage(item, "brush", events):
+                budget, steps = train_splat(item.uuid, job_dir, events)
+            with self._stage(item, "postprocess", events):
+                prune_stats = postprocess_splat(item.uuid, job_dir, self.preset)
+            if MESH_EXPORT_ENABLED:
+                submit_mesh_export(item.uuid, job_dir, events)
+        except Exception as e:
+            item.status = "failed"
+            item.error = str(getattr(e, "detail", None) or e)
+            LOGGER.error(
+                "Batch input %s failed: %s", item.source, traceback.format_exc()
+            )
+            update_job(job_dir, status="failed", error=item.error)
+            return
+
+        item.status = "done"
+        item.result = reconstruct_summary(prune_stats, budget, steps, item.timings)
+        update_job(job_dir, status="done", finished_at=time.time(), result=item.result)
+
+
+def write_report(path: Path, items: List[BatchItem], seconds: float) -> dict:
+    """Writes the per-input outcomes and timings, and the totals, as JSON."""
+    counts = {status: 0 for status in ("done", "skipped", "failed")}
+    stage_seconds: Dict[str, float] = {}
+    for item in items:
+        counts[item.status] = counts.get(item.status, 0) + 1
+        for stage, stage_time in item.timings.items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + stage_time
+    report = {
+        "inputs": len(items),
+        **counts,
+        "wall_seconds": seconds,
+        "stage_seconds": stage_seconds,
+        "items": [asdict(item) for item in items],
+    }
+    path.write_text(json.dumps(report, indent=2))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reconstructs splats from local videos and ZIP archives, without the API."
+    )
+    parser.add_argument(
+        "inputs", nargs="*", type=Path, help="Input files or directories."
+    )
+    parser.add_argument(
+        "--manifest", type=Path, help="A file listing one input per line."
+    )
+    parser.add_argument(
+        "--preset", default=DEFAULT_PRUNE_PRESET, choices=sorted(PRUNE_PRESETS)
+    )
+    parser.add_argument("--report", type=Path, default=Path("batch_report.json"))
+    parser.add_argument(
+        "--force", action="store_true", help="Rerun inputs already done."
+    )
+    for stage, count in DEFAULT_STAGE_SLOTS.items():
+        parser.add_argument(
+            f"--{stage}-slots",
+            type=int,
+            default=count,
+            help=f"Inputs running the {stage} stage at once (default {count}).",
+        )
+    args = parser.parse_args()
+    if not args.inputs and args.manifest is None:
+        parser.error("give input paths or --manifest")
+
+    logging.basicConfig(level=logging.INFO)
+    fail_stale_meshes(SPLAT_STORAGE_DIR)
+    inputs = collect_inputs(args.inputs, args.manifest)
+    LOGGER.info("Processing %d inputs", len(inputs))
+    runner = BatchRunner(
+        SPLAT_STORAGE_DIR,
+        args.preset,
+        stage_slots={
+            stage: getattr(args, f"{stage}_slots") for stage in DEFAULT_STAGE_SLOTS
+        },
+        force=args.force,
+    )
+    start = time.monotonic()
+    items = runner.run(inputs)
+    report = write_report(args.report, items, time.monotonic() - start)
+    LOGGER.info(
+        "%d done, %d skipped, %d failed in %.0fs; report written to %s",
+        report["done"],
+        report["skipped"],
+        report["failed"],
+        report["wall_seconds"],
+        args.report,
+    )
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,241 @@
+import glob
 import logging
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from functools import reduce
 from pathlib import Path
-
-from src.utils import run_command
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 LOGGER = logging.getLogger(__name__)
 
+TOTAL_STEPS = 30000
+SH_DEGREE = 2
+# Steps at which a checkpoint PLY is exported for previews; the last one is the
+# final splat.
+CHECKPOINT_STEPS = [
+    int(step)
+    for step in os.getenv("BRUSH_CHECKPOINT_STEPS", "2000,7000,15000,30000").split(",")
+]
+CHECKPOINT_POLL_SECONDS = 2.0
+# Upper bound on the full PLYs brush writes during a run, checkpoints included.
+MAX_EXPORTS = int(os.getenv("BRUSH_MAX_EXPORTS", 10))
+
+
+def checkpoint_path(output_dir: Path, filename: str, step: int) -> Path:
+    return output_dir / f"{filename}.step_{step}.ply"
+
+
+def _export_schedule(
+    checkpoint_steps: Sequence[int], total_steps: int
+) -> Tuple[int, List[int]]:
+    """Picks brush's export interval and the checkpoints it lands on.
+
+    brush exports at a fixed interval, so the interval must divide every
+    checkpoint; the exports in between are dropped. When their greatest common
+    divisor would export more than `MAX_EXPORTS` times, a coarser interval that
+    still divides `total_steps` is used and each checkpoint moves to the first
+    export at or after it.
+
+    Returns:
+        The export interval and the checkpoint steps, ending with `total_steps`.
+    """
+    divisor = reduce(math.gcd, checkpoint_steps)
+    every = divisor
+    # total_steps is a checkpoint, so every == total_steps always ends the loop
+    while total_steps // every > MAX_EXPORTS or total_steps % every:
+        every += divisor
+    snapped = sorted({math.ceil(step / every) * every for step in checkpoint_steps})
+    if snapped != list(checkpoint_steps):
+        LOGGER.info(
+            "Exporting every %d steps, checkpoints moved from %s to %s",
+            every,
+            list(checkpoint_steps),
+            snapped,
+        )
+    return every, snapped
+
+
+def run_brush(
+    colmap_dir: Path,
+    output_dir: Path,
+    filename: str,
+    on_progress: Optional[Callable[[float, str], None]] = None,
+    on_checkpoint: Optional[Callable[[int, Path], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    checkpoint_steps: Sequence[int] = CHECKPOINT_STEPS,
+    total_steps: int = TOTAL_STEPS,
+    sh_degree: int = SH_DEGREE,
+) -> int:
+    """Trains a splat with brush on a COLMAP reconstruction.
+
+    The splat is exported at every checkpoint step, which may move to keep the
+    exports under `MAX_EXPORTS`, see `_export_schedule`. Each complete checkpoint
+    but the last is passed to `on_checkpoint` as a hard link, or copy, which the
+    callback owns from then on. The exports themselves are kept until brush
+    exits, when the latest complete one becomes `<output_dir>/<filename>.ply`,
+    also if training was stopped early, and the others are removed.
+
+    Args:
+        colmap_dir: The COLMAP dataset.
+        output_dir: Where the PLYs are exported.
+        filename: Name of the exported PLY, without extension.
+        on_progress: Called with the percentage of training steps done.
+        on_checkpoint: Called with the step and path of each checkpoint PLY.
+        should_stop: Polled during training; brush is stopped once it returns True.
+        checkpoint_steps: Steps at which to export checkpoints.
+        total_steps: Number of training steps.
+        sh_degree: Degree of the spherical harmonics trained per splat.
+
+    Returns:
+        The step of the final splat.
+    """
+    checkpoint_steps = sorted(set(checkpoint_steps) | {total_steps})
+    checkpoint_steps = [step for step in checkpoint_steps if 0 < step <= total_steps]
+    export_every, checkpoint_steps = _export_schedule(checkpoint_steps, total_steps)
+    cmd = [
+        "brush_app",
+        "--sh-degree",
+        str(sh_degree),
+        str(colmap_dir),
+        "--export-path",
+        str(output_dir),
+        "--export-name",
+        f"{filename}.step_{{iter}}.ply",
+        "--total-steps",
+        str(total_steps),
+        "--export-every",
+        str(export_every),
+    ]
+    LOGGER.info("Running brush with command: %s", " ".join(cmd))
+
+    # no shell, so terminate() reaches brush itself
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,  # universal newlines: "\r" ends a line too
+        errors="replace",
+    )
+    reader = threading.Thread(
+        target=_read_output,
+        args=(process, total_steps, on_progress),
+        name="brush-output",
+        daemon=True,
+    )
+    reader.start()
+
+    complete: List[int] = []
+    sizes: Dict[Path, int] = {}
+    stopped = False
+    while process.poll() is None:
+        time.sleep(CHECKPOINT_POLL_SECONDS)
+        _collect_checkpoints(
+            output_dir, filename, checkpoint_steps, complete, sizes, on_checkpoint
+        )
+        if not stopped and should_stop is not None and should_stop():
+            LOGGER.info("Stopping brush early after step %s", max(complete, default=0))
+            stopped = True
+            process.terminate()
+    reader.join()
+    if process.returncode != 0 and not stopped:
+        LOGGER.error("brush exited with %s", process.returncode)
+
+    exports = _list_exports(output_dir, filename)
+    if stopped:
+        # brush may have been killed while writing an export
+        exports = [(step, path) for step, path in exports if step in complete]
+    if not exports:
+        raise RuntimeError("brush did not export any splat")
+    final_step, final_path = exports[-1]
+    os.replace(final_path, output_dir / f"{filename}.ply")
+    for _, path in _list_exports(output_dir, filename):
+        path.unlink(missing_ok=True)
+    return final_step
+
+
+def handover_path(output_dir: Path, filename: str, step: int) -> Path:
+    return output_dir / f"{filename}.checkpoint_{step}.ply"
+
+
+def remove_checkpoints(output_dir: Path, filename: str):
+    """Removes the exports and any checkpoints handed over but never used."""
+    for _, path in _list_exports(output_dir, filename):
+        path.unlink(missing_ok=True)
+    for path in output_dir.glob(f"{glob.escape(filename)}.checkpoint_*.ply"):
+        path.unlink(missing_ok=True)
+
+
+def _hand_over(path: Path, handover: Path):
+    handover.unlink(missing_ok=True)
+    try:
+        os.link(path, handover)
+    except OSError:
+        shutil.copyfile(path, handover)
+
+
+def _list_exports(output_dir: Path, filename: str) -> List[Tuple[int, Path]]:
+    pattern = re.compile(rf"{re.escape(filename)}\.step_(\d+)\.ply")
+    return sorted(
+        (int(match[1]), output_dir / name)
+        for name in os.listdir(output_dir)
+        if (match := pattern.fullmatch(name))
+    )
+
+
+def _read_output(
+    process: subprocess.Popen,
+    total_steps: int,
+    on_progress: Optional[Callable[[float, str], None]],
+):
+    # brush's progress output shows "<step>/<total>"; match it against the known total
+    step_pattern = re.compile(rf"\b(\d+)\s*/\s*{total_steps}\b")
+    for line in process.stdout:
+        sys.stdout.write(line)
+        match = step_pattern.search(line)
+        if match is not None and on_progress is not None:
+            step = int(match[1])
+            try:
+                on_progress(100.0 * step / total_steps, f"step {step}/{total_steps}")
+            except Exception:
+                LOGGER.exception("Progress callback failed")
+
+
+def _collect_checkpoints(
+    output_dir: Path,
+    filename: str,
+    checkpoint_steps: Sequence[int],
+    complete: List[int],
+    sizes: Dict[Path, int],
+    on_checkpoint: Optional[Callable[[int, Path], None]],
+):
+    """Records complete exports, hands over checkpoints and drops the exports
+    in between, keeping the latest one in case training is stopped.
 
-def run_brush(colmap_dir: Path, output_dir: Path, filename: str):
-    cmd = "brush_app --sh-degree 2 " f"{colmap_dir} --export-path {output_dir} --export-name {filename}.ply " "--export-every 30000"
-    LOGGER.info("Running brush with command: %s", cmd)
-    run_command(cmd, verbose=True)
+    An export counts as complete once a later one exists or its size did not
+    change since the previous poll.
+    """
+    exports = _list_exports(output_dir, filename)
+    for i, (step, path) in enumerate(exports):
+        latest = i + 1 == len(exports)
+        if step not in complete:
+            if latest:
+                size = path.stat().st_size
+                if sizes.get(path) != size:
+                    sizes[path] = size
+                    continue
+            complete.append(step)
+            if step in checkpoint_steps[:-1] and on_checkpoint is not None:
+                try:
+                    handover = handover_path(output_dir, filename, step)
+                    _hand_over(path, handover)
+                    on_checkpoint(step, handover)
+                except Exception:
+                    LOGGER.exception("Checkpoint callback failed for step %d", step)
+        if step not in checkpoint_steps and not latest:
+            path.unlink(missing_ok=True)
@@ -1,13 +1,63 @@
 import logging
 import os
+import re
 import subprocess
 from pathlib import Path
-from typing import Literal, Optional
+from typing import Callable, Iterable, Literal, Optional, Tuple
 
 from src.utils import run_command
 
 LOGGER = logging.getLogger(__name__)
 
+# Called with the estimated percentage of the whole COLMAP run and the current step.
+ProgressCallback = Callable[[float, str], None]
+
+# Rough share of COLMAP's run time taken by each step.
+STEP_PERCENT_SPANS = {
+    "feature_extraction": (0.0, 30.0),
+    "matching": (30.0, 60.0),
+    "mapping": (60.0, 95.0),
+    "bundle_adjustment": (95.0, 100.0),
+}
+STEP_PROGRESS_PATTERNS = {
+    "feature_extraction": re.compile(r"Processed file \[(\d+)/(\d+)\]"),
+    # "Matching image [i/N]" (vocab tree, sequential) or "Matching block [i/N, j/N]"
+    "matching": re.compile(r"Matching \w+ \[(\d+)/(\d+)"),
+    "mapping": re.compile(r"Registering image #\d+ \((\d+)\)"),
+}
+
+
+def is_single_camera(sizes: Iterable[Tuple[int, int]]) -> bool:
+    """Tells whether images of these (width, height) sizes may share one camera.
+
+    COLMAP's `--ImageReader.single_camera 1` gives every image the intrinsics of
+    the first, which only holds when they all have its resolution.
+    """
+    return len(set(sizes)) <= 1
+
+
+def _step_progress(
+    step: str, num_images: int, on_progress: Optional[ProgressCallback]
+) -> Optional[Callable[[str], None]]:
+    """Returns an output callback that turns a step's log lines into progress."""
+    if on_progress is None:
+        return None
+    start, end = STEP_PERCENT_SPANS[step]
+    pattern = STEP_PROGRESS_PATTERNS.get(step)
+    on_progress(start, step)
+
+    def on_output(line: str):
+        match = pattern.search(line) if pattern is not None else None
+        if match is None:
+            return
+        done = int(match[1])
+        # the mapper only logs how many images are registered so far
+        total = int(match[2]) if match.lastindex == 2 else num_images
+        if total > 0:
+            on_progress(start + (end - start) * min(done / total, 1.0), step)
+
+    return on_output
+
 
 def _run_colmap(
     image_dir: Path,
@@ -19,6 +69,9 @@ def _run_colmap(
     matching_method: Literal["vocab_tree", "exhaustive", "sequential"] = "vocab_tree",
     refine_intrinsics: bool = True,
     colmap_cmd: str = "colmap",
+    on_progress: Optional[ProgressCallback] = None,
+    single_camera: bool = True,
+    mask_dir: Optional[Path] = None,
 ) -> None:
     """Runs COLMAP on the images.
 
@@ -32,7 +85,11 @@ def _run_colmap(
         matching_method: Matching method to use.
         refine_intrinsics: If True, refine intrinsics.
         colmap_cmd: Path to the COLMAP executable.
+        on_progress: Called with the estimated percentage done and the current step.
+        single_camera: If True, all images share one camera, else each has its own.
+        mask_dir: Directory of per-image masks, named `<image name>.png`.
     """
+    num_images = len(os.listdir(image_dir))
 
     colmap_database_path = colmap_dir / "database.db"
     colmap_database_path.unlink(missing_ok=True)
@@ -42,7 +99,7 @@ def _run_colmap(
         f"{colmap_cmd} feature_extractor",
         f"--database_path {colmap_dir / 'database.db'}",
         f"--image_path {image_dir}",
-        "--ImageReader.single_camera 1",
+        f"--ImageReader.single_camera {int(single_camera)}",
         f"--ImageReader.camera_model {camera_model}",
         f"--SiftExtraction.use_gpu {int(gpu)}",
     ]
@@ -50,9 +107,15 @@ def _run_colmap(
         feature_extractor_cmd.append(
             f"--ImageReader.camera_mask_path {camera_mask_path}"
         )
+    if mask_dir is not None:
+        feature_extractor_cmd.append(f"--ImageReader.mask_path {mask_dir}")
     feature_extractor_cmd = " ".join(feature_extractor_cmd)
 
-    run_command(feature_extractor_cmd, verbose=verbose)
+    run_command(
+        feature_extractor_cmd,
+        verbose=verbose,
+        on_output=_step_progress("feature_extraction", num_images, on_progress),
+    )
 
     LOGGER.info("Done extracting COLMAP features.")
 
@@ -68,7 +131,11 @@ def _run_colmap(
             f'--VocabTreeMatching.vocab_tree_path "{vocab_tree_path}"'
         )
     feature_matcher_cmd = " ".join(feature_matcher_cmd)
-    run_command(feature_matcher_cmd, verbose=verbose)
+    run_command(
+        feature_matcher_cmd,
+        verbose=verbose,
+        on_output=_step_progress("matching", num_images, on_progress),
+    )
     LOGGER.info("Done matching COLMAP features.")
 
     # Bundle adjustment
@@ -85,7 +152,11 @@ def _run_colmap(
     mapper_cmd = " ".join(mapper_cmd)
 
     LOGGER.info("Running COLMAP bundle adjustment...")
-    run_command(mapper_cmd, verbose=verbose)
+    run_command(
+        mapper_cmd,
+        verbose=verbose,
+        on_output=_step_progress("mapping", num_images, on_progress),
+    )
     LOGGER.info("Done COLMAP bundle adjustment.")
 
     if refine_intrinsics:
@@ -95,14 +166,31 @@ def _run_colmap(
             f"--output_path {sparse_dir}/0",
             "--BundleAdjustment.refine_principal_point 1",
         ]
-        run_command(" ".join(bundle_adjuster_cmd), verbose=verbose)
+        run_command(
+            " ".join(bundle_adjuster_cmd),
+            verbose=verbose,
+            on_output=_step_progress("bundle_adjustment", num_images, on_progress),
+        )
         LOGGER.info("Done refining intrinsics.")
 
 
-def run_colmap(images_dir: Path, colmap_dir: Path, mask_path: Optional[Path] = None):
+def run_colmap(
+    images_dir: Path,
+    colmap_dir: Path,
+    mask_path: Optional[Path] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    single_camera: bool = True,
+    mask_dir: Optional[Path] = None,
+):
     """
     Args:
         mask_path: Path to the camera mask. Defaults to None.
+        on_progress: Called with the estimated percentage done and the current step.
+        single_camera: If False, COLMAP estimates a camera per image, for images
+            of differing resolutions. Defaults to True.
+        mask_dir: Directory of per-image masks, `<mask_dir>/<image name>.png`,
+            black where features are ignored. Images without one are used
+            whole. Defaults to None.
     """
 
     matching_method = "vocab_tree"  # got from nerfstudio
@@ -117,4 +205,7 @@ def run_colmap(images_dir: Path, colmap_dir: Path, mask_path: Optional[Path] = N
         matching_method=matching_method,
         refine_intrinsics=True,
         colmap_cmd="colmap",
+        on_progress=on_progress,
+        single_camera=single_camera,
+        mask_dir=mask_dir,
     )
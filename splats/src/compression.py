@@ -0,0 +1,83 @@
+import gzip
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from src.serving import PRECOMPRESSED_SUFFIXES
+
+try:
+    import brotli
+except ImportError:  # optional, variant is skipped
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, variant is skipped
+    zstandard = None
+
+LOGGER = logging.getLogger(__name__)
+
+# Variants are written once per splat, so favour ratio over speed.
+BROTLI_QUALITY = 9
+ZSTD_LEVEL = 19
+GZIP_LEVEL = 9
+# Variants that don't save at least 5% are not worth a Content-Encoding.
+MAX_COMPRESSION_RATIO = 0.95
+
+
+def _compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=BROTLI_QUALITY, lgwin=24)
+
+
+def _compress_zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _compress_gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+COMPRESSORS: Dict[str, Optional[Callable[[bytes], bytes]]] = {
+    "br": _compress_brotli if brotli is not None else None,
+    "zstd": _compress_zstd if zstandard is not None else None,
+    "gzip": _compress_gzip,
+}
+
+
+def write_precompressed_variants(path: Path) -> Dict[str, int]:
+    """Writes `.br`, `.zst` and `.gz` siblings of a file for Content-Encoding negotiation.
+
+    Variants are written atomically so the download endpoints never see a partial
+    file. Stale variants from a previous version of the file are removed when the
+    new one does not compress well enough or its compressor is not installed.
+
+    Args:
+        path: Path of the file to compress, e.g. `<uuid>.ksplat`.
+
+    Returns:
+        The size in bytes of each variant written, keyed by content coding.
+    """
+    data = path.read_bytes()
+    sizes = {}
+    for coding, compress in COMPRESSORS.items():
+        variant_path = path.with_name(path.name + PRECOMPRESSED_SUFFIXES[coding])
+        if compress is None:
+            LOGGER.info("No %s compressor installed, skipping %s", coding, variant_path)
+            variant_path.unlink(missing_ok=True)
+            continue
+
+        compressed = compress(data)
+        if len(compressed) > len(data) * MAX_COMPRESSION_RATIO:
+            variant_path.unlink(missing_ok=True)
+            continue
+
+        tmp_path = variant_path.with_name(variant_path.name + ".tmp")
+        tmp_path.write_bytes(compressed)
+        os.replace(tmp_path, variant_path)
+        sizes[coding] = len(compressed)
+
+    LOGGER.info(
+        "Wrote precompressed variants of %s (%d bytes): %s", path, len(data), sizes
+    )
+    return sizes
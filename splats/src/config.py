@@ -0,0 +1,20 @@
+import os
+from pathlib import Path
+
+# read from env (with fallback)
+SPLAT_STORAGE_DIR = Path(os.getenv("SPLAT_STORAGE_DIR", "splat_storage"))
+SPLAT_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+UPLOADS_DIR = SPLAT_STORAGE_DIR / "uploads"
+UPLOADS_DIR.mkdir(exist_ok=True)
+
+# The job queue and the stage timings are shared by the API and every worker.
+# The queue uses WAL on a local disk, so the API and the workers must then run on
+# that host. For workers on other nodes, SPLAT_JOB_DB must be on a network
+# filesystem whose locks work across hosts (e.g. NFSv4); it then uses a rollback
+# journal. See src.database.
+JOB_DB_PATH = Path(os.getenv("SPLAT_JOB_DB", SPLAT_STORAGE_DIR / "jobs.sqlite3"))
+STAGE_TIMINGS_PATH = SPLAT_STORAGE_DIR / "stage_timings.jsonl"
+
+# Workers the API process runs itself, for single-box deployments. Set to 0 when
+# jobs are processed by `python -m src.worker` on dedicated nodes.
+EMBEDDED_WORKERS = int(os.getenv("SPLAT_EMBEDDED_WORKERS", 1))
@@ -0,0 +1,106 @@
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+# SQLite's WAL mode shares memory between the processes using a database, which
+# only works on one host: on these filesystems a rollback journal is used
+# instead, relying on the filesystem's byte-range locks.
+NETWORK_FILESYSTEMS = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "9p",
+    "ceph",
+    "glusterfs",
+    "lustre",
+    "fuse.sshfs",
+    "fuse.glusterfs",
+    "fuse.cephfs",
+}
+# Overrides the journal mode chosen from the database's filesystem, e.g. WAL or DELETE.
+JOURNAL_MODE = os.getenv("SPLAT_JOB_DB_JOURNAL_MODE")
+MOUNTS_PATH = Path("/proc/mounts")
+
+
+def filesystem_type(path: Path) -> Optional[str]:
+    """Returns the type of the filesystem `path` is on, or None if unknown."""
+    try:
+        mounts = MOUNTS_PATH.read_text().splitlines()
+    except OSError:
+        return None
+    path = path.resolve()
+    best, best_type = None, None
+    for line in mounts:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # spaces and other special characters in mount points are octal escaped
+        mount_point = Path(fields[1].encode().decode("unicode_escape"))
+        if (path == mount_point or mount_point in path.parents) and (
+            best is None or len(mount_point.parts) >= len(best.parts)
+        ):
+            best, best_type = mount_point, fields[2]
+    return best_type
+
+
+def journal_mode(db_path: Path) -> str:
+    """Picks WAL for a database on a local disk and DELETE on a network filesystem."""
+    if JOURNAL_MODE:
+        return JOURNAL_MODE.upper()
+    fs_type = filesystem_type(db_path.parent)
+    if fs_type in NETWORK_FILESYSTEMS:
+        LOGGER.warning(
+            "%s is on %s, using a rollback journal. Its locks must work across hosts;"
+            " otherwise run the API and the workers on one host, or set SPLAT_JOB_DB"
+            " to a path on a local disk.",
+            db_path,
+            fs_type,
+        )
+        return "DELETE"
+    return "WAL"
+
+
+class Database:
+    """A SQLite database file, created with its schema on first use.
+
+    Nothing is written to disk until the first connection, so the stores can be
+    set up at import time.
+    """
+
+    def __init__(self, db_path: Path, schema: str):
+        self.db_path = db_path
+        self.schema = schema
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._ready:
+            self._initialize()
+        db = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _initialize(self):
+        with self._lock:
+            if self._ready:
+                return
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            try:
+                db.execute(f"PRAGMA journal_mode={journal_mode(self.db_path)}")
+                db.executescript(self.schema)
+            finally:
+                db.close()
+            self._ready = True
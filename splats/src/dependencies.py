@@ -1,9 +1,14 @@
+import json
 import logging
 import mimetypes
 import os
-from typing import Dict
+import tempfile
+import zipfile
+from typing import Annotated, Dict, Optional
 
-from fastapi import HTTPException, status, UploadFile
+from fastapi import Header, HTTPException, Request, status, UploadFile
+
+from src.utils import run_command
 
 LOGGER = logging.getLogger(__name__)
 
@@ -31,25 +36,32 @@ ALLOWED_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp"}
 MAX_IMAGE_SIZE_BYTES = 50 * 1024 * 1024
 
 
-def validate_upload_file(file: UploadFile) -> UploadFile:
+def validate_video_metadata(
+    filename: str, content_type: Optional[str], size: Optional[int]
+):
+    """Checks a video's declared content type, extension and size.
+
+    Raises:
+        HTTPException: 400 listing every violation in the X-Error-Detail header.
+    """
     errors: Dict[str, str] = {}
 
-    if file.content_type not in VIDEO_MIMETYPES:
-        errors["content_type"] = f"Expected video file, got {file.content_type}"
+    if content_type not in VIDEO_MIMETYPES:
+        errors["content_type"] = f"Expected video file, got {content_type}"
 
-    mimetype, _ = mimetypes.guess_type(file.filename)
-    if file.content_type != mimetype:
+    mimetype, _ = mimetypes.guess_type(filename)
+    if content_type != mimetype:
         errors["content_type_mismatch"] = (
-            f"Header content type mismatch, expected {file.content_type}, got {mimetype}"
+            f"Header content type mismatch, expected {content_type}, got {mimetype}"
         )
 
-    _, ext = os.path.splitext(file.filename)
+    _, ext = os.path.splitext(filename)
     if ext not in [".mp4", ".MP4", ".webm", ".MOV", ".mov", ".avi", ".flv", ".wmv"]:
         errors["extension"] = f"Unsupported video format: {ext}"
 
-    if file.size > MAX_VIDEO_SIZE_BYTES:
+    if size is not None and size > MAX_VIDEO_SIZE_BYTES:
         errors["size"] = (
-            f"File too large. Maximum size is {MAX_VIDEO_SIZE_BYTES} bytes. Got {file.size} bytes"
+            f"File too large. Maximum size is {MAX_VIDEO_SIZE_BYTES} bytes. Got {size} bytes"
         )
 
     if errors:
@@ -60,9 +72,21 @@ def validate_upload_file(file: UploadFile) -> UploadFile:
             headers={"X-Error-Detail": str(errors)},
         )
 
+
+def validate_upload_file(file: UploadFile) -> UploadFile:
+    validate_video_metadata(file.filename, file.content_type, file.size)
     return file
 
 
+def get_client_id(
+    request: Request, x_client_id: Annotated[Optional[str], Header()] = None
+) -> str:
+    """Identifies who submitted a job: the X-Client-Id header, else the client address."""
+    if x_client_id:
+        return x_client_id
+    return request.client.host if request.client else "anonymous"
+
+
 def validate_image_file(file: UploadFile) -> UploadFile:
     """
     Ensure an UploadFile is a supported image type, has a matching extension,
@@ -103,3 +127,193 @@ def validate_image_file(file: UploadFile) -> UploadFile:
 
     return file
 
+
+# Bytes at the start of an upload inspected before the rest of it is stored.
+SNIFF_BYTES = 4 * 1024 * 1024
+SUPPORTED_VIDEO_CODECS = {
+    "h264",
+    "hevc",
+    "vp8",
+    "vp9",
+    "av1",
+    "mpeg4",
+    "prores",
+    "mjpeg",
+}
+MAX_VIDEO_DURATION_SECONDS = float(os.getenv("MAX_VIDEO_DURATION_SECONDS", 30 * 60))
+# Budget for image archives, enforced from the ZIP central directory alone.
+MIN_ARCHIVE_IMAGES = 3
+MAX_ARCHIVE_IMAGES = 2000
+MAX_ARCHIVE_UNCOMPRESSED_BYTES = 20 * 1024 * 1024 * 1024
+MAX_COMPRESSION_RATIO = 100
+
+
+def sniff_container(head: bytes) -> Optional[str]:
+    """Identifies a media container from its magic bytes.
+
+    Returns:
+        "mp4" (incl. QuickTime), "matroska" (incl. WebM), "avi", "flv", "asf",
+        "zip", or None if unrecognised.
+    """
+    if head[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip"):
+        return "mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "matroska"
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return "avi"
+    if head.startswith(b"FLV"):
+        return "flv"
+    if head.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "asf"
+    if head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06"):
+        return "zip"
+    return None
+
+
+def probe_video(path) -> Optional[dict]:
+    """Runs ffprobe on a video file.
+
+    Returns:
+        The probed video stream (codec_name, width, height, nb_frames,
+        avg_frame_rate, duration) plus the container duration, or None if ffprobe
+        found no streams.
+    """
+    output = run_command(
+        "ffprobe -v error -show_entries "
+        "stream=codec_type,codec_name,width,height,nb_frames,avg_frame_rate,duration"
+        ":format=duration "
+        f'-of json "{path}"'
+    )
+    try:
+        probe = json.loads(output or "")
+    except json.JSONDecodeError:
+        return None
+    streams = probe.get("streams") or []
+    if not streams:
+        return None
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    return {**video, "format_duration": (probe.get("format") or {}).get("duration")}
+
+
+def probe_video_head(head: bytes, filename: str) -> Optional[dict]:
+    """Runs ffprobe on the first bytes of a video.
+
+    Returns:
+        The probe result, see `probe_video`, or None if the head alone is
+        inconclusive, e.g. an MP4 whose moov atom is at the end of the file.
+    """
+    _, ext = os.path.splitext(filename)
+    with tempfile.NamedTemporaryFile(suffix=ext) as f:
+        f.write(head)
+        f.flush()
+        return probe_video(f.name)
+
+
+def validate_video_head(head: bytes, filename: str) -> Optional[dict]:
+    """Rejects a video from its first few MB, before the rest of it is stored.
+
+    Checks the container magic bytes and, if ffprobe can read the header, the
+    codec, the frame count and the duration.
+
+    Returns:
+        The probe result, or None if the header alone was inconclusive.
+
+    Raises:
+        HTTPException: 400 listing every violation in the X-Error-Detail header.
+    """
+    errors: Dict[str, str] = {}
+    container = sniff_container(head)
+    probe = None
+    if container is None or container == "zip":
+        errors["container"] = f"Not a supported video container: {head[:12]!r}"
+    else:
+        probe = probe_video_head(head, filename)
+
+    if probe is not None:
+        if not probe.get("codec_name"):
+            errors["video_stream"] = "File has no video stream"
+        elif probe["codec_name"] not in SUPPORTED_VIDEO_CODECS:
+            errors["codec"] = f"Unsupported video codec: {probe['codec_name']}"
+        if str(probe.get("nb_frames")) == "0":
+            errors["frames"] = "Video stream has no frames"
+        duration = probe.get("duration") or probe.get("format_duration")
+        try:
+            if duration is not None and float(duration) > MAX_VIDEO_DURATION_SECONDS:
+                errors["duration"] = (
+                    f"Video too long. Maximum duration is {MAX_VIDEO_DURATION_SECONDS:.0f}s. "
+                    f"Got {float(duration):.0f}s"
+                )
+        except ValueError:
+            pass
+
+    if errors:
+        LOGGER.error(errors)
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid video file",
+            headers={"X-Error-Detail": str(errors)},
+        )
+    return probe
+
+
+def validate_zip_archive(archive) -> Dict[str, int]:
+    """Validates an image archive from its central directory, before extraction.
+
+    Args:
+        archive: Path or seekable file object of the ZIP archive.
+
+    Returns:
+        The number of images and their total uncompressed size.
+
+    Raises:
+        HTTPException: 400 listing every violation in the X-Error-Detail header.
+    """
+    try:
+        with zipfile.ZipFile(archive) as z:
+            members = [info for info in z.infolist() if not info.is_dir()]
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid or corrupted ZIP archive")
+
+    errors: Dict[str, str] = {}
+    images = [
+        info
+        for info in members
+        if os.path.splitext(info.filename)[1].lower() in ALLOWED_IMAGE_EXTS
+    ]
+    total_bytes = sum(info.file_size for info in images)
+    if not MIN_ARCHIVE_IMAGES <= len(images) <= MAX_ARCHIVE_IMAGES:
+        errors["image_count"] = (
+            f"Expected between {MIN_ARCHIVE_IMAGES} and {MAX_ARCHIVE_IMAGES} images, "
+            f"got {len(images)}"
+        )
+    if total_bytes > MAX_ARCHIVE_UNCOMPRESSED_BYTES:
+        errors["size"] = (
+            f"Archive too large. Maximum uncompressed size is "
+            f"{MAX_ARCHIVE_UNCOMPRESSED_BYTES} bytes. Got {total_bytes} bytes"
+        )
+    oversized = [
+        info.filename for info in images if info.file_size > MAX_IMAGE_SIZE_BYTES
+    ]
+    if oversized:
+        errors["image_size"] = (
+            f"{len(oversized)} images exceed {MAX_IMAGE_SIZE_BYTES} bytes, e.g. {oversized[0]}"
+        )
+    suspicious = [
+        info.filename
+        for info in members
+        if info.compress_size
+        and info.file_size / info.compress_size > MAX_COMPRESSION_RATIO
+    ]
+    if suspicious:
+        errors["compression_ratio"] = (
+            f"Suspicious compression ratio for {suspicious[0]}"
+        )
+
+    if errors:
+        LOGGER.error("Archive validation failed: %s", errors)
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid images archive",
+            headers={"X-Error-Detail": str(errors)},
+        )
+    return {"image_count": len(images), "uncompressed_bytes": total_bytes}
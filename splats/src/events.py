@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+EVENTS_FILENAME = "events.jsonl"
+# Progress events are dropped unless the percentage moved this much or this long
+# has passed, so chatty tools don't flood the log.
+PROGRESS_MIN_STEP_PERCENT = 1.0
+PROGRESS_MIN_INTERVAL_SECONDS = 5.0
+
+_write_lock = threading.Lock()
+
+
+def emit_event(job_dir: Path, event_type: str, **data) -> dict:
+    """Appends an event to the job's event log, one JSON object per line."""
+    event = {"type": event_type, "time": time.time(), **data}
+    line = (json.dumps(event) + "\n").encode()
+    with _write_lock:
+        # a single O_APPEND write, so concurrent writers never interleave
+        fd = os.open(
+            job_dir / EVENTS_FILENAME, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    return event
+
+
+def read_events(job_dir: Path, offset: int = 0) -> List[Tuple[int, dict]]:
+    """Reads the complete events written after byte `offset` of the event log.
+
+    Returns:
+        Each event with the offset just past it, which resumes reading after it.
+    """
+    try:
+        with open(job_dir / EVENTS_FILENAME, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    events = []
+    # a partially written last line is left for the next read
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        offset += len(line)
+        try:
+            events.append((offset, json.loads(line)))
+        except json.JSONDecodeError:
+            LOGGER.warning("Skipping corrupt event in %s", job_dir / EVENTS_FILENAME)
+    return events
+
+
+class JobEvents:
+    """Reports stage changes and throttled progress of one job."""
+
+    def __init__(self, job_dir: Path):
+        self.job_dir = job_dir
+        self._last_progress: Dict[str, Tuple[float, float]] = {}
+
+    def emit(self, event_type: str, **data):
+        emit_event(self.job_dir, event_type, **data)
+
+    def stage(self, stage: str, state: str, **data):
+        """Records that a stage "started" or "finished"."""
+        emit_event(self.job_dir, "stage", stage=stage, state=state, **data)
+
+    def progress(self, stage: str, percent: float, detail: Optional[str] = None):
+        """Records the estimated completion of a stage, from 0 to 100."""
+        percent = round(min(max(percent, 0.0), 100.0), 1)
+        now = time.monotonic()
+        last_percent, last_time = self._last_progress.get(stage, (-100.0, 0.0))
+        if (
+            percent - last_percent < PROGRESS_MIN_STEP_PERCENT
+            and now - last_time < PROGRESS_MIN_INTERVAL_SECONDS
+        ):
+            return
+        self._last_progress[stage] = (percent, now)
+        emit_event(
+            self.job_dir, "progress", stage=stage, percent=percent, detail=detail
+        )
+
+    def stage_progress(self, stage: str):
+        """Returns a `(percent, detail)` callback for the tools run in `stage`."""
+        return lambda percent, detail=None: self.progress(stage, percent, detail)
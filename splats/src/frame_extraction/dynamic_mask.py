@@ -0,0 +1,250 @@
+import logging
+import os
+import shutil
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+# Masking moving objects out of the frames of a video is optional, and gives up,
+# keeping the masks written so far, once it has run this long. The masks only
+# keep moving objects out of COLMAP's features and matches; brush still trains on
+# the whole frames, so what moved can still leave floaters in the splat.
+DYNAMIC_MASKS_ENABLED = os.getenv("SPLAT_DYNAMIC_MASKS", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+DYNAMIC_MASK_SECONDS = float(os.getenv("SPLAT_DYNAMIC_MASK_SECONDS", 120))
+# Per-image masks go to `<colmap_dir>/<DYNAMIC_MASK_DIRNAME>/<image name>.png`,
+# as COLMAP's `--ImageReader.mask_path` expects.
+DYNAMIC_MASK_DIRNAME = "dynamic_masks"
+# Frames are compared in grey at this long edge.
+ANALYSIS_EDGE = 320
+# Frames, each included, whose per-pixel median is a frame's background.
+BACKGROUND_WINDOW = 7
+# Frames whose backgrounds are computed in one NumPy batch.
+BATCH_SIZE = 32
+# Grey level difference from the background counted as motion.
+DIFF_THRESHOLD = 25
+# Pixels, at the analysis scale, grown around the motion found.
+DILATE_PIXELS = 4
+# Less motion than this is noise. More than the maximum means the background
+# model failed for the frame (parallax, a fast turn), so it is left unmasked.
+MIN_MASKED_RATIO = 0.002
+MAX_MASKED_RATIO = 0.35
+
+
+@dataclass
+class DynamicMaskReport:
+    frames: int = 0
+    masked_frames: int = 0
+    # frames whose motion exceeded MAX_MASKED_RATIO
+    rejected_frames: int = 0
+    mean_masked_ratio: float = 0.0
+    max_masked_ratio: float = 0.0
+    seconds: float = 0.0
+    timed_out: bool = False
+    skipped: Optional[str] = None
+    # masked pixel ratio of every masked frame
+    ratios: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def mask_filename(image_name: str) -> str:
+    return f"{image_name}.png"
+
+
+def _reduced_read_flag(cv2, long_edge: int) -> int:
+    # JPEGs decode straight to a fraction of their size, much faster than in full
+    for factor, flag in (
+        (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+        (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+        (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    ):
+        if long_edge // factor >= ANALYSIS_EDGE:
+            return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def load_frames(
+    image_paths: List[Path], deadline: float
+) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+    """Reads the frames in grey at the analysis size, blurred against noise.
+
+    Returns:
+        The (N, h, w) frames and the full (width, height), or None if the frames
+        differ in size or the deadline passed.
+    """
+    import cv2  # loaded in the stage processes only
+
+    first = cv2.imread(str(image_paths[0]), cv2.IMREAD_GRAYSCALE)
+    height, width = first.shape
+    scale = min(ANALYSIS_EDGE / max(height, width), 1.0)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    flag = _reduced_read_flag(cv2, max(height, width))
+    frames = np.empty((len(image_paths), size[1], size[0]), dtype=np.uint8)
+    reduced_shape = None
+    for i, path in enumerate(image_paths):
+        if time.monotonic() > deadline:
+            return None
+        frame = cv2.imread(str(path), flag)
+        if frame is None or reduced_shape not in (None, frame.shape):
+            return None
+        reduced_shape = frame.shape
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        frames[i] = cv2.GaussianBlur(frame, (5, 5), 0)
+    return frames, (width, height)
+
+
+def frame_offsets(frames: np.ndarray) -> np.ndarray:
+    """Estimates each frame's translation from the first, chaining the phase
+    correlation of consecutive frames.
+
+    Returns:
+        (N, 2) x and y offsets, in analysis pixels.
+    """
+    import cv2
+
+    window = cv2.createHanningWindow(frames.shape[2:0:-1], cv2.CV_32F)
+    offsets = np.zeros((len(frames), 2))
+    previous = frames[0].astype(np.float32)
+    for i in range(1, len(frames)):
+        current = frames[i].astype(np.float32)
+        (dx, dy), _ = cv2.phaseCorrelate(previous, current, window)
+        offsets[i] = offsets[i - 1] + (dx, dy)
+        previous = current
+    return offsets
+
+
+def _shifted(cv2, frame: np.ndarray, shift: np.ndarray) -> np.ndarray:
+    matrix = np.float32([[1, 0, shift[0]], [0, 1, shift[1]]])
+    return cv2.warpAffine(
+        frame,
+        matrix,
+        frame.shape[::-1],
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def motion_masks(frames: np.ndarray, offsets: np.ndarray, refs: range) -> np.ndarray:
+    """Finds the pixels of frames `refs` that differ from their background.
+
+    The background of a frame is the per-pixel median of the `BACKGROUND_WINDOW`
+    frames around it, shifted onto it, so anything crossing the scene in fewer
+    than half of them stands out.
+
+    Returns:
+        (len(refs), h, w) booleans, True where something moved.
+    """
+    import cv2
+
+    count, window = len(frames), min(BACKGROUND_WINDOW, len(frames))
+    stack = np.empty((len(refs), window) + frames.shape[1:], dtype=np.uint8)
+    for b, i in enumerate(refs):
+        first = min(max(i - window // 2, 0), count - window)
+        for k, j in enumerate(range(first, first + window)):
+            stack[b, k] = (
+                frames[j]
+                if j == i
+                else _shifted(cv2, frames[j], offsets[i] - offsets[j])
+            )
+    background = np.median(stack, axis=1)
+    return np.abs(frames[refs.start : refs.stop] - background) > DIFF_THRESHOLD
+
+
+def _clean(cv2, moving: np.ndarray) -> np.ndarray:
+    mask = moving.astype(np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    kernel = cv2.getStructuringElement(
+        cv2.MORPH_ELLIPSE, (2 * DILATE_PIXELS + 1, 2 * DILATE_PIXELS + 1)
+    )
+    return cv2.dilate(mask, kernel)
+
+
+def compute_dynamic_masks(
+    images_dir: Path,
+    mask_dir: Path,
+    camera_mask_path: Optional[Path] = None,
+    time_budget: float = DYNAMIC_MASK_SECONDS,
+) -> DynamicMaskReport:
+    """Masks what moves across the frames out of feature extraction.
+
+    Writes a mask per frame with motion into `mask_dir`, black where something
+    moved and white elsewhere. Frames without a mask are used whole by COLMAP,
+    so stopping at the time budget only leaves later frames unmasked.
+
+    Args:
+        images_dir: The frames, in capture order by name.
+        mask_dir: Where the masks are written; emptied first.
+        camera_mask_path: A mask shared by every frame, combined into theirs.
+        time_budget: Seconds after which no more frames are masked.
+    """
+    import cv2
+
+    start = time.monotonic()
+    deadline = start + time_budget
+    shutil.rmtree(mask_dir, ignore_errors=True)
+    image_paths = sorted(p for p in images_dir.iterdir() if p.is_file())
+    report = DynamicMaskReport(frames=len(image_paths))
+    if len(image_paths) < BACKGROUND_WINDOW:
+        report.skipped = "too few frames"
+        return report
+
+    loaded = load_frames(image_paths, deadline)
+    if loaded is None:
+        report.timed_out = time.monotonic() > deadline
+        report.skipped = "timed out" if report.timed_out else "frames differ in size"
+        return report
+    frames, full_size = loaded
+    offsets = frame_offsets(frames)
+    camera_mask = None
+    if camera_mask_path is not None:
+        camera_mask = cv2.imread(str(camera_mask_path), cv2.IMREAD_GRAYSCALE)
+
+    mask_dir.mkdir(parents=True, exist_ok=True)
+    ratios: List[float] = []
+    for batch_start in range(0, len(frames), BATCH_SIZE):
+        if time.monotonic() > deadline:
+            report.timed_out = True
+            break
+        refs = range(batch_start, min(batch_start + BATCH_SIZE, len(frames)))
+        for i, moving in zip(refs, motion_masks(frames, offsets, refs)):
+            moving = _clean(cv2, moving)
+            ratio = float(moving.mean())
+            ratios.append(ratio)
+            if ratio > MAX_MASKED_RATIO:
+                report.rejected_frames += 1
+                continue
+            if ratio < MIN_MASKED_RATIO:
+                continue
+            mask = cv2.resize(
+                (1 - moving) * 255, full_size, interpolation=cv2.INTER_NEAREST
+            )
+            if camera_mask is not None:
+                mask = np.minimum(mask, camera_mask)
+            name = image_paths[i].name
+            cv2.imwrite(str(mask_dir / mask_filename(name)), mask)
+            report.masked_frames += 1
+            report.ratios[name] = round(ratio, 4)
+
+    if ratios:
+        report.mean_masked_ratio = float(np.mean(ratios))
+        report.max_masked_ratio = float(np.max(ratios))
+    report.seconds = time.monotonic() - start
+    LOGGER.info(
+        "Masked motion in %d of %d frames (%d rejected) in %.1fs%s",
+        report.masked_frames,
+        report.frames,
+        report.rejected_frames,
+        report.seconds,
+        ", timed out" if report.timed_out else "",
+    )
+    return report
@@ -4,19 +4,21 @@ import os
 import re
 import shutil
 from pathlib import Path
+from typing import Callable, Optional
 
-import cv2
-
-from src.frame_extraction.ImageSelector import ImageSelector
-from src.frame_extraction.mask import save_mask
 from src.utils import run_command
 
 LOGGER = logging.getLogger(__name__)
 
+NUM_FRAMES_TARGET = 300  # supposedly a good target num of frames
+FFMPEG_FRAME_PATTERN = re.compile(r"frame=\s*(\d+)")
+
 
 def extract_frames(
     video_path: os.PathLike, output_dir: os.PathLike, interval: int = 60
 ):
+    import cv2
+
     os.makedirs(output_dir, exist_ok=True)
     cap = cv2.VideoCapture(str(video_path))
     frame_idx = 0
@@ -56,15 +58,19 @@ def get_num_frames_in_video(video: Path) -> int:
     return int(number_match[0])
 
 
-def extract_frames_ffmpeg(video_path: Path, output_dir: Path) -> Path | None:
+def extract_frames_ffmpeg(
+    video_path: Path,
+    output_dir: Path,
+    on_progress: Optional[Callable[[float, str], None]] = None,
+) -> Path | None:
     num_frames = get_num_frames_in_video(video_path)
     if num_frames == 0:
         LOGGER.error(f"Video has no frames: {video_path}")
     LOGGER.info("Number of frames in video:", num_frames)
 
-    num_frames_target = 300  # supposedly a good target num of frames
+    num_frames_target = NUM_FRAMES_TARGET
 
-    num_downscales = 0 # 3
+    num_downscales = 0  # 3
     ffmpeg_cmd = f'ffmpeg -i "{video_path}"'
 
     crop_cmd = ""
@@ -117,7 +123,23 @@ def extract_frames_ffmpeg(video_path: Path, output_dir: Path) -> Path | None:
 
     ffmpeg_cmd += downscale_cmd
 
-    run_command(ffmpeg_cmd, verbose=True)
+    on_output = None
+    if on_progress is not None:
+        expected_frames = math.ceil(num_frames / spacing) if spacing > 1 else num_frames
+
+        def on_output(line: str):
+            match = FFMPEG_FRAME_PATTERN.search(line)
+            if match is not None and expected_frames > 0:
+                frames = int(match[1])
+                on_progress(
+                    min(100.0 * frames / expected_frames, 100.0),
+                    f"frame {frames}/{expected_frames}",
+                )
+
+    run_command(ffmpeg_cmd, verbose=True, on_output=on_output)
+
+    # cv2 is only loaded in the processes that run this stage
+    from src.frame_extraction.mask import save_mask
 
     percent_radius_crop: float = 1.0
 
@@ -144,6 +166,8 @@ def filter_images(
     """Filters images based on blurriness, exposure, and scene change.
 
     Sharpness selection based on Laplacian Variance."""
+    from src.frame_extraction.ImageSelector import ImageSelector
+
     images = [
         os.path.join(input_images_dir, img) for img in os.listdir(input_images_dir)
     ]
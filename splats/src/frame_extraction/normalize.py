@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.colmap.colmap import is_single_camera
+from src.dependencies import ALLOWED_IMAGE_EXTS
+
+LOGGER = logging.getLogger(__name__)
+
+# Longer image edges are downscaled to this many pixels; 0 keeps full resolution.
+MAX_IMAGE_EDGE = int(os.getenv("SPLAT_MAX_IMAGE_EDGE", 1600))
+# Every image is re-encoded to this training format.
+TRAINING_IMAGE_EXT = ".jpg"
+JPEG_QUALITY = 95
+MANIFEST_FILENAME = "images_manifest.json"
+# Images handed to a stage process at once; it reads the archive's central
+# directory once for them.
+NORMALIZE_CHUNK_SIZE = 8
+
+
+def normalized_name(index: int) -> str:
+    return f"image_{index:05d}{TRAINING_IMAGE_EXT}"
+
+
+def normalize_image(
+    archive: zipfile.ZipFile,
+    member: str,
+    output_path: Path,
+    max_edge: int = MAX_IMAGE_EDGE,
+) -> Optional[dict]:
+    """Decodes one archive member, upright per its EXIF orientation, downscales
+    it and writes it in the training format.
+
+    Returns:
+        Its original and written sizes and a hash of its bytes, or None if it
+        could not be decoded.
+    """
+    import cv2  # loaded in the stage processes only
+
+    data = archive.read(member)
+    # IMREAD_COLOR applies the EXIF orientation and drops alpha
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = max_edge / max(height, width) if max_edge > 0 else 1.0
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    if not cv2.imwrite(
+        str(output_path), image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    ):
+        raise OSError(f"Could not write {output_path}")
+    return {
+        "source_width": width,
+        "source_height": height,
+        "width": image.shape[1],
+        "height": image.shape[0],
+        "sha1": hashlib.sha1(data).hexdigest(),
+    }
+
+
+def normalize_members(
+    archive_path: Path, members: List[Tuple[str, Path]], max_edge: int = MAX_IMAGE_EDGE
+) -> List[Optional[dict]]:
+    """Normalizes the `(member, output_path)` pairs of one archive, opening it once."""
+    with zipfile.ZipFile(archive_path) as archive:
+        return [normalize_image(archive, *member, max_edge) for member in members]
+
+
+def _normalize_chunk(args) -> List[Optional[dict]]:
+    return normalize_members(*args)
+
+
+def normalize_archive(
+    archive_path: Path,
+    images_dir: Path,
+    map_fn=map,
+    max_edge: int = MAX_IMAGE_EDGE,
+) -> dict:
+    """Normalizes the images of a ZIP archive into `images_dir`.
+
+    Each image is decoded once, turned upright, downscaled to `max_edge` and
+    written as JPEG. Undecodable files and byte-identical duplicates are
+    dropped. A manifest of the kept images, their sizes and whether COLMAP may
+    share one camera between them is written next to `images_dir`.
+
+    Args:
+        archive_path: The ZIP archive.
+        images_dir: Where the normalized images are written.
+        map_fn: Maps the work on chunks of `NORMALIZE_CHUNK_SIZE` images, e.g. over
+            a process pool.
+        max_edge: Longest image edge kept, 0 to keep full resolution.
+
+    Returns:
+        The manifest.
+
+    Raises:
+        zipfile.BadZipFile: If the archive can't be read.
+    """
+    with zipfile.ZipFile(archive_path) as z:
+        members = sorted(
+            info.filename
+            for info in z.infolist()
+            if not info.is_dir()
+            and os.path.splitext(info.filename)[1].lower() in ALLOWED_IMAGE_EXTS
+        )
+    outputs = [
+        (member, images_dir / normalized_name(i)) for i, member in enumerate(members)
+    ]
+    chunks = [
+        (archive_path, outputs[start : start + NORMALIZE_CHUNK_SIZE], max_edge)
+        for start in range(0, len(outputs), NORMALIZE_CHUNK_SIZE)
+    ]
+    infos = chain.from_iterable(map_fn(_normalize_chunk, chunks))
+    images: List[dict] = []
+    dropped: List[Dict[str, str]] = []
+    seen: Dict[str, str] = {}
+    for (member, output_path), info in zip(outputs, infos):
+        if info is None:
+            dropped.append({"source": member, "reason": "undecodable"})
+            continue
+        digest = info.pop("sha1")
+        if digest in seen:
+            output_path.unlink(missing_ok=True)
+            dropped.append({"source": member, "reason": f"duplicate of {seen[digest]}"})
+            continue
+        seen[digest] = member
+        images.append({"name": output_path.name, "source": member, **info})
+
+    manifest = {
+        "images": images,
+        "dropped": dropped,
+        "max_edge": max_edge,
+        # the downscaled sizes of different cameras can match, e.g. at the same aspect
+        "single_camera": is_single_camera(
+            (i["source_width"], i["source_height"]) for i in images
+        ),
+    }
+    (images_dir.parent / MANIFEST_FILENAME).write_text(json.dumps(manifest, indent=1))
+    LOGGER.info(
+        "Normalized %d images of %s, dropped %d, single camera: %s",
+        len(images),
+        archive_path,
+        len(dropped),
+        manifest["single_camera"],
+    )
+    return manifest
+
+
+def read_manifest(images_dir: Path) -> Optional[dict]:
+    try:
+        return json.loads((images_dir.parent / MANIFEST_FILENAME).read_text())
+    except FileNotFoundError:
+        return None
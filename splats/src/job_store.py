@@ -0,0 +1,318 @@
+import json
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, ContextManager, Iterator, List, Optional, Tuple
+
+from src.database import Database
+from src.jobs import update_job
+
+LOGGER = logging.getLogger(__name__)
+
+# A job whose lease expired this many times is failed instead of retried.
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job_dir TEXT NOT NULL,
+    task TEXT NOT NULL,
+    args TEXT NOT NULL,
+    client_id TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    features TEXT NOT NULL,
+    estimated_seconds REAL NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    error_status INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_started_at ON jobs (started_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class StoredJob:
+    id: str
+    job_dir: str
+    task: str
+    args: list
+    client_id: str
+    priority: int
+    features: dict
+    estimated_seconds: float
+    status: str
+    attempts: int
+    worker_id: Optional[str]
+    lease_expires_at: Optional[float]
+    submitted_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    result: Optional[dict]
+    error: Optional[str]
+    error_status: Optional[int]
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "StoredJob":
+        fields = dict(row)
+        for key in ("args", "features", "result"):
+            if fields[key] is not None:
+                fields[key] = json.loads(fields[key])
+        return cls(**fields)
+
+    def remaining_seconds(self, now: float) -> float:
+        if self.started_at is None:
+            return self.estimated_seconds
+        return max(0.0, self.estimated_seconds - (now - self.started_at))
+
+
+# Picks the next job to run from the queued jobs, the (started_at, client_id,
+# estimated_seconds) of recently started jobs, and the current time.
+ChooseJob = Callable[
+    [List[StoredJob], List[Tuple[float, str, float]], float], StoredJob
+]
+
+
+class JobStore:
+    """Durable job queue in a SQLite database, shared by the API and the workers.
+
+    Workers claim a queued job with a lease that they extend by heartbeating while
+    the job runs. When a lease expires, e.g. because its worker crashed, the job is
+    put back in the queue on the next claim, up to `MAX_ATTEMPTS` times.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._db = Database(db_path, SCHEMA)
+
+    def _connect(self) -> ContextManager[sqlite3.Connection]:
+        return self._db.connect()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as db:
+            # take the write lock up front so two workers never claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def enqueue(
+        self,
+        job_id: str,
+        job_dir: Path,
+        task: str,
+        args: list,
+        client_id: str,
+        priority: int,
+        features: dict,
+        estimated_seconds: float,
+    ):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, job_dir, task, args, client_id, priority, features,"
+                " estimated_seconds, status, submitted_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+                (
+                    job_id,
+                    str(job_dir),
+                    task,
+                    json.dumps(args, default=str),
+                    client_id,
+                    priority,
+                    json.dumps(features),
+                    estimated_seconds,
+                    time.time(),
+                ),
+            )
+
+    def get(self, job_id: str) -> Optional[StoredJob]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return StoredJob.from_row(row) if row is not None else None
+
+    def active(self) -> Tuple[List[StoredJob], List[StoredJob]]:
+        """Returns the queued and the running jobs."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        jobs = [StoredJob.from_row(row) for row in rows]
+        return (
+            [job for job in jobs if job.status == "queued"],
+            [job for job in jobs if job.status == "running"],
+        )
+
+    def recent_starts(self, since: float) -> List[Tuple[float, str, float]]:
+        with self._connect() as db:
+            return self._recent_starts(db, since)
+
+    @staticmethod
+    def _recent_starts(
+        db: sqlite3.Connection, since: float
+    ) -> List[Tuple[float, str, float]]:
+        return [
+            tuple(row)
+            for row in db.execute(
+                "SELECT started_at, client_id, estimated_seconds FROM jobs"
+                " WHERE started_at >= ?",
+                (since,),
+            )
+        ]
+
+    def live_workers(self, within: float) -> int:
+        """Counts the workers seen in the last `within` seconds."""
+        with self._connect() as db:
+            (count,) = db.execute(
+                "SELECT COUNT(*) FROM workers WHERE last_seen >= ?",
+                (time.time() - within,),
+            ).fetchone()
+        return count
+
+    def claim(
+        self, worker_id: str, lease_seconds: float, choose: ChooseJob, window: float
+    ) -> Optional[StoredJob]:
+        """Reclaims expired leases, then leases the next job to `worker_id`.
+
+        Args:
+            worker_id: The claiming worker.
+            lease_seconds: How long the lease lasts without a heartbeat.
+            choose: Picks the next job, see `ChooseJob`.
+            window: How far back started jobs are passed to `choose`.
+
+        Returns:
+            The claimed job, or None if the queue is empty.
+        """
+        row = None
+        with self._transaction() as db:
+            now = time.time()
+            db.execute(
+                "INSERT INTO workers (id, last_seen) VALUES (?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET last_seen = excluded.last_seen",
+                (worker_id, now),
+            )
+            failed = self._reclaim_expired(db, now)
+            queued = [
+                StoredJob.from_row(row)
+                for row in db.execute("SELECT * FROM jobs WHERE status = 'queued'")
+            ]
+            if queued:
+                job = choose(queued, self._recent_starts(db, now - window), now)
+                db.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, lease_expires_at = ?,"
+                    " started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker_id, now + lease_seconds, now, job.id),
+                )
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE id = ?", (job.id,)
+                ).fetchone()
+        # like a job failing in its worker, so status readers and event streams end
+        for job_dir, error in failed:
+            if job_dir.is_dir():
+                update_job(job_dir, status="failed", error=error)
+        return StoredJob.from_row(row) if row is not None else None
+
+    def _reclaim_expired(
+        self, db: sqlite3.Connection, now: float
+    ) -> List[Tuple[Path, str]]:
+        """Requeues the jobs whose lease expired, or fails them after `MAX_ATTEMPTS`.
+
+        Returns:
+            The directory and error of each job failed.
+        """
+        expired = db.execute(
+            "SELECT id, job_dir, worker_id, attempts FROM jobs"
+            " WHERE status = 'running' AND lease_expires_at < ?",
+            (now,),
+        ).fetchall()
+        failed = []
+        for job_id, job_dir, worker_id, attempts in expired:
+            if attempts >= MAX_ATTEMPTS:
+                LOGGER.error(
+                    "Job %s lost its worker %d times, failing it", job_id, attempts
+                )
+                error = f"Worker lost {attempts} times"
+                db.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, worker_id = NULL,"
+                    " error = ? WHERE id = ?",
+                    (now, error, job_id),
+                )
+                failed.append((Path(job_dir), error))
+            else:
+                LOGGER.warning(
+                    "Lease of job %s on %s expired, requeueing it", job_id, worker_id
+                )
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', worker_id = NULL,"
+                    " lease_expires_at = NULL, started_at = NULL WHERE id = ?",
+                    (job_id,),
+                )
+        return failed
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extends a lease.
+
+        Returns:
+            False if the worker no longer holds the job's lease.
+        """
+        with self._connect() as db:
+            now = time.time()
+            db.execute(
+                "INSERT INTO workers (id, last_seen) VALUES (?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET last_seen = excluded.last_seen",
+                (worker_id, now),
+            )
+            updated = db.execute(
+                "UPDATE jobs SET lease_expires_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (now + lease_seconds, job_id, worker_id),
+            ).rowcount
+        return updated == 1
+
+    def finish(
+        self,
+        job_id: str,
+        worker_id: str,
+        result: Optional[dict] = None,
+        error: Optional[str] = None,
+        error_status: Optional[int] = None,
+    ) -> bool:
+        """Marks a job done, or failed if `error` is given.
+
+        Returns:
+            False if the worker no longer held the job's lease, in which case the
+            job is left to whoever holds it now.
+        """
+        with self._connect() as db:
+            updated = db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, lease_expires_at = NULL,"
+                " result = ?, error = ?, error_status = ?"
+                " WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (
+                    "failed" if error is not None else "done",
+                    time.time(),
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    error_status,
+                    job_id,
+                    worker_id,
+                ),
+            ).rowcount
+        return updated == 1
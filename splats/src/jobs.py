@@ -0,0 +1,63 @@
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Optional
+
+from src.events import emit_event
+
+LOGGER = logging.getLogger(__name__)
+
+JOB_METADATA_FILENAME = "job.json"
+
+_metadata_lock = threading.Lock()
+
+
+def read_job(job_dir: Path) -> Optional[dict]:
+    """Returns the metadata of a job, or None if the job has none."""
+    try:
+        return json.loads((job_dir / JOB_METADATA_FILENAME).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def update_job(job_dir: Path, **fields) -> dict:
+    """Merges `fields` into the job's metadata file and returns the result.
+
+    The file is replaced atomically so readers never see a partial write. Status
+    changes are also appended to the job's event log.
+    """
+    with _metadata_lock:
+        metadata = read_job(job_dir) or {}
+        metadata.update(fields, updated_at=time.time())
+        tmp_path = job_dir / f"{JOB_METADATA_FILENAME}.tmp"
+        tmp_path.write_text(json.dumps(metadata))
+        os.replace(tmp_path, job_dir / JOB_METADATA_FILENAME)
+    if "status" in fields:
+        emit_event(
+            job_dir,
+            "status",
+            status=fields["status"],
+            **{k: fields[k] for k in ("error", "estimated_seconds") if k in fields},
+        )
+    return metadata
+
+
+def run_job(job_dir: Path, fn: Callable[..., dict], *args, **kwargs) -> Optional[dict]:
+    """Runs a pipeline function and records its status and result in the job metadata.
+
+    Raises:
+        Whatever `fn` raised, after recording the job as failed.
+    """
+    update_job(job_dir, status="running", started_at=time.time())
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        LOGGER.error("Job %s failed: %s", job_dir.name, traceback.format_exc())
+        update_job(job_dir, status="failed", error=getattr(e, "detail", None) or str(e))
+        raise
+    update_job(job_dir, status="done", finished_at=time.time(), result=result)
+    return result
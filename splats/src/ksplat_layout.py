@@ -0,0 +1,120 @@
+import logging
+import math
+import os
+from dataclasses import asdict, dataclass
+from typing import Tuple
+
+import numpy as np
+
+from src.ply import read_ply
+
+LOGGER = logging.getLogger(__name__)
+
+# Splats beyond these per-axis percentiles are floaters; they don't move the
+# scene center or the extent the blocks are sized from.
+TRIM_PERCENTILE = 1.0
+# The ksplat generator splits the scene into cubic blocks of `blockSize` and
+# each block into buckets of up to `bucketSize` splats sharing a center. Blocks
+# are sized so an occupied one holds about one full bucket.
+SPLATS_PER_BUCKET = 256
+# Block sizes tried, halving from the trimmed extent.
+MAX_BLOCK_HALVINGS = 16
+
+
+@dataclass(frozen=True)
+class KsplatLayout:
+    scene_center: Tuple[float, float, float]
+    extent: float
+    block_size: float
+    bucket_size: int
+    splats_per_block: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def conversion_options(self) -> dict:
+        """Returns the layout as options of the ksplat conversion service."""
+        return {
+            "sceneCenter": ",".join(f"{c:.6g}" for c in self.scene_center),
+            "blockSize": self.block_size,
+            "bucketSize": self.bucket_size,
+        }
+
+
+def _mean_splats_per_block(
+    positions: np.ndarray, origin: np.ndarray, block_size: float
+) -> float:
+    cells = np.floor((positions - origin) / block_size).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    # one integer per cell, unique is much faster on those than on rows
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    keys.sort()
+    occupied = 1 + np.count_nonzero(keys[1:] != keys[:-1])
+    return float(len(positions) / occupied)
+
+
+def compute_layout(
+    positions: np.ndarray,
+    trim_percentile: float = TRIM_PERCENTILE,
+    splats_per_bucket: int = SPLATS_PER_BUCKET,
+) -> KsplatLayout:
+    """Derives the ksplat scene center and block size from splat positions.
+
+    The center is the middle of the per-axis percentile-trimmed bounds. The
+    block size is the power-of-two fraction of the trimmed extent whose occupied
+    blocks hold, on average, closest to `splats_per_bucket` splats.
+
+    Args:
+        positions: (N, 3) splat centers.
+        trim_percentile: Percentile trimmed from each end of every axis.
+        splats_per_bucket: Target splats per block, and the bucket size.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    if len(positions) == 0:
+        return KsplatLayout((0.0, 0.0, 0.0), 0.0, 5.0, splats_per_bucket, 0.0)
+    low, high = np.percentile(
+        positions, [trim_percentile, 100.0 - trim_percentile], axis=0
+    )
+    center = (low + high) / 2
+    inside = positions[np.all((positions >= low) & (positions <= high), axis=1)]
+    extent = float((high - low).max())
+    if extent <= 0.0 or len(inside) <= splats_per_bucket:
+        block_size = max(extent, 1e-3)
+        return KsplatLayout(
+            tuple(center.tolist()),
+            extent,
+            block_size,
+            splats_per_bucket,
+            float(len(inside)),
+        )
+
+    # fewer splats per block as blocks shrink; stop at the first size under target
+    block_size, per_block = extent, float(len(inside))
+    for _ in range(MAX_BLOCK_HALVINGS):
+        smaller = block_size / 2
+        smaller_per_block = _mean_splats_per_block(inside, low, smaller)
+        if smaller_per_block < splats_per_bucket:
+            # keep whichever is closer in ratio
+            if math.log(splats_per_bucket / smaller_per_block) < math.log(
+                per_block / splats_per_bucket
+            ):
+                block_size, per_block = smaller, smaller_per_block
+            break
+        block_size, per_block = smaller, smaller_per_block
+
+    return KsplatLayout(
+        scene_center=tuple(center.tolist()),
+        extent=extent,
+        block_size=float(f"{block_size:.4g}"),
+        bucket_size=splats_per_bucket,
+        splats_per_block=per_block,
+    )
+
+
+def layout_of_ply(path: os.PathLike) -> KsplatLayout:
+    vertices = read_ply(path)
+    layout = compute_layout(
+        np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1)
+    )
+    LOGGER.info("ksplat layout of %s: %s", path, layout)
+    return layout
@@ -0,0 +1,200 @@
+import json
+import logging
+import math
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from src.ply import read_ply
+from src.pruning import SH_C0
+
+LOGGER = logging.getLogger(__name__)
+
+# Bytes per splat in the antimatter15 .splat layout: position (3 x float32),
+# scale (3 x float32), RGBA (4 x uint8), rotation (4 x uint8).
+SPLAT_ROW_DTYPE = np.dtype(
+    [
+        ("position", "<f4", 3),
+        ("scale", "<f4", 3),
+        ("color", "u1", 4),
+        ("rotation", "u1", 4),
+    ]
+)
+# Voxel resolution (per axis, over the whole scene) of each merged LOD level. The
+# finest level is always the unmerged splats.
+LOD_VOXEL_DIVISIONS: Tuple[int, ...] = (32, 128)
+TARGET_SPLATS_PER_CHUNK = 65536
+
+
+def _to_rows(
+    positions: np.ndarray,
+    scales: np.ndarray,
+    colors: np.ndarray,
+    alpha: np.ndarray,
+    rotations: np.ndarray,
+) -> np.ndarray:
+    rows = np.empty(len(positions), dtype=SPLAT_ROW_DTYPE)
+    rows["position"] = positions
+    rows["scale"] = scales
+    rows["color"][:, :3] = np.round(np.clip(colors, 0.0, 1.0) * 255)
+    rows["color"][:, 3] = np.round(np.clip(alpha, 0.0, 1.0) * 255)
+    norms = np.linalg.norm(rotations, axis=1, keepdims=True)
+    unit = rotations / np.where(norms == 0, 1, norms)
+    rows["rotation"] = np.clip(np.round(unit * 128 + 128), 0, 255)
+    return rows
+
+
+def splat_attributes(vertices: np.ndarray) -> dict:
+    """Converts PLY splat properties to linear positions, scales, colors, alpha and rotations."""
+    return {
+        "positions": np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1),
+        "scales": np.exp(np.stack([vertices[f"scale_{i}"] for i in range(3)], axis=1)),
+        "colors": 0.5
+        + SH_C0 * np.stack([vertices[f"f_dc_{i}"] for i in range(3)], axis=1),
+        "alpha": 1.0 / (1.0 + np.exp(-vertices["opacity"].astype(np.float64))),
+        "rotations": np.stack([vertices[f"rot_{i}"] for i in range(4)], axis=1),
+    }
+
+
+def merge_splats(attributes: dict, origin: np.ndarray, voxel_size: float) -> dict:
+    """Merges all splats falling in the same voxel into a single Gaussian.
+
+    The merged splat sits at the alpha-weighted mean position, its color is the
+    alpha-weighted mean color, and its (axis aligned) extent covers both the spread
+    of the merged centers and their own scales.
+    """
+    positions = attributes["positions"]
+    voxels = np.floor((positions - origin) / voxel_size).astype(np.int64)
+    _, inverse = np.unique(voxels, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    count = inverse.max() + 1 if len(inverse) else 0
+
+    weights = attributes["alpha"] + 1e-6
+    weight_sum = np.bincount(inverse, weights=weights, minlength=count)
+
+    def weighted_mean(values: np.ndarray) -> np.ndarray:
+        sums = [
+            np.bincount(inverse, weights=weights * values[:, i], minlength=count)
+            for i in range(values.shape[1])
+        ]
+        return np.stack(sums, axis=1) / weight_sum[:, None]
+
+    mean_positions = weighted_mean(positions)
+    spread = weighted_mean((positions - mean_positions[inverse]) ** 2)
+    own_extent = weighted_mean(attributes["scales"] ** 2)
+    alpha = np.zeros(count)
+    np.maximum.at(alpha, inverse, attributes["alpha"])
+    rotations = np.zeros((count, 4))
+    rotations[:, 0] = 1.0
+    return {
+        "positions": mean_positions,
+        "scales": np.sqrt(spread + own_extent),
+        "colors": weighted_mean(attributes["colors"]),
+        "alpha": alpha,
+        "rotations": rotations,
+    }
+
+
+def _chunk_grid(positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int]:
+    low = positions.min(axis=0)
+    high = positions.max(axis=0)
+    cells_per_axis = max(
+        1, math.ceil((len(positions) / TARGET_SPLATS_PER_CHUNK) ** (1 / 3))
+    )
+    cell_size = np.maximum((high - low) / cells_per_axis, 1e-6)
+    return low, cell_size, cells_per_axis
+
+
+def build_lod(
+    ply_path: Path,
+    output_dir: Path,
+    name: str,
+    voxel_divisions: Sequence[int] = LOD_VOXEL_DIVISIONS,
+) -> Path:
+    """Writes a spatially chunked, coarse-to-fine copy of a splat for progressive streaming.
+
+    Splats are partitioned into a uniform grid of chunks. Every LOD level is written
+    chunk by chunk into a single `<name>.lod.splat` file, coarsest level first, so
+    a client can render the whole scene at low detail from the first few hundred KB
+    and refine by fetching further byte ranges. `<name>.lod.json` lists each chunk's
+    bounds, byte offset, length and level.
+
+    Args:
+        ply_path: Path to the (pruned) splat PLY.
+        output_dir: Directory to write the chunk file and manifest to.
+        name: Base name of the output files.
+        voxel_divisions: Per-axis voxel resolution of each merged LOD level.
+
+    Returns:
+        The path to the manifest.
+    """
+    attributes = splat_attributes(read_ply(ply_path))
+    origin, cell_size, cells_per_axis = _chunk_grid(attributes["positions"])
+    scene_extent = float(np.max(cell_size * cells_per_axis))
+
+    levels = [
+        merge_splats(attributes, origin, scene_extent / divisions)
+        for divisions in voxel_divisions
+    ]
+    levels.append(attributes)
+
+    chunks: List[dict] = []
+    offset = 0
+    chunk_path = output_dir / f"{name}.lod.splat"
+    with open(chunk_path, "wb") as f:
+        for level, level_attributes in enumerate(levels):
+            positions = level_attributes["positions"]
+            cells = np.clip(
+                np.floor((positions - origin) / cell_size).astype(np.int64),
+                0,
+                cells_per_axis - 1,
+            )
+            cell_ids = (
+                cells[:, 0] * cells_per_axis + cells[:, 1]
+            ) * cells_per_axis + cells[:, 2]
+            order = np.argsort(cell_ids, kind="stable")
+            rows = _to_rows(**{k: v[order] for k, v in level_attributes.items()})
+            sorted_ids = cell_ids[order]
+            for cell_id in np.unique(sorted_ids):
+                start, end = np.searchsorted(sorted_ids, [cell_id, cell_id + 1])
+                data = rows[start:end].tobytes()
+                f.write(data)
+                cell = np.array(np.unravel_index(cell_id, (cells_per_axis,) * 3))
+                chunks.append(
+                    {
+                        "id": len(chunks),
+                        "level": level,
+                        "cell": cell.tolist(),
+                        "bounds": {
+                            "min": (origin + cell * cell_size).tolist(),
+                            "max": (origin + (cell + 1) * cell_size).tolist(),
+                        },
+                        "offset": offset,
+                        "length": len(data),
+                        "count": int(end - start),
+                    }
+                )
+                offset += len(data)
+
+    manifest = {
+        "format": "splat",
+        "bytes_per_splat": SPLAT_ROW_DTYPE.itemsize,
+        "file": chunk_path.name,
+        "levels": len(levels),
+        "bounds": {
+            "min": origin.tolist(),
+            "max": (origin + cell_size * cells_per_axis).tolist(),
+        },
+        "chunks": chunks,
+    }
+    manifest_path = output_dir / f"{name}.lod.json"
+    manifest_path.write_text(json.dumps(manifest))
+    LOGGER.info(
+        "Wrote %d LOD chunks over %d levels (%d bytes) to %s",
+        len(chunks),
+        len(levels),
+        offset,
+        chunk_path,
+    )
+    return manifest_path
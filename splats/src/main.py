@@ -1,24 +1,79 @@
-import io
+import asyncio
+import json
 import logging
 import os
-import zipfile
-
-import requests
+import threading
+import time
 import uuid
-from pathlib import Path
+from contextlib import asynccontextmanager
 from typing import Annotated, Optional, List
 
-from fastapi import Depends, FastAPI, HTTPException, UploadFile, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 
-from src.brush import run_brush
-from src.colmap.colmap import run_colmap
-from src.dependencies import validate_upload_file
-from src.frame_extraction.frame_extraction import extract_frames_ffmpeg
-from src.utils import copy_upload_file_to_disk, file_chunk_generator
+from src.config import EMBEDDED_WORKERS, JOB_DB_PATH, SPLAT_STORAGE_DIR, UPLOADS_DIR
+from src.dependencies import (
+    SNIFF_BYTES,
+    get_client_id,
+    validate_upload_file,
+    validate_video_head,
+    validate_zip_archive,
+)
+from src.events import EVENTS_FILENAME, emit_event, read_events
+from src.jobs import read_job
+from src.pipeline import preview_path, stop_flag_path
+from src.post_processing import (
+    MESH_EXPORT_ENABLED,
+    fail_stale_mesh,
+    fail_stale_meshes,
+    mesh_path,
+)
+from src.pruning import DEFAULT_PRUNE_PRESET, PRUNE_PRESETS
+from src.scheduler import PRIORITIES, archive_features, video_features
+from src.serving import JsonFileCache, file_response, precompressed_variants
+from src.stage_pool import shutdown_stage_pool
+from src.storage import SWEEP_INTERVAL_SECONDS, StorageIndex, StorageManager
+from src.uploads import (
+    UploadSessionRequest,
+    create_session,
+    finalize_session,
+    load_session,
+    require_complete,
+    upload_status,
+    write_chunk,
+)
+from src.utils import copy_upload_file_to_disk
+from src.worker import Worker, make_scheduler
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = threading.Event()
+    threading.Thread(
+        target=fail_stale_meshes,
+        args=(SPLAT_STORAGE_DIR,),
+        name="mesh-recovery",
+        daemon=True,
+    ).start()
+    for _ in range(EMBEDDED_WORKERS):
+        threading.Thread(
+            target=Worker(SCHEDULER).run,
+            args=(stop,),
+            name="embedded-worker",
+            daemon=True,
+        ).start()
+    if SWEEP_INTERVAL_SECONDS > 0:
+        threading.Thread(
+            target=STORAGE.run, args=(stop,), name="storage-sweep", daemon=True
+        ).start()
+    yield
+    stop.set()
+    shutdown_stage_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,17 +83,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# read from env (with fallback)
-SPLAT_STORAGE_DIR = Path(os.getenv("SPLAT_STORAGE_DIR", "splat_storage"))
-SPLAT_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+SCHEDULER = make_scheduler()
+# Job directories are managed, and upload sessions expired; the job database and
+# the stage timings live outside them.
+STORAGE = StorageManager(
+    SPLAT_STORAGE_DIR,
+    StorageIndex(JOB_DB_PATH),
+    excluded=(UPLOADS_DIR.name,),
+    uploads_dir=UPLOADS_DIR,
+)
+# Parsed LOD manifests, so chunk requests don't re-read them.
+LOD_MANIFESTS = JsonFileCache()
+
+# How often an event stream checks the job's event log, and how long it may stay
+# silent before a keepalive comment is sent so proxies don't drop it.
+SSE_POLL_INTERVAL_SECONDS = 0.5
+SSE_KEEPALIVE_SECONDS = 15.0
+SSE_ETA_INTERVAL_SECONDS = 5.0
+SSE_RETRY_SECONDS = 3.0
 
 LOGGER = logging.getLogger(__name__)
 
 
+def validate_priority(
+    priority: Annotated[str, "Scheduling priority: low, normal or high"] = "normal",
+) -> int:
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority: {priority}, expected one of {sorted(PRIORITIES)}",
+        )
+    return PRIORITIES[priority]
+
+
 @app.post("/splats")
 def create_splat(
+    client_id: Annotated[str, Depends(get_client_id)],
+    priority: Annotated[int, Depends(validate_priority)],
     video: Annotated[Optional[UploadFile], "One video file"] = None,
-    images_archive: Annotated[Optional[UploadFile], "A ZIP archive containing image files"] = None,
+    images_archive: Annotated[
+        Optional[UploadFile], "A ZIP archive containing image files"
+    ] = None,
+    preset: Annotated[Optional[str], "Pruning preset, e.g. web or archive"] = None,
 ):
     # Mutual‐exclusion check
     if bool(video) == bool(images_archive):
@@ -46,22 +132,27 @@ def create_splat(
             status_code=400,
             detail="You must provide exactly one of `video` or `images_archive`.",
         )
+    preset = preset or DEFAULT_PRUNE_PRESET
+    if preset not in PRUNE_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown preset: {preset}, expected one of {sorted(PRUNE_PRESETS)}",
+        )
 
     request_uuid = uuid.uuid4()
     temp_dir = SPLAT_STORAGE_DIR / str(request_uuid)
     temp_dir.mkdir(parents=True)
-    colmap_dir = temp_dir / "colmap"
-    images_dir = colmap_dir / "images"
-    colmap_dir.mkdir()
-    images_dir.mkdir()
 
-    mask_path = None
     if video:
         validate_upload_file(video)
-        temp_video_path = temp_dir / video.filename
-        copy_upload_file_to_disk(video, temp_video_path)
-        mask_path = extract_frames_ffmpeg(temp_video_path, images_dir)
-    else: # images
+        # reject undecodable videos before copying them and running ffmpeg
+        video.file.seek(0)
+        validate_video_head(video.file.read(SNIFF_BYTES), video.filename)
+        video.file.seek(0)
+        upload_path = temp_dir / video.filename
+        copy_upload_file_to_disk(video, upload_path)
+        kind, features = "video", video_features(upload_path)
+    else:  # images
         name, ext = os.path.splitext(images_archive.filename or "")
         if ext.lower() != ".zip":
             raise HTTPException(
@@ -70,57 +161,321 @@ def create_splat(
             )
 
         images_archive.file.seek(0)
-        data = images_archive.file.read()
-        try:
-            with zipfile.ZipFile(io.BytesIO(data)) as z:
-                # extract only files (skip directories)
-                for member in z.namelist():
-                    if member.endswith("/"):
-                        continue
-                    # normalize the path so no one can escape images_dir
-                    target = images_dir / Path(member).name
-                    with z.open(member) as src, open(target, "wb") as dst:
-                        dst.write(src.read())
-        except zipfile.BadZipFile:
-            raise HTTPException(
-                status_code=400, detail="Invalid or corrupted ZIP archive"
-            )
+        validate_zip_archive(images_archive.file)
+        images_archive.file.seek(0)
+        upload_path = temp_dir / "images.zip"
+        copy_upload_file_to_disk(images_archive, upload_path)
+        kind, features = "images_archive", archive_features(upload_path)
 
-    run_colmap(images_dir, colmap_dir, mask_path)
-    run_brush(colmap_dir, temp_dir, str(request_uuid))
-    compress_splat_to_ksplat(request_uuid)
+    # runs in the shared queue like any other job; this endpoint waits for it
+    SCHEDULER.submit(
+        temp_dir,
+        "process_upload",
+        str(request_uuid),
+        temp_dir,
+        upload_path,
+        kind,
+        preset,
+        client_id=client_id,
+        features=features,
+        priority=priority,
+    )
+    result = SCHEDULER.wait(str(request_uuid))
     return JSONResponse(
-        status_code=status.HTTP_201_CREATED, content={"uuid": str(request_uuid)}
+        status_code=status.HTTP_201_CREATED,
+        content={"uuid": str(request_uuid), **result},
     )
 
 
-def compress_splat_to_ksplat(request_uuid):
-    ksplats_url = f"http://localhost:8090/ksplats/{request_uuid}"
-    try:
-        resp = requests.post(ksplats_url, timeout=5.0)
-        resp.raise_for_status()
-        LOGGER.info(f"Successfully notified ksplats service: {ksplats_url}")
-    except requests.RequestException as e:
-        LOGGER.error(f"Failed to notify ksplats service at {ksplats_url}: {e}")
+@app.post("/uploads", status_code=status.HTTP_201_CREATED)
+def create_upload(upload: UploadSessionRequest):
+    if upload.preset is not None and upload.preset not in PRUNE_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown preset: {upload.preset}, expected one of {sorted(PRUNE_PRESETS)}",
+        )
+    return create_session(UPLOADS_DIR, upload)
+
+
+@app.get("/uploads/{upload_id}")
+def read_upload(upload_id: str):
+    return upload_status(UPLOADS_DIR, load_session(UPLOADS_DIR, upload_id))
+
+
+@app.put("/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: Annotated[Optional[str], Header()] = None,
+):
+    session = load_session(UPLOADS_DIR, upload_id)
+    data = await request.body()
+    digest = await run_in_threadpool(
+        write_chunk, UPLOADS_DIR, session, index, data, x_chunk_sha256
+    )
+    return {"upload_id": upload_id, "index": index, "sha256": digest}
+
+
+@app.post("/uploads/{upload_id}/finalize", status_code=status.HTTP_202_ACCEPTED)
+def finalize_upload(
+    upload_id: str,
+    client_id: Annotated[str, Depends(get_client_id)],
+    priority: Annotated[int, Depends(validate_priority)],
+):
+    session = load_session(UPLOADS_DIR, upload_id)
+    # estimate and admit before the session is consumed, so a 429 can be retried
+    data_path = require_complete(UPLOADS_DIR, session)
+    if session["kind"] == "video":
+        features = video_features(data_path)
+    else:
+        features = archive_features(data_path)
+    estimate = SCHEDULER.admit(features)
+
+    request_uuid = str(uuid.uuid4())
+    job_dir = SPLAT_STORAGE_DIR / request_uuid
+    upload_path = finalize_session(UPLOADS_DIR, session, job_dir)
+    SCHEDULER.submit(
+        job_dir,
+        "process_upload",
+        request_uuid,
+        job_dir,
+        upload_path,
+        session["kind"],
+        session["preset"] or DEFAULT_PRUNE_PRESET,
+        client_id=client_id,
+        features=features,
+        priority=priority,
+        estimate=estimate,
+    )
+    return {"uuid": request_uuid, "status_url": f"/splats/{request_uuid}/status"}
+
+
+@app.get("/splats/{splat_uuid}/status")
+def read_status(splat_uuid: str):
+    job_dir = SPLAT_STORAGE_DIR / splat_uuid
+    job = read_job(job_dir)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if "mesh" in job:
+        job["mesh"] = fail_stale_mesh(job_dir, job)
+    # the queue is the source of truth for where the job is, e.g. after a requeue
+    stored = SCHEDULER.store.get(splat_uuid)
+    if stored is not None:
+        job.update(
+            status=stored.status, attempts=stored.attempts, worker_id=stored.worker_id
+        )
+        if stored.error is not None:
+            job["error"] = stored.error
+        if stored.status in ("queued", "running"):
+            job.update(SCHEDULER.eta(splat_uuid) or {})
+    return job
+
+
+def artifact_urls(splat_uuid: str) -> dict:
+    urls = {
+        "ksplat": f"/splats/{splat_uuid}",
+        "lod_manifest": f"/splats/{splat_uuid}/lod",
+        "status": f"/splats/{splat_uuid}/status",
+    }
+    if MESH_EXPORT_ENABLED:
+        # exported after the job is done, see the status' "mesh"
+        urls["mesh"] = f"/splats/{splat_uuid}/mesh.glb"
+    return urls
+
+
+def format_sse(event: dict, event_id: Optional[int] = None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event['type']}", f"data: {json.dumps(event)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+@app.get("/splats/{splat_uuid}/events")
+async def stream_events(
+    splat_uuid: str,
+    request: Request,
+    last_event_id: Annotated[Optional[str], Header()] = None,
+):
+    """Streams a job's status, stage and progress events as Server-Sent Events.
+
+    Event IDs are offsets into the job's event log, so a reconnecting client
+    resumes after the last event it saw. The stream ends after the job is done,
+    with the artifact URLs, or failed.
+    """
+    job_dir = SPLAT_STORAGE_DIR / splat_uuid
+    job = read_job(job_dir)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    offset = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+    async def stream():
+        nonlocal offset
+        yield f"retry: {int(SSE_RETRY_SECONDS * 1000)}\n\n"
+        if not (job_dir / EVENTS_FILENAME).exists() and job.get("status") in (
+            "done",
+            "failed",
+        ):
+            # finished before it had an event log
+            yield format_sse(
+                {
+                    "type": "status",
+                    "status": job["status"],
+                    "artifacts": artifact_urls(splat_uuid),
+                }
+            )
+            return
+
+        last_write = last_eta_check = time.monotonic()
+        last_eta = None
+        while not await request.is_disconnected():
+            try:
+                grown = os.stat(job_dir / EVENTS_FILENAME).st_size > offset
+            except FileNotFoundError:
+                grown = False
+            if grown:
+                for offset, event in await run_in_threadpool(
+                    read_events, job_dir, offset
+                ):
+                    if event["type"] == "status" and event["status"] == "done":
+                        event["artifacts"] = artifact_urls(splat_uuid)
+                    elif event["type"] == "preview":
+                        event["url"] = artifact_urls(splat_uuid)["ksplat"]
+                    yield format_sse(event, offset)
+                    last_write = time.monotonic()
+                    if event["type"] == "status" and event["status"] in (
+                        "done",
+                        "failed",
+                    ):
+                        return
+
+            now = time.monotonic()
+            if now - last_eta_check >= SSE_ETA_INTERVAL_SECONDS:
+                last_eta_check = now
+                eta = await run_in_threadpool(SCHEDULER.eta, splat_uuid)
+                if eta is not None and eta != last_eta:
+                    last_eta = eta
+                    yield format_sse({"type": "eta", **eta})
+                    last_write = now
+            if now - last_write >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_write = now
+            await asyncio.sleep(SSE_POLL_INTERVAL_SECONDS)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/splats/{splat_uuid}/stop", status_code=status.HTTP_202_ACCEPTED)
+def stop_training(splat_uuid: str):
+    """Asks brush to stop at its next poll; the latest checkpoint becomes the splat."""
+    job_dir = SPLAT_STORAGE_DIR / splat_uuid
+    job = read_job(job_dir)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("status") not in ("queued", "running"):
         raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Could not notify ksplats service"
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job is {job.get('status')}, it can no longer be stopped",
         )
+    stop_flag_path(job_dir).touch()
+    emit_event(job_dir, "stop_requested")
+    return {"uuid": splat_uuid, "stop_requested": True}
+
+
+def raise_missing_artifact(splat_uuid: str, detail: str):
+    """Raises 410 for jobs whose artifacts were evicted, otherwise 404."""
+    job = read_job(SPLAT_STORAGE_DIR / splat_uuid) or {}
+    if job.get("evicted_at") is not None:
+        raise HTTPException(status_code=410, detail="Evicted from storage")
+    raise HTTPException(status_code=404, detail=detail)
+
+
+@app.get("/storage/metrics")
+def read_storage_metrics():
+    return STORAGE.metrics()
 
 
 @app.get("/splats/{splat_uuid}")
-async def read_item(splat_uuid: str):
+async def read_item(splat_uuid: str, request: Request):
     file_path = SPLAT_STORAGE_DIR / splat_uuid / f"{splat_uuid}.ksplat"
-    if not file_path.exists() or not file_path.is_file():
-        raise HTTPException(status_code=404, detail="File not found")
-    file_size = file_path.stat().st_size
+    if not file_path.is_file():
+        # serve the latest training checkpoint until the final splat lands
+        preview = preview_path(SPLAT_STORAGE_DIR / splat_uuid, splat_uuid)
+        if not preview.is_file():
+            raise_missing_artifact(splat_uuid, "File not found")
+        return file_response(
+            request,
+            preview,
+            headers={
+                "Content-Disposition": f'attachment; filename="{preview.name}"',
+                "Cache-Control": "no-cache",
+                "X-Splat-Preview": "true",
+            },
+        )
+    STORAGE.record_access(splat_uuid)
+    for variant_path, encoding in precompressed_variants(request, file_path):
+        if variant_path.is_file():
+            break
     headers = {
-        "Content-Length": str(file_size),
-        "Accept-Ranges": "bytes",
         "Content-Disposition": f'attachment; filename="{splat_uuid}.ksplat"',
+        "Vary": "Accept-Encoding",
     }
-    return StreamingResponse(
-        file_chunk_generator(file_path),
-        media_type="application/octet-stream",
-        headers=headers,
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return file_response(request, variant_path, headers=headers)
+
+
+@app.get("/splats/{splat_uuid}/mesh.glb")
+async def read_mesh(splat_uuid: str, request: Request):
+    job_dir = SPLAT_STORAGE_DIR / splat_uuid
+    file_path = mesh_path(job_dir, splat_uuid)
+    if not file_path.is_file():
+        mesh = fail_stale_mesh(job_dir) or {}
+        if mesh.get("status") in ("queued", "running"):
+            raise HTTPException(
+                status_code=404, detail="Mesh not ready", headers={"Retry-After": "30"}
+            )
+        raise_missing_artifact(splat_uuid, "Mesh not found")
+    STORAGE.record_access(splat_uuid)
+    return file_response(
+        request,
+        file_path,
+        media_type="model/gltf-binary",
+        headers={"Content-Disposition": f'attachment; filename="{splat_uuid}.glb"'},
+    )
+
+
+@app.get("/splats/{splat_uuid}/lod")
+async def read_lod_manifest(splat_uuid: str, request: Request):
+    manifest_path = SPLAT_STORAGE_DIR / splat_uuid / f"{splat_uuid}.lod.json"
+    if not manifest_path.is_file():
+        raise_missing_artifact(splat_uuid, "LOD manifest not found")
+    STORAGE.record_access(splat_uuid)
+    return file_response(request, manifest_path, media_type="application/json")
+
+
+@app.get("/splats/{splat_uuid}/lod/{chunk_id}")
+async def read_lod_chunk(splat_uuid: str, chunk_id: int, request: Request):
+    splat_dir = SPLAT_STORAGE_DIR / splat_uuid
+    try:
+        manifest = LOD_MANIFESTS.get(splat_dir / f"{splat_uuid}.lod.json")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="LOD manifest not found")
+    if not 0 <= chunk_id < len(manifest["chunks"]):
+        raise HTTPException(status_code=404, detail="Chunk not found")
+
+    chunk = manifest["chunks"][chunk_id]
+    STORAGE.record_access(splat_uuid)
+    return file_response(
+        request,
+        splat_dir / manifest["file"],
+        headers={
+            "X-Splat-Count": str(chunk["count"]),
+            "X-LOD-Level": str(chunk["level"]),
+        },
+        offset=chunk["offset"],
+        length=chunk["length"],
     )
@@ -0,0 +1,427 @@
+import logging
+import os
+import time
+import traceback
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import requests
+from fastapi import HTTPException, status
+
+from src.brush import remove_checkpoints, run_brush
+from src.colmap.colmap import run_colmap
+from src.compression import write_precompressed_variants
+from src.events import JobEvents
+from src.frame_extraction.dynamic_mask import (
+    DYNAMIC_MASK_DIRNAME,
+    DYNAMIC_MASKS_ENABLED,
+    compute_dynamic_masks,
+)
+from src.frame_extraction.frame_extraction import extract_frames_ffmpeg
+from src.frame_extraction.normalize import normalize_archive, read_manifest
+from src.jobs import update_job
+from src.ksplat_layout import KsplatLayout, layout_of_ply
+from src.lod import build_lod
+from src.post_processing import MESH_EXPORT_ENABLED, submit_mesh_export
+from src.pruning import (
+    KSPLAT_COMPRESSION_LEVELS,
+    PRUNE_PRESETS,
+    PruneStats,
+    prune_splat,
+)
+from src.stage_pool import map_in_stage_pool, run_in_stage_pool
+from src.training_budget import TrainingBudget, choose_budget
+
+LOGGER = logging.getLogger(__name__)
+
+# Pruning preset of the previews published while brush trains.
+PREVIEW_PRESET = "web"
+# The pruned copy of `<uuid>.ply` the final ksplat and LOD chunks are made from.
+PRUNED_VARIANT = "pruned"
+STOP_FLAG_FILENAME = "stop_requested"
+
+
+def create_job_dirs(job_dir: Path) -> Tuple[Path, Path]:
+    """Creates `<job_dir>/colmap/images` and returns the colmap and images dirs."""
+    colmap_dir = job_dir / "colmap"
+    images_dir = colmap_dir / "images"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    return colmap_dir, images_dir
+
+
+@contextmanager
+def timed_stage(
+    timings: Dict[str, float], stage: str, events: Optional[JobEvents] = None
+):
+    """Adds the wall-clock seconds spent in the block to `timings[stage]` and
+    reports the stage starting and finishing to `events`."""
+    if events is not None:
+        events.stage(stage, "started")
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        if events is not None:
+            events.stage(stage, "failed", seconds=time.monotonic() - start)
+        raise
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.monotonic() - start
+    if events is not None:
+        events.stage(stage, "finished", seconds=timings[stage])
+
+
+def compress_splat_to_ksplat(
+    request_uuid,
+    compression_level: int = 0,
+    sh_degree: int = 0,
+    variant: Optional[str] = None,
+    layout: Optional[KsplatLayout] = None,
+):
+    """Converts `<uuid>.ply`, or `<uuid>.<variant>.ply`, to a ksplat next to it.
+
+    The ksplat's scene center and block and bucket sizes come from `layout`,
+    or the converter's defaults.
+    """
+    ksplats_url = f"http://localhost:8090/ksplats/{request_uuid}"
+    body = {
+        "compressionLevel": compression_level,
+        "sphericalHarmonicsDegree": sh_degree,
+    }
+    if variant is not None:
+        body["variant"] = variant
+    if layout is not None:
+        body.update(layout.conversion_options())
+    try:
+        resp = requests.post(
+            ksplats_url,
+            json=body,
+            timeout=5.0,
+        )
+        resp.raise_for_status()
+        LOGGER.info(f"Successfully notified ksplats service: {ksplats_url}")
+    except requests.RequestException as e:
+        LOGGER.error(f"Failed to notify ksplats service at {ksplats_url}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Could not notify ksplats service",
+        )
+
+
+def preview_path(job_dir: Path, request_uuid: str) -> Path:
+    return job_dir / f"{request_uuid}.preview.ksplat"
+
+
+def stop_flag_path(job_dir: Path) -> Path:
+    return job_dir / STOP_FLAG_FILENAME
+
+
+class PreviewPublisher:
+    """Turns brush checkpoints into a preview ksplat in the background.
+
+    Each checkpoint is pruned with the light preview preset, converted and then
+    atomically published as `<uuid>.preview.ksplat`, which the download endpoints
+    serve until the final ksplat exists. A checkpoint is skipped if a newer one is
+    already waiting, so a slow conversion never publishes stale previews.
+    """
+
+    def __init__(self, request_uuid: str, job_dir: Path, events: JobEvents):
+        self.request_uuid = request_uuid
+        self.job_dir = job_dir
+        self.events = events
+        self._latest_step = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+
+    def submit(self, step: int, ply_path: Path):
+        self._latest_step = max(self._latest_step, step)
+        self._executor.submit(self._publish, step, ply_path)
+
+    def close(self):
+        """Drops checkpoints not converted yet and waits for the one in progress."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _publish(self, step: int, ply_path: Path):
+        variant = f"preview-{step}"
+        preview_ply = self.job_dir / f"{self.request_uuid}.{variant}.ply"
+        try:
+            if step < self._latest_step:
+                return
+            preset = PRUNE_PRESETS[PREVIEW_PRESET]
+            prune_splat(ply_path, preview_ply, preset)
+            compress_splat_to_ksplat(
+                self.request_uuid,
+                compression_level=KSPLAT_COMPRESSION_LEVELS[preset.quantization],
+                variant=variant,
+                layout=layout_of_ply(preview_ply),
+            )
+            os.replace(
+                self.job_dir / f"{self.request_uuid}.{variant}.ksplat",
+                preview_path(self.job_dir, self.request_uuid),
+            )
+            self.events.emit("preview", step=step)
+            LOGGER.info("Published preview of %s at step %d", self.request_uuid, step)
+        except Exception:
+            LOGGER.error("Preview at step %d failed: %s", step, traceback.format_exc())
+        finally:
+            ply_path.unlink(missing_ok=True)
+            preview_ply.unlink(missing_ok=True)
+
+
+def _extract_video(job_dir: Path, upload_path: Path) -> Optional[Path]:
+    _, images_dir = create_job_dirs(job_dir)
+    return extract_frames_ffmpeg(
+        upload_path, images_dir, on_progress=JobEvents(job_dir).stage_progress("frames")
+    )
+
+
+def normalize_images_archive(job_dir: Path, archive_path: Path) -> dict:
+    """Decodes, orients, downscales and deduplicates the images of a ZIP
+    archive into `<job_dir>/colmap/images`, spread over the stage processes.
+
+    Returns:
+        The images manifest.
+    """
+    _, images_dir = create_job_dirs(job_dir)
+    try:
+        manifest = normalize_archive(archive_path, images_dir, map_fn=map_in_stage_pool)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid or corrupted ZIP archive")
+    if not manifest["images"]:
+        raise HTTPException(
+            status_code=400, detail="The ZIP archive has no decodable images"
+        )
+    update_job(
+        job_dir,
+        images={
+            "count": len(manifest["images"]),
+            "dropped": len(manifest["dropped"]),
+            "single_camera": manifest["single_camera"],
+        },
+    )
+    return manifest
+
+
+def mask_moving_objects(job_dir: Path, camera_mask_path: Optional[Path] = None) -> dict:
+    """Masks what moves across the frames of a job out of COLMAP's features, in
+    a stage process. A failure only leaves the frames unmasked.
+
+    brush is not given the masks and still trains on the whole frames.
+
+    Returns:
+        The masking report, also recorded in the job.
+    """
+    colmap_dir, images_dir = create_job_dirs(job_dir)
+    try:
+        report = run_in_stage_pool(
+            compute_dynamic_masks,
+            images_dir,
+            colmap_dir / DYNAMIC_MASK_DIRNAME,
+            camera_mask_path,
+        ).to_dict()
+    except Exception as e:
+        LOGGER.error("Masking moving objects failed: %s", traceback.format_exc())
+        report = {"error": str(e)}
+    update_job(job_dir, dynamic_masks=report)
+    return report
+
+
+def extract_upload(job_dir: Path, upload_path: Path, kind: str) -> Optional[Path]:
+    """Extracts the frames of a video, or the images of a ZIP archive, into
+    `<job_dir>/colmap/images`, in warm stage processes, then masks moving
+    objects out of the frames of a video if enabled. Archive images are left
+    unmasked: they are unordered photos, without neighbours to model a
+    background from.
+
+    Returns:
+        The camera mask of a video, if one is needed.
+    """
+    mask_path = None
+    if kind == "video":
+        mask_path = run_in_stage_pool(_extract_video, job_dir, upload_path)
+    else:
+        normalize_images_archive(job_dir, upload_path)
+    if DYNAMIC_MASKS_ENABLED and kind == "video":
+        mask_moving_objects(job_dir, mask_path)
+    return mask_path
+
+
+def dynamic_mask_dir(colmap_dir: Path) -> Optional[Path]:
+    mask_dir = colmap_dir / DYNAMIC_MASK_DIRNAME
+    if mask_dir.is_dir() and any(mask_dir.iterdir()):
+        return mask_dir
+    return None
+
+
+def reconstruct_cameras(job_dir: Path, mask_path: Optional[Path], events: JobEvents):
+    """Runs COLMAP on `<job_dir>/colmap/images` into `<job_dir>/colmap/sparse`.
+
+    Images of differing resolutions, per the images manifest, get a camera each,
+    and the masks of moving objects, if any, are applied.
+    """
+    colmap_dir, images_dir = create_job_dirs(job_dir)
+    manifest = read_manifest(images_dir)
+    run_colmap(
+        images_dir,
+        colmap_dir,
+        mask_path,
+        on_progress=events.stage_progress("colmap"),
+        single_camera=manifest["single_camera"] if manifest else True,
+        mask_dir=dynamic_mask_dir(colmap_dir),
+    )
+
+
+def train_splat(
+    request_uuid: str,
+    job_dir: Path,
+    events: JobEvents,
+    backlog_seconds: Optional[Callable[[], float]] = None,
+) -> Tuple[TrainingBudget, int]:
+    """Trains `<uuid>.ply` with brush on a budget sized to the scene and queue,
+    publishing previews meanwhile.
+
+    Returns:
+        The training budget and the step of the final splat.
+    """
+    sparse_dir = job_dir / "colmap" / "sparse" / "0"
+    budget = choose_budget(sparse_dir, backlog_seconds() if backlog_seconds else 0.0)
+    update_job(job_dir, training_budget=budget.to_dict())
+    events.emit("training_budget", **budget.to_dict())
+    previews = PreviewPublisher(request_uuid, job_dir, events)
+    try:
+        steps = run_brush(
+            job_dir / "colmap",
+            job_dir,
+            request_uuid,
+            on_progress=events.stage_progress("brush"),
+            on_checkpoint=previews.submit,
+            should_stop=stop_flag_path(job_dir).exists,
+            checkpoint_steps=budget.checkpoint_steps,
+            total_steps=budget.total_steps,
+            sh_degree=budget.sh_degree,
+        )
+    finally:
+        previews.close()
+        remove_checkpoints(job_dir, request_uuid)
+    return budget, steps
+
+
+def postprocess_splat(request_uuid: str, job_dir: Path, preset: str) -> PruneStats:
+    """Prunes `<uuid>.ply` into `<uuid>.pruned.ply`, then converts that to the
+    ksplat, LOD chunks and precompressed variants. The full-precision brush
+    export is left as is for later exports. The ksplat layout is recorded in
+    the job metadata."""
+    pruned_ply = job_dir / f"{request_uuid}.{PRUNED_VARIANT}.ply"
+    try:
+        prune_stats = prune_splat(
+            job_dir / f"{request_uuid}.ply", pruned_ply, PRUNE_PRESETS[preset]
+        )
+        layout = layout_of_ply(pruned_ply)
+        update_job(job_dir, ksplat_layout=layout.to_dict())
+        compress_splat_to_ksplat(
+            request_uuid,
+            compression_level=KSPLAT_COMPRESSION_LEVELS[
+                PRUNE_PRESETS[preset].quantization
+            ],
+            sh_degree=min(prune_stats.sh_degree, 2),
+            variant=PRUNED_VARIANT,
+            layout=layout,
+        )
+        os.replace(
+            job_dir / f"{request_uuid}.{PRUNED_VARIANT}.ksplat",
+            job_dir / f"{request_uuid}.ksplat",
+        )
+        preview_path(job_dir, request_uuid).unlink(missing_ok=True)
+        build_lod(pruned_ply, job_dir, request_uuid)
+    finally:
+        pruned_ply.unlink(missing_ok=True)
+    write_precompressed_variants(job_dir / f"{request_uuid}.ksplat")
+    return prune_stats
+
+
+def reconstruct_summary(
+    prune_stats: PruneStats,
+    budget: TrainingBudget,
+    steps: int,
+    timings: Dict[str, float],
+) -> dict:
+    return {
+        "prune": prune_stats.to_dict(),
+        "timings": timings,
+        "training_budget": budget.to_dict(),
+        "steps": steps,
+        "stopped_early": steps < budget.total_steps,
+    }
+
+
+def reconstruct_splat(
+    request_uuid: str,
+    job_dir: Path,
+    preset: str,
+    mask_path: Optional[Path] = None,
+    events: Optional[JobEvents] = None,
+    backlog_seconds: Optional[Callable[[], float]] = None,
+) -> dict:
+    """Runs every stage after image extraction: COLMAP, brush, pruning, ksplat
+    conversion, LOD chunking and precompression, then queues the optional mesh
+    export.
+
+    Args:
+        request_uuid: UUID of the job, used to name the outputs.
+        job_dir: The job's directory, containing `colmap/images`.
+        preset: Name of the pruning preset.
+        mask_path: Path to the camera mask, if any.
+        events: Where stage changes and progress are reported.
+        backlog_seconds: Returns the estimated queue backlog, which lowers the
+            training budget under load.
+
+    Returns:
+        A summary of the job's outputs, including the seconds spent per stage
+        and the training budget.
+    """
+    events = events or JobEvents(job_dir)
+    timings: Dict[str, float] = {}
+    with timed_stage(timings, "colmap", events):
+        reconstruct_cameras(job_dir, mask_path, events)
+    with timed_stage(timings, "brush", events):
+        budget, steps = train_splat(request_uuid, job_dir, events, backlog_seconds)
+    with timed_stage(timings, "postprocess", events):
+        prune_stats = postprocess_splat(request_uuid, job_dir, preset)
+    if MESH_EXPORT_ENABLED:
+        # finishes after the job, the splat is not held back by the mesh
+        submit_mesh_export(request_uuid, job_dir, events)
+    return reconstruct_summary(prune_stats, budget, steps, timings)
+
+
+def process_upload(
+    request_uuid: str,
+    job_dir: Union[str, Path],
+    upload_path: Union[str, Path],
+    kind: str,
+    preset: str,
+    backlog_seconds: Optional[Callable[[], float]] = None,
+) -> dict:
+    """Runs the whole pipeline for an upload already stored in `job_dir`.
+
+    Args:
+        request_uuid: UUID of the job.
+        job_dir: The job's directory.
+        upload_path: Path to the uploaded video or ZIP archive.
+        kind: "video" or "images_archive".
+        preset: Name of the pruning preset.
+        backlog_seconds: Returns the estimated queue backlog, see `reconstruct_splat`.
+
+    Returns:
+        A summary of the job's outputs.
+    """
+    job_dir, upload_path = Path(job_dir), Path(upload_path)
+    events = JobEvents(job_dir)
+    timings: Dict[str, float] = {}
+    with timed_stage(timings, "frames", events):
+        mask_path = extract_upload(job_dir, upload_path, kind)
+    result = reconstruct_splat(
+        request_uuid, job_dir, preset, mask_path, events, backlog_seconds
+    )
+    result["timings"].update(timings)
+    return result
@@ -0,0 +1,108 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+PLY_PROPERTY_DTYPES = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "<i2",
+    "int16": "<i2",
+    "ushort": "<u2",
+    "uint16": "<u2",
+    "int": "<i4",
+    "int32": "<i4",
+    "uint": "<u4",
+    "uint32": "<u4",
+    "float": "<f4",
+    "float32": "<f4",
+    "double": "<f8",
+    "float64": "<f8",
+}
+NUMPY_PROPERTY_TYPES = {
+    "i1": "char",
+    "u1": "uchar",
+    "<i2": "short",
+    "<u2": "ushort",
+    "<i4": "int",
+    "<u4": "uint",
+    "<f4": "float",
+    "<f8": "double",
+}
+
+
+def _read_header(f) -> Tuple[int, np.dtype]:
+    """Parses a binary little endian PLY header and returns the vertex count and dtype."""
+    if f.readline().strip() != b"ply":
+        raise ValueError("Not a PLY file")
+
+    vertex_count = None
+    fields: List[Tuple[str, str]] = []
+    current_element = None
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("Unexpected end of PLY header")
+        tokens = line.decode("ascii").split()
+        if not tokens or tokens[0] in ("comment", "obj_info"):
+            continue
+        if tokens[0] == "end_header":
+            break
+        if tokens[0] == "format" and tokens[1] != "binary_little_endian":
+            raise ValueError(f"Unsupported PLY format: {tokens[1]}")
+        if tokens[0] == "element":
+            current_element = tokens[1]
+            if current_element == "vertex":
+                vertex_count = int(tokens[2])
+            elif vertex_count is None:
+                raise ValueError("PLY elements before 'vertex' are not supported")
+        if tokens[0] == "property" and current_element == "vertex":
+            if tokens[1] == "list":
+                raise ValueError("List properties are not supported on vertices")
+            fields.append((tokens[2], PLY_PROPERTY_DTYPES[tokens[1]]))
+
+    if vertex_count is None:
+        raise ValueError("PLY file has no vertex element")
+    return vertex_count, np.dtype(fields)
+
+
+def read_ply(path: os.PathLike) -> np.ndarray:
+    """Reads the vertex element of a binary PLY file, e.g. a brush export.
+
+    Args:
+        path: Path to the PLY file.
+
+    Returns:
+        A structured array with one field per vertex property.
+    """
+    with open(path, "rb") as f:
+        vertex_count, dtype = _read_header(f)
+        data = f.read(vertex_count * dtype.itemsize)
+    return np.frombuffer(data, dtype=dtype, count=vertex_count)
+
+
+def write_ply(path: os.PathLike, vertices: np.ndarray):
+    """Writes a structured array as the vertex element of a binary PLY file.
+
+    Args:
+        path: Path to the PLY file.
+        vertices: Structured array with one field per vertex property.
+    """
+    header = [
+        "ply",
+        "format binary_little_endian 1.0",
+        f"element vertex {len(vertices)}",
+    ]
+    for name in vertices.dtype.names:
+        ply_type = NUMPY_PROPERTY_TYPES[
+            vertices.dtype[name].newbyteorder("<").str.lstrip("|")
+        ]
+        header.append(f"property {ply_type} {name}")
+    header.append("end_header")
+
+    little_endian = vertices.astype(vertices.dtype.newbyteorder("<"), copy=False)
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(np.ascontiguousarray(little_endian).tobytes())
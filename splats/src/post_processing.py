@@ -1,20 +1,296 @@
+import logging
+import math
+import multiprocessing
 import os
+import resource
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
 
-import open3d as o3d
+import numpy as np
 
+from src.events import JobEvents
+from src.jobs import read_job, update_job
+from src.ply import read_ply
+from src.pruning import SH_C0
 
-def convert_ply_to_glb(ply_dir: os.PathLike, glb_dir: os.PathLike):
-    # Load point cloud
-    pcd = o3d.io.read_point_cloud(ply_dir)
+LOGGER = logging.getLogger(__name__)
 
-    # Estimate normals — required for Poisson meshing
-    pcd.estimate_normals()
+# Mesh export is expensive, so it is off unless enabled, and runs after the job
+# is done in a separate, memory capped process.
+MESH_EXPORT_ENABLED = os.getenv("SPLAT_MESH_EXPORT", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+MESH_MEMORY_LIMIT_BYTES = (
+    int(os.getenv("SPLAT_MESH_MEMORY_LIMIT_MB", 8192)) * 1024 * 1024
+)
+MESH_TIMEOUT_SECONDS = float(os.getenv("SPLAT_MESH_TIMEOUT_SECONDS", 30 * 60))
+# Splats are voxel downsampled until at most this many points are left.
+MESH_MAX_POINTS = int(os.getenv("SPLAT_MESH_MAX_POINTS", 500_000))
+MESH_TARGET_TRIANGLES = 100_000
+# Initial voxel size, as a fraction of the largest scene extent, and how much it
+# grows per downsampling attempt.
+MESH_VOXEL_FRACTION = 1 / 1024
+MESH_VOXEL_GROWTH = 1.5
+MIN_POISSON_DEPTH = 6
+MAX_POISSON_DEPTH = 10
+# Poisson extrapolates a surface far from the points; vertices with the lowest
+# density of supporting points are dropped.
+LOW_DENSITY_QUANTILE = 0.02
 
-    # Mesh from point cloud
-    mesh, _ = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(pcd, depth=9)
+# One mesh at a time per process, so concurrent jobs never stack their memory caps.
+MESH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mesh")
+# Meshes are exported in memory, so a queued or running mesh is lost when its
+# process exits. The owner recorded with it, <host>:<pid>:<random>, lets a
+# process on the same host tell when that happened; a mesh of another host is
+# given up once it has not changed state for MESH_STALE_SECONDS.
+MESH_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+MESH_STALE_SECONDS = float(os.getenv("SPLAT_MESH_STALE_SECONDS", 24 * 60 * 60))
 
-    # Optional: simplify the mesh to reduce size
-    mesh = mesh.simplify_quadric_decimation(target_number_of_triangles=10000)
 
-    # Save to GLB
-    o3d.io.write_triangle_mesh(glb_dir, mesh)
+def mesh_path(job_dir: Path, request_uuid: str) -> Path:
+    return job_dir / f"{request_uuid}.glb"
+
+
+def poisson_depth(num_points: int) -> int:
+    """Picks the Poisson octree depth for a point count.
+
+    A surface sampled by n points has about n occupied cells at depth log4(n),
+    deeper octrees only add memory and noise.
+    """
+    if num_points <= 1:
+        return MIN_POISSON_DEPTH
+    depth = round(math.log(num_points, 4))
+    return int(min(max(depth, MIN_POISSON_DEPTH), MAX_POISSON_DEPTH))
+
+
+def initial_voxel_size(positions: np.ndarray) -> float:
+    extent = float(np.ptp(positions, axis=0).max()) if len(positions) else 0.0
+    return max(extent * MESH_VOXEL_FRACTION, 1e-6)
+
+
+def convert_ply_to_glb(ply_path: os.PathLike, glb_path: os.PathLike) -> dict:
+    """Meshes a splat PLY with screened Poisson reconstruction and saves a GLB.
+
+    The splat centers are colored from their DC spherical harmonics, voxel
+    downsampled to at most `MESH_MAX_POINTS` and cleared of statistical outliers
+    before normals are estimated.
+
+    Returns:
+        The point counts, Poisson depth and triangle count of the mesh.
+    """
+    import open3d as o3d
+
+    vertices = read_ply(ply_path)
+    positions = np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1).astype(
+        np.float64
+    )
+    colors = 0.5 + SH_C0 * np.stack([vertices[f"f_dc_{i}"] for i in range(3)], axis=1)
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(positions))
+    pcd.colors = o3d.utility.Vector3dVector(
+        np.clip(colors, 0.0, 1.0).astype(np.float64)
+    )
+    del vertices, positions, colors
+
+    voxel_size = initial_voxel_size(np.asarray(pcd.points))
+    downsampled = pcd.voxel_down_sample(voxel_size)
+    while len(downsampled.points) > MESH_MAX_POINTS:
+        voxel_size *= MESH_VOXEL_GROWTH
+        downsampled = pcd.voxel_down_sample(voxel_size)
+    input_points = len(pcd.points)
+    del pcd
+
+    filtered, _ = downsampled.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.0)
+    filtered.estimate_normals(
+        o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size * 4, max_nn=30)
+    )
+    filtered.orient_normals_consistent_tangent_plane(15)
+
+    depth = poisson_depth(len(filtered.points))
+    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
+        filtered, depth=depth
+    )
+    densities = np.asarray(densities)
+    mesh.remove_vertices_by_mask(
+        densities < np.quantile(densities, LOW_DENSITY_QUANTILE)
+    )
+    if len(mesh.triangles) > MESH_TARGET_TRIANGLES:
+        mesh = mesh.simplify_quadric_decimation(
+            target_number_of_triangles=MESH_TARGET_TRIANGLES
+        )
+    mesh.compute_vertex_normals()
+
+    o3d.io.write_triangle_mesh(str(glb_path), mesh)
+    return {
+        "input_points": input_points,
+        "meshed_points": len(filtered.points),
+        "voxel_size": voxel_size,
+        "poisson_depth": depth,
+        "triangles": len(mesh.triangles),
+    }
+
+
+def _run_limited(conn, memory_limit_bytes: int, fn: Callable[..., Any], args: Sequence):
+    if memory_limit_bytes > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+    try:
+        conn.send((True, fn(*args)))
+    except BaseException as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def run_in_subprocess(
+    fn: Callable[..., Any],
+    args: Sequence = (),
+    memory_limit_bytes: int = MESH_MEMORY_LIMIT_BYTES,
+    timeout: float = MESH_TIMEOUT_SECONDS,
+) -> Any:
+    """Runs `fn(*args)` in a fresh process with its address space capped.
+
+    Running out of memory fails the call instead of the worker, and a call that
+    exceeds `timeout` is killed.
+
+    Raises:
+        RuntimeError: If `fn` raised, was killed or timed out.
+    """
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_run_limited,
+        args=(child_conn, memory_limit_bytes, fn, args),
+        daemon=True,
+    )
+    process.start()
+    child_conn.close()
+    try:
+        if not parent_conn.poll(timeout):
+            if process.is_alive():
+                process.kill()
+                raise RuntimeError(f"Timed out after {timeout:.0f}s")
+            raise RuntimeError(f"Process exited with {process.exitcode}")
+        ok, value = parent_conn.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"Process exited with {process.exitcode}")
+    finally:
+        parent_conn.close()
+        process.join()
+    if not ok:
+        raise RuntimeError(value)
+    return value
+
+
+def export_mesh(
+    request_uuid: str, job_dir: Path, events: Optional[JobEvents] = None
+) -> dict:
+    """Meshes the final splat of a job into `<uuid>.glb` and records the outcome
+    in the job metadata under `mesh`."""
+    events = events or JobEvents(job_dir)
+    update_job(job_dir, mesh=_pending_mesh("running"))
+    events.emit("mesh", status="running")
+    output_path = mesh_path(job_dir, request_uuid)
+    tmp_path = job_dir / f"{request_uuid}.tmp.glb"
+    start = time.monotonic()
+    try:
+        stats = run_in_subprocess(
+            convert_ply_to_glb, (job_dir / f"{request_uuid}.ply", tmp_path)
+        )
+        os.replace(tmp_path, output_path)
+    except Exception as e:
+        LOGGER.error(
+            "Mesh export of %s failed: %s", request_uuid, traceback.format_exc()
+        )
+        tmp_path.unlink(missing_ok=True)
+        update_job(job_dir, mesh={"status": "failed", "error": str(e)})
+        events.emit("mesh", status="failed", error=str(e))
+        return {"status": "failed", "error": str(e)}
+    mesh = {"status": "done", "seconds": time.monotonic() - start, **stats}
+    update_job(job_dir, mesh=mesh)
+    events.emit("mesh", **mesh)
+    LOGGER.info("Exported mesh of %s: %s", request_uuid, mesh)
+    return mesh
+
+
+def submit_mesh_export(
+    request_uuid: str, job_dir: Path, events: Optional[JobEvents] = None
+) -> Future:
+    """Queues `export_mesh` behind the meshes already running in this process."""
+    update_job(job_dir, mesh=_pending_mesh("queued"))
+    return MESH_EXECUTOR.submit(export_mesh, request_uuid, job_dir, events)
+
+
+def _pending_mesh(status: str) -> dict:
+    return {"status": status, "owner": MESH_OWNER, "updated_at": time.time()}
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def mesh_is_stale(mesh: dict, now: Optional[float] = None) -> bool:
+    """Whether a queued or running mesh export was lost with its process."""
+    if (
+        mesh.get("status") not in ("queued", "running")
+        or mesh.get("owner") == MESH_OWNER
+    ):
+        return False
+    if mesh.get("owner"):
+        host, pid, _ = mesh["owner"].rsplit(":", 2)
+        if host == socket.gethostname() and (
+            int(pid) == os.getpid() or not _process_exists(int(pid))
+        ):
+            return True
+    updated_at = mesh.get("updated_at")
+    return (
+        updated_at is not None
+        and (now or time.time()) - updated_at > MESH_STALE_SECONDS
+    )
+
+
+def fail_stale_mesh(job_dir: Path, job: Optional[dict] = None) -> Optional[dict]:
+    """Records a mesh export lost with its process as failed.
+
+    Args:
+        job_dir: The job directory.
+        job: The job metadata, if already read.
+
+    Returns:
+        The mesh state of the job, if it has one.
+    """
+    mesh = ((read_job(job_dir) if job is None else job) or {}).get("mesh")
+    if mesh is None or not mesh_is_stale(mesh):
+        return mesh
+    LOGGER.warning("Mesh export of %s was interrupted, marking it failed", job_dir.name)
+    mesh = {"status": "failed", "error": "Mesh export was interrupted"}
+    update_job(job_dir, mesh=mesh)
+    JobEvents(job_dir).emit("mesh", **mesh)
+    return mesh
+
+
+def fail_stale_meshes(storage_dir: Path) -> int:
+    """Fails the mesh exports lost with their process, e.g. on startup.
+
+    Returns:
+        The number of meshes marked failed.
+    """
+    failed = 0
+    for job_dir in storage_dir.iterdir():
+        job = read_job(job_dir) if job_dir.is_dir() else None
+        if mesh_is_stale((job or {}).get("mesh") or {}):
+            fail_stale_mesh(job_dir, job)
+            failed += 1
+    return failed
@@ -0,0 +1,247 @@
+import logging
+import os
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Literal, Optional
+
+import numpy as np
+
+from src.ply import read_ply, write_ply
+
+LOGGER = logging.getLogger(__name__)
+
+SH_C0 = 0.28209479177387814
+
+
+@dataclass(frozen=True)
+class PrunePreset:
+    """Quality/bandwidth trade-off applied to a trained splat before serving.
+
+    Attributes:
+        min_opacity: Splats with a (post-sigmoid) opacity below this are dropped.
+        bounds_percentile: Splats outside the [p, 100 - p] percentile box on any axis
+            are dropped. 0 disables the bounding volume.
+        sh_degree: Spherical harmonics degree to keep, or None to keep all of them.
+        quantization: Precision the splat is stored with once converted to ksplat.
+    """
+
+    min_opacity: float
+    bounds_percentile: float
+    sh_degree: Optional[int]
+    quantization: Literal["none", "half", "8bit"]
+
+
+PRUNE_PRESETS: Dict[str, PrunePreset] = {
+    "web": PrunePreset(
+        min_opacity=0.05, bounds_percentile=1.0, sh_degree=0, quantization="8bit"
+    ),
+    "archive": PrunePreset(
+        min_opacity=0.005, bounds_percentile=0.0, sh_degree=None, quantization="half"
+    ),
+}
+DEFAULT_PRUNE_PRESET = os.getenv("SPLAT_PRUNE_PRESET", "web")
+
+# ksplat compression levels understood by create-ksplat.js
+KSPLAT_COMPRESSION_LEVELS = {"none": 0, "half": 1, "8bit": 2}
+
+
+@dataclass
+class PruneStats:
+    count_before: int
+    count_after: int
+    bytes_before: int
+    bytes_after: int
+    quantized_bytes: int
+    sh_degree: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _sh_rest_fields(vertices: np.ndarray) -> list:
+    names = [n for n in vertices.dtype.names if re.fullmatch(r"f_rest_\d+", n)]
+    return sorted(names, key=lambda n: int(n.rsplit("_", 1)[1]))
+
+
+def sh_degree_of(vertices: np.ndarray) -> int:
+    """Returns the spherical harmonics degree stored in a splat PLY."""
+    coeffs_per_channel = len(_sh_rest_fields(vertices)) // 3 + 1
+    return int(round(np.sqrt(coeffs_per_channel))) - 1
+
+
+def opacity_mask(vertices: np.ndarray, min_opacity: float) -> np.ndarray:
+    """Keeps splats whose sigmoid(opacity) is at least `min_opacity`."""
+    opacity = 1.0 / (1.0 + np.exp(-vertices["opacity"].astype(np.float64)))
+    return opacity >= min_opacity
+
+
+def bounds_mask(vertices: np.ndarray, percentile: float) -> np.ndarray:
+    """Keeps splats inside the per-axis [percentile, 100 - percentile] box."""
+    if percentile <= 0.0:
+        return np.ones(len(vertices), dtype=bool)
+    positions = np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1)
+    low, high = np.percentile(positions, [percentile, 100.0 - percentile], axis=0)
+    return np.all((positions >= low) & (positions <= high), axis=1)
+
+
+def truncate_sh(vertices: np.ndarray, sh_degree: int) -> np.ndarray:
+    """Drops spherical harmonics coefficients above `sh_degree`.
+
+    f_rest_* is stored channel-major (all R coefficients, then G, then B), so the
+    kept coefficients are taken per channel and renumbered.
+    """
+    rest_fields = _sh_rest_fields(vertices)
+    per_channel = len(rest_fields) // 3
+    keep_per_channel = (sh_degree + 1) ** 2 - 1
+    if keep_per_channel >= per_channel:
+        return vertices
+
+    kept = [
+        rest_fields[channel * per_channel + i]
+        for channel in range(3)
+        for i in range(keep_per_channel)
+    ]
+    fields, sources = [], []
+    for name in vertices.dtype.names:
+        if name in rest_fields:
+            continue
+        fields.append((name, vertices.dtype[name]))
+        sources.append(name)
+        if name == "f_dc_2":
+            fields.extend(
+                (f"f_rest_{i}", vertices.dtype[n]) for i, n in enumerate(kept)
+            )
+            sources.extend(kept)
+
+    out = np.empty(len(vertices), dtype=fields)
+    for (name, _), source in zip(fields, sources):
+        out[name] = vertices[source]
+    return out
+
+
+def quantize(vertices: np.ndarray, quantization: str) -> Dict[str, np.ndarray]:
+    """Packs splat attributes at the requested precision.
+
+    "half" stores everything as float16; "8bit" additionally stores colors, opacity,
+    rotations and spherical harmonics as uint8.
+
+    Returns:
+        The packed attribute arrays, keyed by attribute name.
+    """
+    positions = np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1)
+    scales = np.stack([vertices[f"scale_{i}"] for i in range(3)], axis=1)
+    rotations = np.stack([vertices[f"rot_{i}"] for i in range(4)], axis=1)
+    colors = np.stack([vertices[f"f_dc_{i}"] for i in range(3)], axis=1)
+    opacity = vertices["opacity"]
+    rest_fields = _sh_rest_fields(vertices)
+    sh_rest = (
+        np.stack([vertices[n] for n in rest_fields], axis=1)
+        if rest_fields
+        else np.zeros((len(vertices), 0), dtype=np.float32)
+    )
+
+    if quantization == "none":
+        return {
+            "positions": positions.astype(np.float32),
+            "scales": scales.astype(np.float32),
+            "rotations": rotations.astype(np.float32),
+            "colors": colors.astype(np.float32),
+            "opacity": opacity.astype(np.float32),
+            "sh_rest": sh_rest.astype(np.float32),
+        }
+
+    packed = {
+        "positions": positions.astype(np.float16),
+        "scales": scales.astype(np.float16),
+    }
+    if quantization == "half":
+        packed.update(
+            rotations=rotations.astype(np.float16),
+            colors=colors.astype(np.float16),
+            opacity=opacity.astype(np.float16),
+            sh_rest=sh_rest.astype(np.float16),
+        )
+        return packed
+
+    norms = np.linalg.norm(rotations, axis=1, keepdims=True)
+    unit_rotations = rotations / np.where(norms == 0, 1, norms)
+    rgb = np.clip(0.5 + SH_C0 * colors, 0.0, 1.0)
+    alpha = 1.0 / (1.0 + np.exp(-opacity.astype(np.float64)))
+    packed.update(
+        rotations=np.round((unit_rotations + 1.0) * 127.5).astype(np.uint8),
+        colors=np.round(rgb * 255).astype(np.uint8),
+        opacity=np.round(alpha * 255).astype(np.uint8),
+        sh_rest=np.round((np.clip(sh_rest, -1.0, 1.0) + 1.0) * 127.5).astype(np.uint8),
+    )
+    return packed
+
+
+# Attribute components per splat, besides the SH rest coefficients.
+_FLOAT16_COMPONENTS = 3 + 3  # positions and scales, kept as float16 by "8bit"
+_PACKED_COMPONENTS = 4 + 3 + 1  # rotations, colors and opacity
+
+
+def quantized_size(count: int, sh_rest_count: int, quantization: str) -> int:
+    """Returns the bytes `quantize` packs `count` splats into, without packing them.
+
+    Args:
+        count: Number of splats.
+        sh_rest_count: Number of f_rest_* coefficients per splat.
+        quantization: "none", "half" or "8bit".
+    """
+    components = _FLOAT16_COMPONENTS + _PACKED_COMPONENTS + sh_rest_count
+    if quantization == "none":
+        return count * components * 4
+    if quantization == "half":
+        return count * components * 2
+    return count * (_FLOAT16_COMPONENTS * 2 + _PACKED_COMPONENTS + sh_rest_count)
+
+
+def prune_vertices(vertices: np.ndarray, preset: PrunePreset) -> np.ndarray:
+    """Applies the opacity and bounding volume filters and SH truncation of `preset`."""
+    keep = opacity_mask(vertices, preset.min_opacity)
+    keep &= bounds_mask(vertices, preset.bounds_percentile)
+    pruned = vertices[keep]
+    if preset.sh_degree is not None:
+        pruned = truncate_sh(pruned, preset.sh_degree)
+    return pruned
+
+
+def prune_splat(input_path: Path, output_path: Path, preset: PrunePreset) -> PruneStats:
+    """Prunes a brush PLY export and writes the result to `output_path`.
+
+    Args:
+        input_path: Path to the PLY exported by brush.
+        output_path: Path to write the pruned PLY to. May equal `input_path`,
+            which loses the full-precision export.
+        preset: The pruning preset to apply.
+
+    Returns:
+        Splat counts and sizes before and after pruning.
+    """
+    bytes_before = input_path.stat().st_size
+    vertices = read_ply(input_path)
+    pruned = prune_vertices(vertices, preset)
+    write_ply(output_path, pruned)
+
+    stats = PruneStats(
+        count_before=len(vertices),
+        count_after=len(pruned),
+        bytes_before=bytes_before,
+        bytes_after=output_path.stat().st_size,
+        quantized_bytes=quantized_size(
+            len(pruned), len(_sh_rest_fields(pruned)), preset.quantization
+        ),
+        sh_degree=sh_degree_of(pruned),
+    )
+    LOGGER.info(
+        "Pruned splat %s from %d to %d splats (%d -> %d bytes, %d bytes quantized)",
+        input_path,
+        stats.count_before,
+        stats.count_after,
+        stats.bytes_before,
+        stats.bytes_after,
+        stats.quantized_bytes,
+    )
+    return stats
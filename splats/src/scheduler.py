@@ -0,0 +1,410 @@
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zipfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from fastapi import HTTPException, status
+
+from src.dependencies import ALLOWED_IMAGE_EXTS, probe_video
+from src.frame_extraction.frame_extraction import NUM_FRAMES_TARGET
+from src.job_store import JobStore, StoredJob
+from src.jobs import update_job
+
+LOGGER = logging.getLogger(__name__)
+
+STAGES = ("frames", "colmap", "brush", "postprocess")
+# Seconds per stage as intercept + per image + per image-megapixel, used until
+# enough jobs have finished to fit the model.
+DEFAULT_STAGE_COEFFICIENTS = {
+    "frames": (10.0, 0.1, 0.05),
+    "colmap": (30.0, 1.5, 0.3),
+    "brush": (600.0, 0.5, 0.1),
+    "postprocess": (30.0, 0.0, 0.0),
+}
+MIN_FIT_SAMPLES = 8
+MAX_HISTORY = 500
+DEFAULT_MEGAPIXELS = 1920 * 1080 / 1e6
+
+# Estimated seconds of queued and running work above which new jobs get a 429.
+MAX_BACKLOG_SECONDS = float(os.getenv("SCHEDULER_MAX_BACKLOG_SECONDS", 4 * 60 * 60))
+# How far back a client's started jobs count against its fair share.
+FAIR_SHARE_WINDOW_SECONDS = float(
+    os.getenv("SCHEDULER_FAIR_SHARE_WINDOW_SECONDS", 60 * 60)
+)
+PRIORITIES = {"low": -1, "normal": 0, "high": 1}
+# How long a worker holds a job without heartbeating before it is requeued.
+LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", 120))
+
+
+@dataclass
+class JobFeatures:
+    """What the cost of a job is estimated from."""
+
+    images: int
+    megapixels: float
+
+    def vector(self) -> np.ndarray:
+        return np.array([1.0, self.images, self.images * self.megapixels])
+
+
+def _frame_rate(rate: Optional[str]) -> Optional[float]:
+    try:
+        num, _, den = (rate or "").partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def video_features(path: Path) -> JobFeatures:
+    """Estimates the number and size of the frames extracted from a video."""
+    probe = probe_video(path) or {}
+    frames = None
+    try:
+        frames = int(probe["nb_frames"])
+    except (KeyError, TypeError, ValueError):
+        duration = probe.get("duration") or probe.get("format_duration")
+        fps = _frame_rate(probe.get("avg_frame_rate"))
+        try:
+            if duration is not None and fps:
+                frames = int(float(duration) * fps)
+        except ValueError:
+            pass
+    if not frames:
+        frames = NUM_FRAMES_TARGET
+
+    # mirrors the thumbnail spacing of extract_frames_ffmpeg
+    spacing = frames // NUM_FRAMES_TARGET
+    images = math.ceil(frames / spacing) if spacing > 1 else frames
+    if probe.get("width") and probe.get("height"):
+        megapixels = probe["width"] * probe["height"] / 1e6
+    else:
+        megapixels = DEFAULT_MEGAPIXELS
+    return JobFeatures(images=images, megapixels=megapixels)
+
+
+def archive_features(archive: Union[Path, BinaryIO]) -> JobFeatures:
+    """Counts the images of a ZIP archive and decodes the first one for its size."""
+    with zipfile.ZipFile(archive) as z:
+        images = [
+            info
+            for info in z.infolist()
+            if not info.is_dir()
+            and os.path.splitext(info.filename)[1].lower() in ALLOWED_IMAGE_EXTS
+        ]
+        megapixels = DEFAULT_MEGAPIXELS
+        if images:
+            import cv2  # kept out of the API's startup
+
+            image = cv2.imdecode(
+                np.frombuffer(z.read(images[0]), dtype=np.uint8), cv2.IMREAD_UNCHANGED
+            )
+            if image is not None:
+                megapixels = image.shape[0] * image.shape[1] / 1e6
+    return JobFeatures(images=len(images), megapixels=megapixels)
+
+
+class CostModel:
+    """Estimates the seconds a job spends in each pipeline stage.
+
+    Each stage is a linear model of the image count and total megapixels, fitted
+    by least squares on the stage timings of the last `MAX_HISTORY` finished jobs.
+    Timings are kept as JSON lines in `history_path` so the fit survives restarts.
+    """
+
+    def __init__(self, history_path: Path):
+        self.history_path = history_path
+        self.coefficients = {
+            stage: np.array(c) for stage, c in DEFAULT_STAGE_COEFFICIENTS.items()
+        }
+        self._history: List[dict] = []
+        self._loaded_version: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self._reload_if_changed()
+
+    def estimate(self, features: JobFeatures, stages: Sequence[str] = STAGES) -> float:
+        self._reload_if_changed()
+        x = features.vector()
+        return sum(max(0.0, float(self.coefficients[stage] @ x)) for stage in stages)
+
+    def record(self, features: JobFeatures, timings: Dict[str, float]):
+        """Adds the stage timings of a finished job and refits the model."""
+        entry = {
+            **asdict(features),
+            "timings": {s: float(t) for s, t in timings.items() if s in STAGES},
+        }
+        with self._lock:
+            with open(self.history_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        self._reload_if_changed()
+
+    def _reload_if_changed(self):
+        # workers on other nodes append to the same file
+        try:
+            stat_result = self.history_path.stat()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if (stat_result.st_mtime_ns, stat_result.st_size) != self._loaded_version:
+                self._loaded_version = (stat_result.st_mtime_ns, stat_result.st_size)
+                self._load()
+
+    def _load(self):
+        try:
+            lines = self.history_path.read_text().splitlines()
+        except FileNotFoundError:
+            return
+        self._history = []
+        for line in lines:
+            try:
+                self._history.append(json.loads(line))
+            except json.JSONDecodeError:
+                LOGGER.warning(
+                    "Skipping corrupt timing record in %s", self.history_path
+                )
+        self._history = self._history[-MAX_HISTORY:]
+        if len(lines) > 2 * MAX_HISTORY:
+            self.history_path.write_text(
+                "".join(json.dumps(entry) + "\n" for entry in self._history)
+            )
+        self._fit()
+
+    def _fit(self):
+        for stage in STAGES:
+            samples = [h for h in self._history if stage in h["timings"]]
+            if len(samples) < MIN_FIT_SAMPLES:
+                continue
+            x = np.stack(
+                [JobFeatures(h["images"], h["megapixels"]).vector() for h in samples]
+            )
+            y = np.array([h["timings"][stage] for h in samples])
+            self.coefficients[stage], *_ = np.linalg.lstsq(x, y, rcond=None)
+
+
+class Scheduler:
+    """Admits pipeline jobs into the job store and orders them by weighted fair share.
+
+    The next job is the one that would leave its client with the least estimated
+    pipeline time used over the last `fair_share_window` seconds, that time
+    divided by 2 ** the job's priority; ties go to the oldest job. A high
+    priority job thus runs ahead of a normal one of the same estimated cost even
+    from a client with no usage, without starving other clients. A job is refused with
+    429 and a Retry-After when the queue would take longer than
+    `max_backlog_seconds` to drain on the live workers.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        cost_model: CostModel,
+        max_backlog_seconds: float = MAX_BACKLOG_SECONDS,
+        fair_share_window: float = FAIR_SHARE_WINDOW_SECONDS,
+        lease_seconds: float = LEASE_SECONDS,
+    ):
+        self.store = store
+        self.cost_model = cost_model
+        self.max_backlog_seconds = max_backlog_seconds
+        self.fair_share_window = fair_share_window
+        self.lease_seconds = lease_seconds
+
+    def submit(
+        self,
+        job_dir: Path,
+        task: str,
+        *args,
+        client_id: str,
+        features: JobFeatures,
+        priority: int = 0,
+        stages: Sequence[str] = STAGES,
+        estimate: Optional[float] = None,
+    ) -> str:
+        """Queues a pipeline task, or refuses it if the backlog is full.
+
+        Args:
+            job_dir: The job's directory; its name is the job ID.
+            task: Name of the task a worker runs, see `src.worker.TASKS`.
+            args: JSON-serialisable arguments of the task.
+            client_id: Who submitted the job, for fair sharing.
+            features: Probe data the job's cost is estimated from.
+            priority: Weight of the job's client, see PRIORITIES.
+            stages: The pipeline stages the task runs.
+            estimate: The job's estimated seconds from an earlier `admit`; the
+                job is then queued without being admitted again.
+
+        Returns:
+            The job ID.
+
+        Raises:
+            HTTPException: 429 if the estimated backlog exceeds the budget.
+        """
+        if estimate is None:
+            estimate = self.admit(features, stages)
+        update_job(
+            job_dir,
+            status="queued",
+            queued_at=time.time(),
+            client_id=client_id,
+            priority=priority,
+            features=asdict(features),
+            estimated_seconds=estimate,
+        )
+        self.store.enqueue(
+            job_dir.name,
+            job_dir,
+            task,
+            list(args),
+            client_id,
+            priority,
+            asdict(features),
+            estimate,
+        )
+        return job_dir.name
+
+    def admit(self, features: JobFeatures, stages: Sequence[str] = STAGES) -> float:
+        """Checks that a job would be accepted, without queueing it.
+
+        Returns:
+            The job's estimated seconds.
+
+        Raises:
+            HTTPException: 429 if the estimated backlog exceeds the budget.
+        """
+        estimate = self.cost_model.estimate(features, stages)
+        queued, running = self.store.active()
+        workers = self._workers(running)
+        backlog = self._backlog(queued, running, time.time()) / workers
+        wait = backlog + estimate / workers
+        if (queued or running) and wait > self.max_backlog_seconds:
+            retry_after = math.ceil(wait - self.max_backlog_seconds)
+            LOGGER.warning(
+                "Refusing job: backlog %.0fs + %.0fs on %d workers exceeds %.0fs",
+                backlog,
+                estimate,
+                workers,
+                self.max_backlog_seconds,
+            )
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="The processing queue is full, try again later",
+                headers={"Retry-After": str(retry_after)},
+            )
+        return estimate
+
+    def backlog_seconds(self) -> float:
+        """Returns how long the queue takes to drain on the live workers."""
+        queued, running = self.store.active()
+        return self._backlog(queued, running, time.time()) / self._workers(running)
+
+    def eta(self, job_id: str) -> Optional[dict]:
+        """Returns the queue position and estimated start and completion of a job.
+
+        Returns:
+            The estimate, or None if the job is neither queued nor running.
+        """
+        queued, running = self.store.active()
+        now = time.time()
+        for job in running:
+            if job.id == job_id:
+                return {
+                    "queue_position": 0,
+                    "estimated_seconds": job.estimated_seconds,
+                    "estimated_completion_at": now + job.remaining_seconds(now),
+                }
+
+        # when each worker frees up, running jobs first
+        free_at = [now + job.remaining_seconds(now) for job in running]
+        free_at += [now] * (self._workers(running) - len(free_at))
+        heapq.heapify(free_at)
+        recent = self.store.recent_starts(now - self.fair_share_window)
+        for position, job in enumerate(self.order(queued, recent, now), start=1):
+            start = heapq.heappop(free_at)
+            heapq.heappush(free_at, start + job.estimated_seconds)
+            if job.id == job_id:
+                return {
+                    "queue_position": position,
+                    "estimated_seconds": job.estimated_seconds,
+                    "estimated_start_at": start,
+                    "estimated_completion_at": start + job.estimated_seconds,
+                }
+        return None
+
+    def claim(self, worker_id: str) -> Optional[StoredJob]:
+        """Leases the next job in fair-share order to a worker."""
+        return self.store.claim(
+            worker_id,
+            self.lease_seconds,
+            lambda queued, recent, now: self.order(queued, recent, now)[0],
+            self.fair_share_window,
+        )
+
+    def wait(self, job_id: str, poll_interval: float = 1.0) -> dict:
+        """Blocks until a job finishes and returns its result.
+
+        Raises:
+            HTTPException: With the job's error if it failed.
+        """
+        while True:
+            job = self.store.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="Job not found")
+            if job.status == "done":
+                return job.result or {}
+            if job.status == "failed":
+                raise HTTPException(
+                    status_code=job.error_status
+                    or status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=job.error,
+                )
+            time.sleep(poll_interval)
+
+    def order(
+        self,
+        queued: List[StoredJob],
+        recent: List[Tuple[float, str, float]],
+        now: float,
+    ) -> List[StoredJob]:
+        """Returns the queued jobs in the order they will run.
+
+        Args:
+            queued: The queued jobs.
+            recent: (started_at, client_id, estimated_seconds) of recently started jobs.
+            now: The current time.
+        """
+        usage: Dict[str, float] = {}
+        for started_at, client_id, seconds in recent:
+            if now - started_at < self.fair_share_window:
+                usage[client_id] = usage.get(client_id, 0.0) + seconds
+
+        pending = list(queued)
+        order = []
+        while pending:
+            job = min(
+                pending,
+                key=lambda j: (
+                    (usage.get(j.client_id, 0.0) + j.estimated_seconds) / 2**j.priority,
+                    j.submitted_at,
+                ),
+            )
+            pending.remove(job)
+            order.append(job)
+            usage[job.client_id] = usage.get(job.client_id, 0.0) + job.estimated_seconds
+        return order
+
+    def _workers(self, running: List[StoredJob]) -> int:
+        live = self.store.live_workers(within=self.lease_seconds)
+        return max(1, live, len(running))
+
+    @staticmethod
+    def _backlog(
+        queued: List[StoredJob], running: List[StoredJob], now: float
+    ) -> float:
+        return sum(job.estimated_seconds for job in queued) + sum(
+            job.remaining_seconds(now) for job in running
+        )
@@ -0,0 +1,566 @@
+"""HTTP file serving shared by the splats API and ark: Range, conditional and
+precompressed responses, and recording when a job's artifacts are downloaded.
+
+This is the only copy: ark/src/ark/serving.py is a symlink to it, and ark's
+Docker image, built from the repository root, copies this file in its place.
+It must therefore import nothing from either service.
+"""
+
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 1024 * 1024  # 1 MiB per read when zero-copy is unavailable
+MAX_RANGES = 64
+# ASGI extension servers implement with sendfile(2). uvicorn, which both services
+# run, does not offer it, so there bytes are always read and sent by Python.
+ZEROCOPY_EXTENSION = "http.response.zerocopy"
+
+# Precompressed siblings of a file (e.g. scene.ksplat.br), in server preference order
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+
+# Touched in a job directory whenever either server serves the job's artifacts;
+# the storage sweep of splats evicts the least recently accessed jobs first.
+ACCESS_MARKER_FILENAME = "last_access"
+ACCESS_RECORD_INTERVAL_SECONDS = 60.0
+
+ByteRange = Tuple[int, int]
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def make_etag(
+    stat_result: os.stat_result, offset: int = 0, length: Optional[int] = None
+) -> str:
+    if offset or length is not None:
+        # a slice of the file, e.g. one LOD chunk
+        return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}-{offset:x}-{length or 0:x}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range_header(
+    range_header: str, file_size: int, open_ended_limit: Optional[int] = None
+) -> Optional[List[ByteRange]]:
+    """Parses a `Range: bytes=...` header into inclusive byte ranges.
+
+    Supports single, multiple and suffix (`bytes=-N`) ranges. Overlapping or
+    adjacent ranges are coalesced.
+
+    Args:
+        range_header: Value of the Range header.
+        file_size: Size of the file being served.
+        open_ended_limit: If set, open-ended ranges (`bytes=N-`) are cut to at most
+            this many bytes; the client asks for the rest with a new request.
+
+    Returns:
+        The sorted ranges, or None if the header is malformed and must be ignored.
+
+    Raises:
+        RangeNotSatisfiable: If none of the ranges overlap the file.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges: List[ByteRange] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start_str, sep, end_str = (s.strip() for s in part.partition("-"))
+        if not sep or not (start_str or end_str):
+            return None
+        if (start_str and not start_str.isdigit()) or (
+            end_str and not end_str.isdigit()
+        ):
+            return None
+
+        if not start_str:
+            suffix_length = int(end_str)
+            if suffix_length > 0 and file_size > 0:
+                ranges.append((max(0, file_size - suffix_length), file_size - 1))
+            continue
+
+        start = int(start_str)
+        if end_str and int(end_str) < start:
+            return None
+        if end_str:
+            end = min(int(end_str), file_size - 1)
+        elif open_ended_limit is not None:
+            end = min(start + open_ended_limit - 1, file_size - 1)
+        else:
+            end = file_size - 1
+        if start < file_size:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    coalesced = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = coalesced[-1]
+        if start <= last_end + 1:
+            coalesced[-1] = (last_start, max(last_end, end))
+        else:
+            coalesced.append((start, end))
+    if len(coalesced) > MAX_RANGES:
+        return None
+    return coalesced
+
+
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Evaluates If-None-Match, falling back to If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def if_range_matches(request: Request, etag: str, mtime: float) -> bool:
+    """Returns False if an If-Range validator no longer matches the file."""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    since = _parse_http_date(if_range)
+    return since is not None and int(mtime) == int(since)
+
+
+def acceptable_encodings(accept_encoding: Optional[str], offered) -> List[str]:
+    """Ranks the `offered` content codings by the client's Accept-Encoding.
+
+    Args:
+        accept_encoding: Value of the Accept-Encoding header.
+        offered: Codings the server can send, in server preference order.
+
+    Returns:
+        The acceptable codings, best first. Identity is not included.
+    """
+    if not accept_encoding:
+        return []
+    weights = {}
+    for item in accept_encoding.split(","):
+        token, *params = (p.strip() for p in item.split(";"))
+        if not token:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[token.lower()] = weight
+
+    ranked = []
+    for preference, coding in enumerate(offered):
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > 0:
+            ranked.append((-weight, preference, coding))
+    return [coding for _, _, coding in sorted(ranked)]
+
+
+def precompressed_variants(
+    request: Request, path: Path
+) -> List[Tuple[Path, Optional[str]]]:
+    """Lists the representations of `path` the client accepts, best first.
+
+    The last entry is always the identity representation `(path, None)`. Variants
+    are not checked for existence; callers fall through to the next one.
+    """
+    codings = acceptable_encodings(
+        request.headers.get("accept-encoding"), PRECOMPRESSED_SUFFIXES
+    )
+    variants = [
+        (path.with_name(path.name + PRECOMPRESSED_SUFFIXES[coding]), coding)
+        for coding in codings
+    ]
+    return variants + [(path, None)]
+
+
+class AccessRecorder:
+    """Records downloads of a job in the mtime of its access marker, at most once
+    per `interval` per job so that hot jobs cost no writes."""
+
+    def __init__(
+        self, storage_dir: Path, interval: float = ACCESS_RECORD_INTERVAL_SECONDS
+    ):
+        self.storage_dir = storage_dir
+        self.interval = interval
+        self._recorded: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, job_id: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        if job_id.startswith(".") or "/" in job_id:
+            return
+        with self._lock:
+            if now - self._recorded.get(job_id, -self.interval) < self.interval:
+                return
+            self._recorded[job_id] = now
+        try:
+            (self.storage_dir / job_id / ACCESS_MARKER_FILENAME).touch()
+        except OSError:
+            pass  # e.g. the job is gone; a missed access only makes eviction earlier
+
+
+class CachedFile:
+    """Keeps a frequently served file open and its stat result cached.
+
+    The file is re-stat'ed at most every `revalidate_after` seconds and reopened
+    when it was replaced or modified. A replaced file object is not closed
+    explicitly: responses still streaming from it hold a reference, and it is
+    closed once the last of them is done.
+    """
+
+    def __init__(self, path: Path, revalidate_after: float = 1.0):
+        self.path = path
+        self.revalidate_after = revalidate_after
+        self._file = None
+        self._stat: Optional[os.stat_result] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the open file object and its stat result.
+
+        Raises:
+            FileNotFoundError: If the file does not exist (anymore).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._file is None or now - self._checked_at >= self.revalidate_after:
+                stat_result = os.stat(self.path)
+                if self._stat is None or (
+                    stat_result.st_ino,
+                    stat_result.st_size,
+                    stat_result.st_mtime_ns,
+                ) != (self._stat.st_ino, self._stat.st_size, self._stat.st_mtime_ns):
+                    self._file = open(self.path, "rb", buffering=0)
+                self._stat = stat_result
+                self._checked_at = now
+            return self._file, self._stat
+
+
+class JsonFileCache:
+    """Keeps the parsed content of small JSON files, such as LOD manifests.
+
+    A file is re-stat'ed on every lookup and parsed again only when it was
+    replaced or modified. The least recently used entries beyond `max_entries`
+    are dropped.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Path, Tuple[tuple, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> Any:
+        """Returns the parsed file.
+
+        Raises:
+            FileNotFoundError: If the file does not exist (anymore).
+        """
+        stat_result = os.stat(path)
+        key = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                return entry[1]
+        value = json.loads(Path(path).read_bytes())
+        with self._lock:
+            self._entries[path] = (key, value)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+def _body_parts(ranges: Optional[List[ByteRange]], size: int, media_type: str):
+    """Lays out the body for the selected ranges.
+
+    Returns:
+        The status code, content type, extra headers, `(prefix, start, end)` parts
+        and the trailer to send after the last part.
+    """
+    if ranges is None:
+        return 200, media_type, {}, [(b"", 0, size - 1)], b""
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers = {"Content-Range": f"bytes {start}-{end}/{size}"}
+        return 206, media_type, headers, [(b"", start, end)], b""
+
+    boundary = secrets.token_hex(16)
+    parts = [
+        (
+            (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode("latin-1"),
+            start,
+            end,
+        )
+        for start, end in ranges
+    ]
+    trailer = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    return 206, f"multipart/byteranges; boundary={boundary}", {}, parts, trailer
+
+
+class RangeFileResponse(Response):
+    """Streams a whole file, one byte range or a multipart/byteranges body.
+
+    With an `offset` and `size`, the representation is that slice of the file
+    and the ranges are relative to it.
+
+    Bytes are handed to the server with the ASGI zero-copy extension when it is
+    offered, so they never enter Python; otherwise, as under uvicorn, they are
+    read with positional reads in a worker thread, off the event loop. An already
+    open `file` (e.g. from a `CachedFile`) is used as is and left open.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        stat_result: os.stat_result,
+        ranges: Optional[List[ByteRange]] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: str = "application/octet-stream",
+        file=None,
+        offset: int = 0,
+        size: Optional[int] = None,
+    ):
+        self.path = path
+        self.file = file
+        self.offset = offset
+        self.background = None
+        self.status_code, self.media_type, range_headers, self.parts, self.trailer = (
+            _body_parts(
+                ranges, stat_result.st_size if size is None else size, media_type
+            )
+        )
+        headers = {**(headers or {}), **range_headers}
+        content_length = len(self.trailer) + sum(
+            len(prefix) + end - start + 1 for prefix, start, end in self.parts
+        )
+        headers["Content-Length"] = str(content_length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        zerocopy = ZEROCOPY_EXTENSION in (scope.get("extensions") or {})
+        f = self.file or await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            for prefix, start, end in self.parts:
+                if prefix:
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": prefix,
+                            "more_body": True,
+                        }
+                    )
+                await self._send_range(
+                    send, f, self.offset + start, end - start + 1, zerocopy
+                )
+        finally:
+            if f is not self.file:
+                f.close()
+        await send(
+            {"type": "http.response.body", "body": self.trailer, "more_body": False}
+        )
+
+    @staticmethod
+    async def _send_range(send: Send, f, offset: int, count: int, zerocopy: bool):
+        if count <= 0:
+            return
+        if zerocopy:
+            await send(
+                {
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": f,
+                    "offset": offset,
+                    "count": count,
+                    "more_body": True,
+                }
+            )
+            return
+        fd = f.fileno()
+        while count > 0:
+            data = await anyio.to_thread.run_sync(
+                os.pread, fd, min(CHUNK_SIZE, count), offset
+            )
+            if not data:
+                break
+            offset += len(data)
+            count -= len(data)
+            await send({"type": "http.response.body", "body": data, "more_body": True})
+
+
+def evaluate_request(
+    request: Request,
+    size: int,
+    etag: str,
+    mtime: float,
+    headers: Optional[Mapping[str, str]] = None,
+    open_ended_limit: Optional[int] = None,
+) -> Tuple[Optional[Response], Optional[List[ByteRange]], dict]:
+    """Applies the conditional and Range headers of a request for a representation.
+
+    Returns:
+        A 304/416 response if the request is answered without a body (else None),
+        the byte ranges to send (None for the whole representation) and the
+        validator headers to send with the body.
+    """
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        **(headers or {}),
+    }
+
+    if is_not_modified(request, etag, mtime):
+        return (
+            Response(status_code=304, headers=response_headers),
+            None,
+            response_headers,
+        )
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header and if_range_matches(request, etag, mtime):
+        try:
+            ranges = parse_range_header(range_header, size, open_ended_limit)
+        except RangeNotSatisfiable:
+            unsatisfiable = Response(
+                status_code=416,
+                headers={**response_headers, "Content-Range": f"bytes */{size}"},
+            )
+            return unsatisfiable, None, response_headers
+    return None, ranges, response_headers
+
+
+def file_response(
+    request: Request,
+    path: Path,
+    media_type: str = "application/octet-stream",
+    headers: Optional[Mapping[str, str]] = None,
+    stat_result: Optional[os.stat_result] = None,
+    file=None,
+    open_ended_limit: Optional[int] = None,
+    offset: int = 0,
+    length: Optional[int] = None,
+) -> Response:
+    """Serves a file with Range, If-Range and conditional (304) request support.
+
+    Args:
+        request: The incoming request.
+        path: Path to the file to serve.
+        media_type: Content type of the file.
+        headers: Extra response headers, e.g. Content-Disposition.
+        stat_result: The file's stat result, if the caller already has it.
+        file: An open file object to serve from instead of opening `path`.
+        open_ended_limit: Maximum bytes returned for an open-ended range.
+        offset: Start of the slice of the file to serve, e.g. one LOD chunk.
+        length: Length of that slice; the rest of the file by default.
+
+    Returns:
+        A 200, 206, 304 or 416 response.
+    """
+    stat_result = stat_result or os.stat(path)
+    size = stat_result.st_size - offset if length is None else length
+    early_response, ranges, response_headers = evaluate_request(
+        request,
+        size,
+        make_etag(stat_result, offset, length),
+        stat_result.st_mtime,
+        headers,
+        open_ended_limit,
+    )
+    if early_response is not None:
+        return early_response
+    return RangeFileResponse(
+        path, stat_result, ranges, response_headers, media_type, file, offset, size
+    )
+
+
+def memory_response(
+    request: Request,
+    data: bytes,
+    etag: str,
+    mtime: float,
+    media_type: str = "application/octet-stream",
+    headers: Optional[Mapping[str, str]] = None,
+    open_ended_limit: Optional[int] = None,
+) -> Response:
+    """Serves an in-memory copy of a file with the same semantics as `file_response`.
+
+    Args:
+        request: The incoming request.
+        data: The file contents.
+        etag: ETag of the contents.
+        mtime: Modification time of the contents.
+        media_type: Content type of the contents.
+        headers: Extra response headers, e.g. Content-Disposition.
+        open_ended_limit: Maximum bytes returned for an open-ended range.
+
+    Returns:
+        A 200, 206, 304 or 416 response.
+    """
+    early_response, ranges, response_headers = evaluate_request(
+        request, len(data), etag, mtime, headers, open_ended_limit
+    )
+    if early_response is not None:
+        return early_response
+
+    status_code, content_type, range_headers, parts, trailer = _body_parts(
+        ranges, len(data), media_type
+    )
+    if ranges is None:
+        body = data
+    else:
+        view = memoryview(data)
+        body = b"".join(prefix + view[start : end + 1] for prefix, start, end in parts)
+        body += trailer
+    return Response(
+        body,
+        status_code=status_code,
+        headers={**response_headers, **range_headers},
+        media_type=content_type,
+    )
@@ -0,0 +1,104 @@
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+# Processes running the CPU-bound, vision heavy parts of pipeline stages. They
+# import these modules once, when started, and are reused across jobs.
+STAGE_PROCESSES = int(os.getenv("SPLAT_STAGE_PROCESSES", min(os.cpu_count() or 2, 8)))
+WARM_MODULES = (
+    "numpy",
+    "cv2",
+    "src.frame_extraction.mask",
+    "src.frame_extraction.normalize",
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _warm_up(modules):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            LOGGER.warning("Could not preload %s: %s", module, e)
+
+
+def _started() -> int:
+    return os.getpid()
+
+
+def stage_pool() -> ProcessPoolExecutor:
+    """Returns the process pool, creating it on first use.
+
+    Processes are spawned rather than forked, since the API and workers run
+    threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=STAGE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+                initargs=(WARM_MODULES,),
+            )
+        return _pool
+
+
+def warm_stage_pool():
+    """Starts every stage process now, so no job waits for their imports."""
+    pool = stage_pool()
+    # a process is spawned per task while none is idle
+    futures = [pool.submit(_started) for _ in range(STAGE_PROCESSES)]
+    wait(futures)
+    LOGGER.info("Warmed %d stage processes", len({f.result() for f in futures}))
+
+
+def _reset_if_broken(
+    pool: ProcessPoolExecutor, call: Callable[[ProcessPoolExecutor], Any]
+):
+    global _pool
+    try:
+        return call(pool)
+    except BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
+
+def run_in_stage_pool(fn: Callable[..., Any], *args) -> Any:
+    """Runs a picklable, module-level `fn(*args)` in a stage process.
+
+    Raises:
+        Whatever `fn` raised, or BrokenProcessPool if its process died, after
+        which the next call starts a new pool.
+    """
+    return _reset_if_broken(stage_pool(), lambda pool: pool.submit(fn, *args).result())
+
+
+def map_in_stage_pool(
+    fn: Callable[[Any], Any], items: Iterable[Any], chunksize: int = 1
+) -> Iterator[Any]:
+    """Maps a picklable, module-level `fn` over `items` in the stage processes,
+    yielding the results in order."""
+    # results arrive lazily, so the whole iteration resets a broken pool
+    yield from _reset_if_broken(
+        stage_pool(), lambda pool: list(pool.map(fn, items, chunksize=chunksize))
+    )
+
+
+def shutdown_stage_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
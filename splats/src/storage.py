@@ -0,0 +1,427 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import ContextManager, Dict, List, Optional
+
+from src.database import Database
+from src.events import EVENTS_FILENAME
+from src.jobs import JOB_METADATA_FILENAME, read_job, update_job
+from src.pipeline import STOP_FLAG_FILENAME
+from src.post_processing import fail_stale_mesh
+from src.serving import ACCESS_MARKER_FILENAME, PRECOMPRESSED_SUFFIXES, AccessRecorder
+from src.uploads import UPLOAD_TTL_SECONDS, expire_sessions
+
+LOGGER = logging.getLogger(__name__)
+
+# Frames, masks and the original upload of finished jobs are kept this long.
+KEEP_INPUTS_DAYS = float(os.getenv("SPLAT_KEEP_INPUTS_DAYS", 7))
+# The brush PLY is only needed to re-run post processing, e.g. with another preset.
+KEEP_PLY = os.getenv("SPLAT_KEEP_PLY", "0").lower() in ("1", "true", "yes")
+# Above this many bytes of job data, the least recently downloaded jobs are
+# evicted until usage is back under the low-water mark. 0 disables the quota.
+STORAGE_QUOTA_BYTES = int(float(os.getenv("SPLAT_STORAGE_QUOTA_GB", 0)) * 1024**3)
+QUOTA_LOW_WATER = 0.9
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SPLAT_STORAGE_SWEEP_SECONDS", 5 * 60))
+
+# Files never removed from a job directory, so its status stays readable.
+METADATA_FILENAMES = (JOB_METADATA_FILENAME, EVENTS_FILENAME, ACCESS_MARKER_FILENAME)
+SPARSE_ARCHIVE_NAME = "sparse.tar.gz"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS storage (
+    job_id TEXT PRIMARY KEY,
+    status TEXT,
+    bytes INTEGER NOT NULL,
+    metadata_mtime REAL NOT NULL,
+    finished_at REAL,
+    last_access REAL,
+    compacted_at REAL,
+    inputs_removed_at REAL,
+    evicted_at REAL,
+    mesh_pending INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    keep_inputs_seconds: float = KEEP_INPUTS_DAYS * 24 * 60 * 60
+    keep_ply: bool = KEEP_PLY
+    quota_bytes: int = STORAGE_QUOTA_BYTES
+    upload_ttl_seconds: float = UPLOAD_TTL_SECONDS
+
+
+@dataclass
+class JobUsage:
+    job_id: str
+    status: Optional[str]
+    bytes: int
+    metadata_mtime: float
+    finished_at: Optional[float]
+    last_access: Optional[float]
+    compacted_at: Optional[float]
+    inputs_removed_at: Optional[float]
+    evicted_at: Optional[float]
+    mesh_pending: bool
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+
+def artifact_names(job_id: str) -> List[str]:
+    """Returns the files of a done job that are served to clients."""
+    ksplat = f"{job_id}.ksplat"
+    return [
+        ksplat,
+        *(ksplat + suffix for suffix in PRECOMPRESSED_SUFFIXES.values()),
+        f"{job_id}.lod.json",
+        f"{job_id}.lod.splat",
+        f"{job_id}.glb",
+    ]
+
+
+def directory_bytes(path: Path) -> int:
+    """Sums the sizes of the files under `path`, without following symlinks."""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def last_access(job_dir: Path) -> Optional[float]:
+    """Returns when the job's artifacts were last downloaded, if ever."""
+    try:
+        return (job_dir / ACCESS_MARKER_FILENAME).stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _remove(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class StorageIndex:
+    """Per-job byte counts and lifecycle timestamps, in the shared job database."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._db = Database(db_path, SCHEMA)
+
+    def _connect(self) -> ContextManager[sqlite3.Connection]:
+        return self._db.connect()
+
+    def all(self) -> Dict[str, JobUsage]:
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM storage").fetchall()
+        return {
+            row["job_id"]: JobUsage(
+                **{**dict(row), "mesh_pending": bool(row["mesh_pending"])}
+            )
+            for row in rows
+        }
+
+    def put(self, usage: JobUsage):
+        fields = dict(vars(usage), mesh_pending=int(usage.mesh_pending))
+        columns = ", ".join(fields)
+        with self._connect() as db:
+            db.execute(
+                f"INSERT OR REPLACE INTO storage ({columns})"
+                f" VALUES ({', '.join('?' for _ in fields)})",
+                tuple(fields.values()),
+            )
+
+    def remove(self, job_ids: List[str]):
+        with self._connect() as db:
+            db.executemany(
+                "DELETE FROM storage WHERE job_id = ?", [(i,) for i in job_ids]
+            )
+
+
+class StorageManager:
+    """Compacts finished job directories and keeps the storage under its quota.
+
+    Each sweep, a finished job is compacted: its COLMAP database and brush PLY
+    are removed and its sparse model is archived, leaving the served artifacts.
+    Its frames, masks and upload follow after `keep_inputs_seconds`. When the job
+    directories exceed the quota, the least recently downloaded jobs are evicted
+    down to their metadata. Jobs that are queued, running or still exporting a
+    mesh are never touched. Outside the job directories, only upload sessions
+    in `uploads_dir` are removed, once older than the policy's upload TTL.
+    """
+
+    def __init__(
+        self,
+        storage_dir: Path,
+        index: StorageIndex,
+        policy: RetentionPolicy = RetentionPolicy(),
+        excluded: tuple = ("uploads",),
+        uploads_dir: Optional[Path] = None,
+    ):
+        self.storage_dir = storage_dir
+        self.index = index
+        self.policy = policy
+        self.excluded = set(excluded)
+        self.uploads_dir = uploads_dir
+        self.access = AccessRecorder(storage_dir)
+        self._metrics = {
+            "sweeps": 0,
+            "sweep_errors": 0,
+            "last_sweep_at": None,
+            "last_sweep_seconds": None,
+            "compacted_jobs": 0,
+            "inputs_removed_jobs": 0,
+            "evicted_jobs": 0,
+            "expired_uploads": 0,
+            "freed_bytes": 0,
+        }
+        self._lock = threading.Lock()
+
+    def record_access(self, job_id: str):
+        """Marks a job's artifacts as downloaded, which delays their eviction.
+
+        ark records its downloads in the same access marker.
+        """
+        self.access.record(job_id)
+
+    def metrics(self) -> dict:
+        usages = self.index.all().values()
+        return {
+            **self._metrics,
+            "total_bytes": sum(u.bytes for u in usages),
+            "quota_bytes": self.policy.quota_bytes or None,
+            "jobs": len(usages),
+            "jobs_by_state": {
+                state: sum(1 for u in usages if self._state(u) == state)
+                for state in ("active", "finished", "compacted", "evicted")
+            },
+        }
+
+    @staticmethod
+    def _state(usage: JobUsage) -> str:
+        if usage.evicted_at is not None:
+            return "evicted"
+        if usage.compacted_at is not None:
+            return "compacted"
+        return "finished" if usage.finished else "active"
+
+    def run(self, stop: threading.Event, interval: float = SWEEP_INTERVAL_SECONDS):
+        """Sweeps every `interval` seconds until `stop` is set."""
+        while not stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception:
+                self._metrics["sweep_errors"] += 1
+                LOGGER.error("Storage sweep failed: %s", traceback.format_exc())
+
+    def sweep(self, now: Optional[float] = None) -> dict:
+        """Indexes the job directories, compacts them and enforces the quota.
+
+        Returns:
+            The storage metrics after the sweep.
+        """
+        with self._lock:
+            start = time.monotonic()
+            now = now or time.time()
+            indexed = self.index.all()
+            seen = set()
+            for entry in os.scandir(self.storage_dir):
+                if entry.name in self.excluded or not entry.is_dir(
+                    follow_symlinks=False
+                ):
+                    continue
+                seen.add(entry.name)
+                self._sweep_job(Path(entry.path), indexed.get(entry.name), now)
+            self.index.remove([job_id for job_id in indexed if job_id not in seen])
+            self._enforce_quota(now)
+            if self.uploads_dir is not None and self.uploads_dir.is_dir():
+                expired, reserved = expire_sessions(
+                    self.uploads_dir, self.policy.upload_ttl_seconds, now
+                )
+                self._metrics["expired_uploads"] += expired
+                self._metrics["freed_bytes"] += reserved
+            self._metrics["sweeps"] += 1
+            self._metrics["last_sweep_at"] = now
+            self._metrics["last_sweep_seconds"] = time.monotonic() - start
+        return self.metrics()
+
+    def _sweep_job(self, job_dir: Path, usage: Optional[JobUsage], now: float):
+        try:
+            metadata_mtime = (job_dir / JOB_METADATA_FILENAME).stat().st_mtime
+        except FileNotFoundError:
+            return  # not a job, or not submitted yet
+        if (
+            usage is None
+            or usage.metadata_mtime != metadata_mtime
+            or not usage.finished
+            or usage.mesh_pending
+        ):
+            usage = self._read_usage(job_dir, usage, metadata_mtime)
+        elif not self._needs_inputs_removed(usage, now):
+            return  # unchanged since the last sweep
+
+        if usage.finished and usage.evicted_at is None and not usage.mesh_pending:
+            if usage.compacted_at is None:
+                self._compact(job_dir, usage, now)
+            if self._needs_inputs_removed(usage, now):
+                self._remove_inputs(job_dir, usage, now)
+        usage.bytes = directory_bytes(job_dir)
+        self.index.put(usage)
+
+    @staticmethod
+    def _read_usage(
+        job_dir: Path, usage: Optional[JobUsage], metadata_mtime: float
+    ) -> JobUsage:
+        job = read_job(job_dir) or {}
+        usage = usage or JobUsage(
+            job_id=job_dir.name,
+            status=None,
+            bytes=0,
+            metadata_mtime=metadata_mtime,
+            finished_at=None,
+            last_access=None,
+            compacted_at=None,
+            inputs_removed_at=None,
+            evicted_at=None,
+            mesh_pending=False,
+        )
+        usage.status = job.get("status")
+        usage.metadata_mtime = metadata_mtime
+        if usage.finished:
+            usage.finished_at = job.get("finished_at") or job.get("updated_at")
+        # a mesh lost with its process would hold the job back forever
+        mesh = fail_stale_mesh(job_dir, job) or {}
+        usage.mesh_pending = mesh.get("status") in ("queued", "running")
+        usage.evicted_at = job.get("evicted_at", usage.evicted_at)
+        usage.last_access = last_access(job_dir) or usage.last_access
+        return usage
+
+    def _needs_inputs_removed(self, usage: JobUsage, now: float) -> bool:
+        return (
+            usage.inputs_removed_at is None
+            and usage.finished_at is not None
+            and now - usage.finished_at >= self.policy.keep_inputs_seconds
+        )
+
+    def _compact(self, job_dir: Path, usage: JobUsage, now: float):
+        colmap_dir = job_dir / "colmap"
+        sparse_dir = colmap_dir / "sparse"
+        if sparse_dir.is_dir():
+            shutil.make_archive(
+                str(colmap_dir / SPARSE_ARCHIVE_NAME.removesuffix(".tar.gz")),
+                "gztar",
+                root_dir=colmap_dir,
+                base_dir="sparse",
+            )
+        intermediates = [colmap_dir / "database.db", sparse_dir]
+        for entry in job_dir.iterdir():
+            # besides the artifacts, the top level holds the upload, an input, and
+            # leftovers such as the PLY, previews and the stop flag
+            if self._kept(entry.name, usage.job_id):
+                continue
+            if entry.is_dir():
+                if entry.name != "colmap":
+                    intermediates.append(entry)
+            elif entry.name == STOP_FLAG_FILENAME or entry.suffix in (
+                ".ply",
+                ".ksplat",
+                ".glb",
+            ):
+                intermediates.append(entry)
+        freed = self._remove_all(intermediates)
+        usage.compacted_at = now
+        self._metrics["compacted_jobs"] += 1
+        LOGGER.info("Compacted job %s, freed %d bytes", usage.job_id, freed)
+
+    def _kept(self, name: str, job_id: str) -> bool:
+        if name.startswith(METADATA_FILENAMES) or name in artifact_names(job_id):
+            return True
+        return self.policy.keep_ply and name == f"{job_id}.ply"
+
+    def _remove_inputs(self, job_dir: Path, usage: JobUsage, now: float):
+        colmap_dir = job_dir / "colmap"
+        inputs = [
+            entry
+            for entry in job_dir.iterdir()
+            if entry.name != "colmap" and not self._kept(entry.name, usage.job_id)
+        ]
+        if colmap_dir.is_dir():
+            inputs += [e for e in colmap_dir.iterdir() if e.name != SPARSE_ARCHIVE_NAME]
+        freed = self._remove_all(inputs)
+        usage.inputs_removed_at = now
+        self._metrics["inputs_removed_jobs"] += 1
+        LOGGER.info("Removed the inputs of job %s, freed %d bytes", usage.job_id, freed)
+
+    def _enforce_quota(self, now: float):
+        quota = self.policy.quota_bytes
+        if quota <= 0:
+            return
+        usages = self.index.all()
+        total = sum(u.bytes for u in usages.values())
+        if total <= quota:
+            return
+        candidates = [
+            u
+            for u in usages.values()
+            if u.finished and u.evicted_at is None and not u.mesh_pending
+        ]
+        for usage in candidates:
+            # downloads since the job was last indexed, by either server
+            usage.last_access = (
+                last_access(self.storage_dir / usage.job_id) or usage.last_access
+            )
+        candidates.sort(key=lambda u: u.last_access or u.finished_at or 0.0)
+        target = quota * QUOTA_LOW_WATER
+        for usage in candidates:
+            if total <= target:
+                break
+            total -= self._evict(self.storage_dir / usage.job_id, usage, now)
+        if total > quota:
+            LOGGER.warning(
+                "Storage at %d bytes after eviction, over its %d quota", total, quota
+            )
+
+    def _evict(self, job_dir: Path, usage: JobUsage, now: float) -> int:
+        entries = [
+            e for e in job_dir.iterdir() if not e.name.startswith(METADATA_FILENAMES)
+        ]
+        freed = self._remove_all(entries)
+        update_job(job_dir, evicted_at=now)
+        usage.evicted_at = now
+        usage.bytes = directory_bytes(job_dir)
+        usage.metadata_mtime = (job_dir / JOB_METADATA_FILENAME).stat().st_mtime
+        self.index.put(usage)
+        self._metrics["evicted_jobs"] += 1
+        LOGGER.info("Evicted job %s, freed %d bytes", usage.job_id, freed)
+        return freed
+
+    def _remove_all(self, paths: List[Path]) -> int:
+        freed = 0
+        for path in paths:
+            if not os.path.lexists(path):
+                continue
+            freed += directory_bytes(path) if path.is_dir() else path.lstat().st_size
+            _remove(path)
+        self._metrics["freed_bytes"] += freed
+        return freed
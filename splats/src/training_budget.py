@@ -0,0 +1,126 @@
+import logging
+import os
+import struct
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+from src.brush import CHECKPOINT_STEPS, TOTAL_STEPS
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BudgetTier:
+    name: str
+    total_steps: int
+    sh_degree: int
+    # the smallest scene that needs this tier; any condition is enough
+    min_registered_images: int
+    min_points: int
+
+
+# From most to least expensive; the first tier whose minimums a scene meets is
+# used, so "draft" is only reached by downgrading under queue pressure.
+BUDGET_TIERS = (
+    BudgetTier(
+        "large", 30000, sh_degree=2, min_registered_images=300, min_points=300_000
+    ),
+    BudgetTier(
+        "medium", 15000, sh_degree=2, min_registered_images=80, min_points=60_000
+    ),
+    BudgetTier("small", 7000, sh_degree=1, min_registered_images=0, min_points=0),
+    BudgetTier("draft", 3000, sh_degree=0, min_registered_images=0, min_points=0),
+)
+# Every this many seconds of estimated backlog drops the budget one tier.
+BACKLOG_SECONDS_PER_DOWNGRADE = float(
+    os.getenv("BRUSH_BACKLOG_SECONDS_PER_DOWNGRADE", 2 * 60 * 60)
+)
+CHECKPOINT_ROUNDING = 500
+
+
+@dataclass(frozen=True)
+class TrainingBudget:
+    tier: str
+    total_steps: int
+    sh_degree: int
+    checkpoint_steps: Tuple[int, ...]
+    registered_images: Optional[int]
+    points: Optional[int]
+    backlog_seconds: float
+    downgrades: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def read_model_counts(sparse_dir: Path) -> Tuple[Optional[int], Optional[int]]:
+    """Reads the registered image and 3D point counts of a binary COLMAP model.
+
+    Both files start with their number of records as a uint64.
+
+    Returns:
+        The counts, each None if its file is missing or unreadable.
+    """
+    counts = []
+    for filename in ("images.bin", "points3D.bin"):
+        try:
+            with open(sparse_dir / filename, "rb") as f:
+                counts.append(struct.unpack("<Q", f.read(8))[0])
+        except (OSError, struct.error):
+            counts.append(None)
+    return counts[0], counts[1]
+
+
+def scale_checkpoints(total_steps: int) -> Tuple[int, ...]:
+    """Places the configured checkpoints at the same fractions of a shorter run."""
+    steps = set()
+    for step in CHECKPOINT_STEPS:
+        fraction = step / TOTAL_STEPS
+        scaled = (
+            round(fraction * total_steps / CHECKPOINT_ROUNDING) * CHECKPOINT_ROUNDING
+        )
+        steps.add(max(CHECKPOINT_ROUNDING, scaled))
+    return tuple(sorted(step for step in steps if step < total_steps)) + (total_steps,)
+
+
+def choose_budget(sparse_dir: Path, backlog_seconds: float = 0.0) -> TrainingBudget:
+    """Picks brush's step count, SH degree and checkpoints for a reconstruction.
+
+    The tier follows the size of the COLMAP model, then drops one tier for every
+    `BACKLOG_SECONDS_PER_DOWNGRADE` of estimated queue backlog.
+
+    Args:
+        sparse_dir: The COLMAP model, e.g. `colmap/sparse/0`.
+        backlog_seconds: Estimated seconds of queued work behind this job.
+    """
+    registered_images, points = read_model_counts(sparse_dir)
+    if registered_images is None and points is None:
+        index = 0  # unknown scene size, keep the full budget
+    else:
+        index = next(
+            i
+            for i, tier in enumerate(BUDGET_TIERS)
+            if (registered_images or 0) >= tier.min_registered_images
+            or (points or 0) >= tier.min_points
+        )
+
+    downgrades = 0
+    if BACKLOG_SECONDS_PER_DOWNGRADE > 0:
+        downgrades = min(
+            int(backlog_seconds // BACKLOG_SECONDS_PER_DOWNGRADE),
+            len(BUDGET_TIERS) - 1 - index,
+        )
+    tier = BUDGET_TIERS[index + downgrades]
+    budget = TrainingBudget(
+        tier=tier.name,
+        total_steps=tier.total_steps,
+        sh_degree=tier.sh_degree,
+        checkpoint_steps=scale_checkpoints(tier.total_steps),
+        registered_images=registered_images,
+        points=points,
+        backlog_seconds=backlog_seconds,
+        downgrades=downgrades,
+    )
+    LOGGER.info("Training budget: %s", budget)
+    return budget
@@ -0,0 +1,394 @@
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Literal, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from src.dependencies import (
+    MAX_VIDEO_SIZE_BYTES,
+    SNIFF_BYTES,
+    sniff_container,
+    validate_video_head,
+    validate_video_metadata,
+    validate_zip_archive,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+SESSION_FILENAME = "session.json"
+DATA_FILENAME = "data"
+CHUNKS_DIRNAME = "chunks"
+VALIDATED_FILENAME = "validated"
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MiB
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# Sessions, finished or abandoned, are removed this long after they were created.
+UPLOAD_TTL_SECONDS = float(os.getenv("SPLAT_UPLOAD_TTL_HOURS", 24)) * 60 * 60
+# Every session reserves its declared size on disk up front, so open sessions are
+# capped in number and in reserved bytes.
+MAX_OPEN_UPLOADS = int(os.getenv("SPLAT_MAX_OPEN_UPLOADS", 32))
+MAX_RESERVED_UPLOAD_BYTES = int(
+    float(os.getenv("SPLAT_MAX_RESERVED_UPLOAD_GB", 20)) * 1024**3
+)
+
+# Serializes the reservation check and the creation of a session.
+_reservation_lock = threading.Lock()
+
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    kind: Literal["video", "images_archive"]
+    content_type: Optional[str] = None
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    preset: Optional[str] = None
+
+
+def _session_dir(uploads_dir: Path, upload_id: str) -> Path:
+    if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return uploads_dir / upload_id
+
+
+def list_sessions(uploads_dir: Path) -> List[dict]:
+    """Returns the metadata of every open upload session."""
+    sessions = []
+    for session_dir in uploads_dir.iterdir():
+        if not UPLOAD_ID_PATTERN.fullmatch(session_dir.name):
+            continue
+        try:
+            sessions.append(json.loads((session_dir / SESSION_FILENAME).read_text()))
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            continue
+    return sessions
+
+
+def expire_sessions(
+    uploads_dir: Path, ttl: float = UPLOAD_TTL_SECONDS, now: Optional[float] = None
+) -> Tuple[int, int]:
+    """Removes the upload sessions created more than `ttl` seconds ago.
+
+    Returns:
+        The number of sessions removed and the bytes they had reserved.
+    """
+    now = now or time.time()
+    expired, reserved = 0, 0
+    for session_dir in uploads_dir.iterdir():
+        if not UPLOAD_ID_PATTERN.fullmatch(session_dir.name):
+            continue
+        try:
+            session = json.loads((session_dir / SESSION_FILENAME).read_text())
+            created_at, size = session["created_at"], session["size"]
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError, KeyError):
+            # interrupted while being created
+            try:
+                created_at, size = session_dir.stat().st_mtime, 0
+            except FileNotFoundError:
+                continue
+        if now - created_at < ttl:
+            continue
+        shutil.rmtree(session_dir, ignore_errors=True)
+        expired += 1
+        reserved += size
+        LOGGER.info("Expired upload session %s", session_dir.name)
+    return expired, reserved
+
+
+def _check_reservation(uploads_dir: Path, size: int):
+    sessions = list_sessions(uploads_dir)
+    if len(sessions) >= MAX_OPEN_UPLOADS:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many uploads in progress, retry later",
+            headers={"Retry-After": "60"},
+        )
+    if sum(s["size"] for s in sessions) + size > MAX_RESERVED_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+            detail="Not enough upload space reserved for this file, retry later",
+            headers={"Retry-After": "60"},
+        )
+
+
+def create_session(uploads_dir: Path, request: UploadSessionRequest) -> dict:
+    """Creates an upload session with a preallocated data file.
+
+    Expired sessions are removed first; the new one is refused while too many
+    sessions are open or their sizes would exceed the reservation budget.
+
+    Args:
+        uploads_dir: Directory holding all upload sessions.
+        request: The declared file and chunking.
+
+    Returns:
+        The session metadata.
+
+    Raises:
+        HTTPException: 429 or 507 if no room can be reserved for the upload.
+    """
+    filename = Path(request.filename).name
+    if request.kind == "video":
+        content_type = request.content_type or mimetypes.guess_type(filename)[0]
+        validate_video_metadata(filename, content_type, request.size)
+    else:
+        _, ext = os.path.splitext(filename)
+        if ext.lower() != ".zip":
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported archive format: {ext}, expected .zip",
+            )
+        if request.size > MAX_VIDEO_SIZE_BYTES:
+            raise HTTPException(status_code=400, detail="Archive too large")
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="Size must be positive")
+    if not MIN_CHUNK_SIZE <= request.chunk_size <= MAX_CHUNK_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"chunk_size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE}",
+        )
+
+    upload_id = uuid.uuid4().hex
+    session_dir = uploads_dir / upload_id
+    session = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "size": request.size,
+        "kind": request.kind,
+        "chunk_size": request.chunk_size,
+        "chunk_count": -(-request.size // request.chunk_size),
+        "preset": request.preset,
+        "created_at": time.time(),
+    }
+    with _reservation_lock:
+        expire_sessions(uploads_dir)
+        _check_reservation(uploads_dir, request.size)
+        (session_dir / CHUNKS_DIRNAME).mkdir(parents=True)
+        (session_dir / SESSION_FILENAME).write_text(json.dumps(session))
+
+    fd = os.open(session_dir / DATA_FILENAME, os.O_CREAT | os.O_WRONLY, 0o644)
+    try:
+        os.posix_fallocate(fd, 0, request.size)
+    except (AttributeError, OSError):
+        # no fallocate on this platform/filesystem; a sparse file works too
+        os.ftruncate(fd, request.size)
+    finally:
+        os.close(fd)
+    LOGGER.info(
+        "Created upload session %s for %s (%d bytes)", upload_id, filename, request.size
+    )
+    return session
+
+
+def load_session(uploads_dir: Path, upload_id: str) -> dict:
+    try:
+        return json.loads(
+            (_session_dir(uploads_dir, upload_id) / SESSION_FILENAME).read_text()
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+
+def received_chunks(uploads_dir: Path, upload_id: str) -> Dict[int, str]:
+    """Returns the SHA-256 of every chunk received so far, keyed by chunk index."""
+    chunks_dir = _session_dir(uploads_dir, upload_id) / CHUNKS_DIRNAME
+    return {
+        int(marker.name): marker.read_text()
+        for marker in chunks_dir.iterdir()
+        if marker.name.isdigit()
+    }
+
+
+def upload_status(uploads_dir: Path, session: dict) -> dict:
+    """Lists the received chunks and byte ranges of an upload session."""
+    received = sorted(received_chunks(uploads_dir, session["upload_id"]))
+    chunk_size, size = session["chunk_size"], session["size"]
+
+    ranges: List[List[int]] = []
+    for index in received:
+        start, end = index * chunk_size, min((index + 1) * chunk_size, size) - 1
+        if ranges and ranges[-1][1] + 1 == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+    return {
+        **session,
+        "received": received,
+        "received_ranges": ranges,
+        "received_bytes": sum(end - start + 1 for start, end in ranges),
+        "complete": len(received) == session["chunk_count"],
+    }
+
+
+def write_chunk(
+    uploads_dir: Path,
+    session: dict,
+    index: int,
+    data: bytes,
+    sha256: Optional[str] = None,
+) -> str:
+    """Writes one chunk at its offset in the preallocated data file.
+
+    Chunks may arrive concurrently and in any order; each is written with a
+    positional write and recorded with its checksum once it is on disk.
+
+    Args:
+        uploads_dir: Directory holding all upload sessions.
+        session: The session metadata.
+        index: Zero-based chunk index.
+        data: The chunk's bytes.
+        sha256: Hex SHA-256 the client computed for the chunk, if any.
+
+    Returns:
+        The SHA-256 of the chunk.
+    """
+    if not 0 <= index < session["chunk_count"]:
+        raise HTTPException(
+            status_code=400, detail=f"Chunk index out of range: {index}"
+        )
+    offset = index * session["chunk_size"]
+    expected_length = min(session["chunk_size"], session["size"] - offset)
+    if len(data) != expected_length:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Chunk {index} must be {expected_length} bytes, got {len(data)}",
+        )
+    digest = hashlib.sha256(data).hexdigest()
+    if sha256 is not None and sha256.lower() != digest:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Checksum mismatch for chunk {index}",
+        )
+
+    session_dir = _session_dir(uploads_dir, session["upload_id"])
+    if index == 0:
+        _reject_on_failure(session_dir, _validate_head, session, data)
+
+    fd = os.open(session_dir / DATA_FILENAME, os.O_WRONLY)
+    try:
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], offset + written)
+    finally:
+        os.close(fd)
+
+    marker = session_dir / CHUNKS_DIRNAME / str(index)
+    tmp_marker = marker.with_name(f"{index}.{uuid.uuid4().hex}.tmp")
+    tmp_marker.write_text(digest)
+    os.replace(tmp_marker, marker)
+
+    if (
+        session["kind"] == "images_archive"
+        and not (session_dir / VALIDATED_FILENAME).exists()
+        and _zip_directory_received(uploads_dir, session)
+    ):
+        _reject_on_failure(session_dir, _validate_archive, session_dir)
+    return digest
+
+
+def _reject_on_failure(session_dir: Path, validate, *args):
+    """Runs a validator and drops the whole session if it rejects the upload."""
+    try:
+        validate(*args)
+    except HTTPException:
+        shutil.rmtree(session_dir, ignore_errors=True)
+        raise
+
+
+def _validate_head(session: dict, head: bytes):
+    if session["kind"] == "video":
+        validate_video_head(head[:SNIFF_BYTES], session["filename"])
+    elif sniff_container(head) != "zip":
+        raise HTTPException(status_code=400, detail="Invalid or corrupted ZIP archive")
+
+
+def _validate_archive(session_dir: Path):
+    validated_marker = session_dir / VALIDATED_FILENAME
+    if not validated_marker.exists():
+        validate_zip_archive(session_dir / DATA_FILENAME)
+        validated_marker.touch()
+
+
+def _zip_directory_received(uploads_dir: Path, session: dict) -> bool:
+    """Returns True once every chunk holding the ZIP central directory has arrived.
+
+    The end of central directory record sits in the last 64 KiB of the archive and
+    points at the central directory, which is all `zipfile` needs to list members.
+    """
+    received = received_chunks(uploads_dir, session["upload_id"])
+    size, chunk_size = session["size"], session["chunk_size"]
+
+    def covered(start: int, end: int) -> bool:
+        return all(
+            i in received
+            for i in range(start // chunk_size, (end - 1) // chunk_size + 1)
+        )
+
+    # the record is 22 bytes plus a comment of up to 64 KiB; usually only the last
+    # chunk is needed to find it
+    tail_start = max(0, size - (65535 + 22))
+    first = session["chunk_count"]
+    while first > 0 and first - 1 in received and first * chunk_size > tail_start:
+        first -= 1
+    read_from = max(tail_start, first * chunk_size)
+    if read_from >= size:
+        return False
+    data_path = _session_dir(uploads_dir, session["upload_id"]) / DATA_FILENAME
+    with open(data_path, "rb") as f:
+        tail = os.pread(f.fileno(), size - read_from, read_from)
+    eocd = tail.rfind(b"PK\x05\x06")
+    if eocd < 0 or len(tail) < eocd + 20:
+        # not a ZIP, let validation reject it once the whole tail is here
+        return read_from == tail_start
+    directory_size, directory_offset = struct.unpack("<II", tail[eocd + 12 : eocd + 20])
+    if directory_offset == 0xFFFFFFFF:  # ZIP64, wait for the whole file
+        return covered(0, size)
+    return covered(directory_offset, directory_offset + directory_size)
+
+
+def require_complete(uploads_dir: Path, session: dict) -> Path:
+    """Returns the data file of an upload session, or raises 409 if chunks are missing."""
+    progress = upload_status(uploads_dir, session)
+    if not progress["complete"]:
+        missing = sorted(set(range(session["chunk_count"])) - set(progress["received"]))
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Upload is incomplete", "missing": missing},
+        )
+    return _session_dir(uploads_dir, session["upload_id"]) / DATA_FILENAME
+
+
+def finalize_session(uploads_dir: Path, session: dict, job_dir: Path) -> Path:
+    """Moves a complete upload into a job directory and removes the session.
+
+    Returns:
+        The path of the uploaded file inside `job_dir`.
+    """
+    data_path = require_complete(uploads_dir, session)
+    session_dir = data_path.parent
+    if session["kind"] == "images_archive":
+        _reject_on_failure(session_dir, _validate_archive, session_dir)
+    fd = os.open(data_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    job_dir.mkdir(parents=True, exist_ok=True)
+    upload_path = job_dir / session["filename"]
+    os.replace(data_path, upload_path)
+    shutil.rmtree(session_dir, ignore_errors=True)
+    return upload_path
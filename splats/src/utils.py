@@ -1,8 +1,9 @@
 import logging
 import shutil
 import subprocess
+import sys
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 import aiofiles
 from fastapi import UploadFile
@@ -23,15 +24,22 @@ def copy_upload_file_to_disk(file: UploadFile, output_dir: Path):
         shutil.copyfileobj(file.file, f)  # type: ignore
 
 
-def run_command(cmd: str, verbose=False) -> Optional[str]:
+def run_command(
+    cmd: str, verbose=False, on_output: Optional[Callable[[str], None]] = None
+) -> Optional[str]:
     """Runs a command and returns the output.
 
     Args:
         cmd: Command to run.
         verbose: If True, logs the output of the command.
+        on_output: Called with every line the command prints, stdout and stderr
+            merged, as it is printed. Carriage returns end a line too, so progress
+            bars are reported as they redraw.
     Returns:
         The output of the command if return_output is True, otherwise None.
     """
+    if on_output is not None:
+        return _run_command_streaming(cmd, verbose, on_output)
     out = subprocess.run(
         cmd, capture_output=not verbose, shell=True, check=False, text=True
     )
@@ -42,11 +50,38 @@ def run_command(cmd: str, verbose=False) -> Optional[str]:
     return out
 
 
+def _run_command_streaming(
+    cmd: str, verbose: bool, on_output: Callable[[str], None]
+) -> str:
+    process = subprocess.Popen(
+        cmd,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,  # universal newlines: "\r" ends a line too
+        errors="replace",
+    )
+    lines = []
+    for line in process.stdout:
+        if verbose:
+            sys.stdout.write(line)
+        lines.append(line)
+        try:
+            on_output(line.rstrip("\n"))
+        except Exception:
+            logging.exception("Output callback failed for: %s", cmd)
+    process.wait()
+    output = "".join(lines)
+    if process.returncode != 0:
+        logging.error(output[-10000:])
+    return output
+
+
 async def file_chunk_generator(
     path: Path,
     chunk_size: int = 1024 * 1024,  # 1 MB per chunk,
     start: int = 0,
-    end: int = None
+    end: int = None,
 ):
     """
     Async generator that reads a slice [start,end] of the file in CHUNK_SIZE pieces.
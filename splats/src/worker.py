@@ -0,0 +1,161 @@
+"""Pipeline worker: claims jobs from the shared job store and runs them.
+
+Run one per GPU, on any node that mounts `SPLAT_STORAGE_DIR` and the job database
+`SPLAT_JOB_DB`. Workers on other nodes than the API need the database on a network
+filesystem with working locks; see `src.config`:
+
+    python -m src.worker
+"""
+
+import argparse
+import logging
+import socket
+import threading
+import traceback
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from src.config import JOB_DB_PATH, SPLAT_STORAGE_DIR, STAGE_TIMINGS_PATH
+from src.job_store import JobStore, StoredJob
+from src.jobs import run_job
+from src.pipeline import process_upload
+from src.post_processing import fail_stale_meshes
+from src.scheduler import CostModel, JobFeatures, Scheduler
+from src.stage_pool import shutdown_stage_pool, warm_stage_pool
+
+LOGGER = logging.getLogger(__name__)
+
+# Tasks a job can name; job arguments are stored as JSON. Every task also gets a
+# `backlog_seconds` callable for load-dependent choices.
+TASKS: Dict[str, Callable[..., dict]] = {
+    "process_upload": process_upload,
+}
+POLL_INTERVAL_SECONDS = 2.0
+
+
+class Worker:
+    """Claims jobs one at a time and heartbeats their lease while they run.
+
+    If the lease is lost anyway, e.g. after a long stall, the job has been handed
+    to another worker; this worker finishes its run but its result is discarded.
+    """
+
+    def __init__(
+        self,
+        scheduler: Scheduler,
+        worker_id: Optional[str] = None,
+        poll_interval: float = POLL_INTERVAL_SECONDS,
+    ):
+        self.scheduler = scheduler
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.poll_interval = poll_interval
+
+    def run(self, stop: Optional[threading.Event] = None):
+        """Processes jobs until `stop` is set, once the stage processes are warm."""
+        stop = stop or threading.Event()
+        try:
+            warm_stage_pool()
+        except Exception:
+            LOGGER.error(
+                "Could not warm the stage processes: %s", traceback.format_exc()
+            )
+        LOGGER.info(
+            "Worker %s polling %s", self.worker_id, self.scheduler.store.db_path
+        )
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(self.poll_interval)
+
+    def run_once(self) -> bool:
+        """Claims and runs one job.
+
+        Returns:
+            False if the queue was empty.
+        """
+        job = self.scheduler.claim(self.worker_id)
+        if job is None:
+            return False
+        LOGGER.info(
+            "Worker %s running job %s (attempt %d)",
+            self.worker_id,
+            job.id,
+            job.attempts,
+        )
+
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job, done),
+            name=f"heartbeat-{job.id}",
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            result = run_job(
+                Path(job.job_dir),
+                TASKS[job.task],
+                *job.args,
+                backlog_seconds=self.scheduler.backlog_seconds,
+            )
+        except Exception as e:
+            done.set()
+            self.scheduler.store.finish(
+                job.id,
+                self.worker_id,
+                error=str(getattr(e, "detail", None) or e),
+                error_status=getattr(e, "status_code", None),
+            )
+            return True
+        done.set()
+
+        timings = (result or {}).get("timings")
+        if timings:
+            try:
+                self.scheduler.cost_model.record(JobFeatures(**job.features), timings)
+            except OSError:
+                LOGGER.error(
+                    "Could not record stage timings: %s", traceback.format_exc()
+                )
+        if not self.scheduler.store.finish(job.id, self.worker_id, result=result):
+            LOGGER.warning(
+                "Worker %s lost the lease of job %s, result discarded",
+                self.worker_id,
+                job.id,
+            )
+        return True
+
+    def _heartbeat(self, job: StoredJob, done: threading.Event):
+        interval = self.scheduler.lease_seconds / 3
+        while not done.wait(interval):
+            if not self.scheduler.store.heartbeat(
+                job.id, self.worker_id, self.scheduler.lease_seconds
+            ):
+                LOGGER.error(
+                    "Worker %s lost the lease of job %s", self.worker_id, job.id
+                )
+                return
+
+
+def make_scheduler() -> Scheduler:
+    return Scheduler(JobStore(JOB_DB_PATH), CostModel(STAGE_TIMINGS_PATH))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs splat pipeline jobs from the job store."
+    )
+    parser.add_argument("--worker-id", help="Defaults to <hostname>-<random>.")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fail_stale_meshes(SPLAT_STORAGE_DIR)
+    try:
+        Worker(make_scheduler(), args.worker_id, args.poll_interval).run()
+    finally:
+        shutdown_stage_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Point the storage, and the job database in it, at a scratch directory before
+# `src.config` is imported, so the tests never write into the working tree.
+os.environ.setdefault("SPLAT_STORAGE_DIR", tempfile.mkdtemp(prefix="splat_storage_"))
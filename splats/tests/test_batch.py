@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+
+import src.batch
+from src.batch import BatchRunner, collect_inputs, write_report
+from src.jobs import update_job
+from src.pruning import PruneStats
+from src.training_budget import choose_budget
+
+
+def test_collect_inputs(tmp_path):
+    """GIVEN a directory of scans and a manifest naming one of them again
+    WHEN the inputs are collected
+    THEN supported files are listed once each, in order
+    """
+    scans = tmp_path / "scans"
+    scans.mkdir()
+    for name in ("b.mp4", "a.MOV", "c.zip", "notes.txt"):
+        (scans / name).write_bytes(b"")
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# backfill\nscans/c.zip\n\nscans/missing.mp4\n")
+
+    inputs = collect_inputs([scans], manifest)
+
+    assert [p.name for p in inputs] == ["c.zip", "a.MOV", "b.mp4"]
+
+
+def test_batch_runner(tmp_path, monkeypatch):
+    """GIVEN three videos, one already done and one whose post processing fails
+    WHEN the batch runs
+    THEN the done one is skipped, the failure is reported, the other completes
+    with its input hard-linked, and no two inputs train at once
+    """
+    scans = tmp_path / "scans"
+    scans.mkdir()
+    for name in ("done.mp4", "broken.mp4", "good.mp4"):
+        (scans / name).write_bytes(name.encode())
+    storage = tmp_path / "storage"
+    runner = BatchRunner(storage, "web")
+    inputs = collect_inputs([scans])
+    done_uuid = str(src.batch.uuid.uuid5(src.batch.BATCH_NAMESPACE, str(inputs[1])))
+    (storage / done_uuid).mkdir(parents=True)
+    (storage / done_uuid / f"{done_uuid}.ksplat").write_bytes(b"")
+    update_job(storage / done_uuid, status="done")
+
+    training = []
+    overlap = threading.Event()
+
+    def fake_postprocess(request_uuid, job_dir, preset):
+        if (job_dir / "broken.mp4").exists():
+            raise RuntimeError("ksplat conversion failed")
+        return PruneStats(10, 8, 100, 80, 80, 2)
+
+    def fake_train(request_uuid, job_dir, events):
+        training.append(request_uuid)
+        if len(training) > 1:
+            overlap.set()
+        time.sleep(0.05)
+        training.remove(request_uuid)
+        return choose_budget(job_dir / "missing"), 30000
+
+    monkeypatch.setattr(src.batch, "extract_upload", lambda *args: None)
+    monkeypatch.setattr(src.batch, "reconstruct_cameras", lambda *args: None)
+    monkeypatch.setattr(src.batch, "train_splat", fake_train)
+    monkeypatch.setattr(src.batch, "postprocess_splat", fake_postprocess)
+
+    items = runner.run(inputs)
+    report = write_report(tmp_path / "report.json", items, 1.0)
+
+    assert [item.status for item in items] == ["failed", "skipped", "done"]
+    assert items[0].error == "ksplat conversion failed"
+    good = storage / items[2].uuid
+    assert (good / "good.mp4").stat().st_ino == (scans / "good.mp4").stat().st_ino
+    assert json.loads((good / "job.json").read_text())["status"] == "done"
+    assert set(items[2].timings) == {"frames", "colmap", "brush", "postprocess"}
+    assert not overlap.is_set()
+    assert (report["done"], report["skipped"], report["failed"]) == (1, 1, 1)
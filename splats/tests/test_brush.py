@@ -0,0 +1,164 @@
+import os
+import stat
+import sys
+
+from fastapi.testclient import TestClient
+
+import src.brush
+import src.main
+from src.brush import run_brush
+from src.jobs import update_job
+from src.pipeline import stop_flag_path
+
+FAKE_BRUSH = f"""#!{sys.executable}
+import os, sys, time
+args = sys.argv[1:]
+pause = float(os.environ.get("FAKE_BRUSH_PAUSE_AFTER_FIRST", 0))
+export_path = args[args.index("--export-path") + 1]
+export_name = args[args.index("--export-name") + 1]
+total = int(args[args.index("--total-steps") + 1])
+every = int(args[args.index("--export-every") + 1])
+for step in range(every, total + 1, every):
+    time.sleep(0.02)
+    with open(f"{{export_path}}/" + export_name.replace("{{iter}}", str(step)), "w") as f:
+        f.write(str(step))
+    print(f"{{step}}/{{total}}", flush=True)
+    if step == every:
+        time.sleep(pause)
+"""
+
+
+def install_fake_brush(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "brush_app"
+    script.write_text(FAKE_BRUSH)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(src.brush, "CHECKPOINT_POLL_SECONDS", 0.005)
+
+
+def test_run_brush_hands_over_checkpoints(tmp_path, monkeypatch):
+    """GIVEN brush exporting at the common divisor of the checkpoint steps
+    WHEN training runs to the end
+    THEN every checkpoint but the last is handed over, the last export becomes the
+    final PLY and the other exports are removed."""
+    install_fake_brush(tmp_path, monkeypatch)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    checkpoints, progress = [], []
+
+    steps = run_brush(
+        tmp_path,
+        output_dir,
+        "scan",
+        on_progress=lambda percent, detail: progress.append(percent),
+        on_checkpoint=lambda step, path: checkpoints.append((step, path.read_text())),
+        checkpoint_steps=[6000, 12000],
+    )
+
+    assert steps == 30000
+    assert checkpoints == [(6000, "6000"), (12000, "12000")]
+    assert progress[-1] == 100.0
+    assert (output_dir / "scan.ply").read_text() == "30000"
+    assert sorted(os.listdir(output_dir)) == [
+        "scan.checkpoint_12000.ply",
+        "scan.checkpoint_6000.ply",
+        "scan.ply",
+    ]
+
+
+def test_exports_are_capped(tmp_path, monkeypatch):
+    """GIVEN checkpoints whose common divisor would export every 1000 of 30000 steps
+    WHEN training runs with at most 10 exports
+    THEN brush exports every 3000 steps and each checkpoint moves to the next export."""
+    install_fake_brush(tmp_path, monkeypatch)
+    monkeypatch.setattr(src.brush, "MAX_EXPORTS", 10)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    checkpoints = []
+
+    run_brush(
+        tmp_path,
+        output_dir,
+        "scan",
+        on_checkpoint=lambda step, path: checkpoints.append(step),
+        checkpoint_steps=[2000, 7000, 15000, 30000],
+        total_steps=30000,
+    )
+
+    assert checkpoints == [3000, 9000, 15000]
+    assert (output_dir / "scan.ply").read_text() == "30000"
+
+
+def test_run_brush_stops_early(tmp_path, monkeypatch):
+    """GIVEN a training run asked to stop once the first checkpoint is out
+    WHEN brush is terminated
+    THEN the latest complete export becomes the final PLY."""
+    install_fake_brush(tmp_path, monkeypatch)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    checkpoints = []
+
+    steps = run_brush(
+        tmp_path,
+        output_dir,
+        "scan",
+        on_checkpoint=lambda step, path: checkpoints.append(step),
+        should_stop=lambda: bool(checkpoints),
+        checkpoint_steps=[6000],
+    )
+
+    assert 6000 <= steps < 30000
+    assert (output_dir / "scan.ply").read_text() == str(steps)
+
+
+def test_stop_right_after_a_preview_keeps_that_checkpoint(tmp_path, monkeypatch):
+    """GIVEN a preview consuming the first checkpoint, and training stopped before the next export
+    WHEN brush is terminated
+    THEN that checkpoint still becomes the final PLY."""
+    install_fake_brush(tmp_path, monkeypatch)
+    monkeypatch.setenv("FAKE_BRUSH_PAUSE_AFTER_FIRST", "30")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    checkpoints = []
+
+    def publish(step, path):
+        # like the preview publisher, which removes the checkpoint it was given
+        checkpoints.append(step)
+        path.unlink()
+
+    steps = run_brush(
+        tmp_path,
+        output_dir,
+        "scan",
+        on_checkpoint=publish,
+        should_stop=lambda: bool(checkpoints),
+        checkpoint_steps=[6000],
+    )
+
+    assert steps == 6000
+    assert (output_dir / "scan.ply").read_text() == "6000"
+    assert os.listdir(output_dir) == ["scan.ply"]
+
+
+def test_preview_is_served_until_training_stops(tmp_path, monkeypatch):
+    """GIVEN a running job that published a preview
+    WHEN its splat is downloaded and training is stopped
+    THEN the preview is served uncached and a stop flag is left for the pipeline."""
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    client = TestClient(src.main.app)
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+    update_job(job_dir, status="running")
+    (job_dir / "job.preview.ksplat").write_bytes(b"preview")
+
+    response = client.get("/splats/job")
+    assert response.content == b"preview"
+    assert response.headers["x-splat-preview"] == "true"
+    assert response.headers["cache-control"] == "no-cache"
+
+    assert client.post("/splats/job/stop").status_code == 202
+    assert stop_flag_path(job_dir).exists()
+    update_job(job_dir, status="done")
+    assert client.post("/splats/job/stop").status_code == 409
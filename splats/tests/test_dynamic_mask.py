@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+import pytest
+
+import src.colmap.colmap
+import src.pipeline
+from src.events import JobEvents
+from src.frame_extraction.dynamic_mask import (
+    DYNAMIC_MASK_DIRNAME,
+    compute_dynamic_masks,
+    mask_filename,
+)
+from src.pipeline import reconstruct_cameras
+
+
+@pytest.fixture()
+def panning_scan(tmp_path):
+    """12 frames panning across a textured wall while a white block crosses it."""
+    images_dir = tmp_path / "colmap" / "images"
+    images_dir.mkdir(parents=True)
+    noise = np.random.default_rng(0).integers(0, 255, (600, 900), dtype=np.uint8)
+    wall = cv2.normalize(
+        cv2.GaussianBlur(noise, (0, 0), 3), None, 0, 255, cv2.NORM_MINMAX
+    )
+    for i in range(12):
+        frame = wall[50:530, 20 + 6 * i : 660 + 6 * i].copy()
+        cv2.rectangle(frame, (40 + 40 * i, 200), (100 + 40 * i, 300), 255, -1)
+        cv2.imwrite(str(images_dir / f"frame_{i:05d}.png"), frame)
+    return images_dir
+
+
+def test_moving_block_is_masked_out(panning_scan):
+    """GIVEN frames of a panning camera with a block moving across the scene
+    WHEN dynamic masks are computed
+    THEN each frame gets a full size mask, black over the block only
+    """
+    mask_dir = panning_scan.parent / DYNAMIC_MASK_DIRNAME
+
+    report = compute_dynamic_masks(panning_scan, mask_dir)
+
+    assert report.frames == report.masked_frames == 12
+    assert not report.timed_out and report.rejected_frames == 0
+    # the 60x100 block, grown a little
+    assert 0.015 < report.mean_masked_ratio < report.max_masked_ratio < 0.06
+    mask = cv2.imread(
+        str(mask_dir / mask_filename("frame_00005.png")), cv2.IMREAD_GRAYSCALE
+    )
+    assert mask.shape == (480, 640)
+    assert mask[250, 270] == 0 and mask[100, 100] == 255
+    assert 0.015 < (mask == 0).mean() < 0.06
+
+
+def test_masking_stops_at_its_time_budget(panning_scan):
+    """GIVEN no time to mask the frames
+    WHEN dynamic masks are computed
+    THEN none are written and the report says it timed out
+    """
+    mask_dir = panning_scan.parent / DYNAMIC_MASK_DIRNAME
+
+    report = compute_dynamic_masks(panning_scan, mask_dir, time_budget=0.0)
+
+    assert report.timed_out and report.masked_frames == 0
+    assert not any(mask_dir.glob("*.png"))
+
+
+@pytest.mark.parametrize("kind, masked", [("video", True), ("images_archive", False)])
+def test_only_video_frames_are_masked(tmp_path, monkeypatch, kind, masked):
+    """GIVEN dynamic masking enabled
+    WHEN the frames of a video, or the unordered images of an archive, are extracted
+    THEN only the video frames are masked
+    """
+    calls = []
+    monkeypatch.setattr(src.pipeline, "DYNAMIC_MASKS_ENABLED", True)
+    monkeypatch.setattr(src.pipeline, "run_in_stage_pool", lambda *args: None)
+    monkeypatch.setattr(src.pipeline, "normalize_images_archive", lambda *args: None)
+    monkeypatch.setattr(
+        src.pipeline, "mask_moving_objects", lambda *args: calls.append(args)
+    )
+
+    src.pipeline.extract_upload(tmp_path, tmp_path / "upload", kind)
+
+    assert bool(calls) == masked
+
+
+def test_reconstruct_cameras_uses_dynamic_masks(panning_scan, monkeypatch):
+    """GIVEN a job whose frames have dynamic masks
+    WHEN COLMAP runs
+    THEN it is given the mask directory
+    """
+    job_dir = panning_scan.parent.parent
+    compute_dynamic_masks(panning_scan, panning_scan.parent / DYNAMIC_MASK_DIRNAME)
+    calls = []
+    monkeypatch.setattr(
+        src.pipeline, "run_colmap", lambda *args, **kwargs: calls.append(kwargs)
+    )
+
+    reconstruct_cameras(job_dir, None, JobEvents(job_dir))
+
+    assert calls[0]["mask_dir"] == panning_scan.parent / DYNAMIC_MASK_DIRNAME
+
+
+def test_colmap_extracts_features_through_the_dynamic_masks(panning_scan, monkeypatch):
+    """GIVEN a job whose frames have dynamic masks
+    WHEN COLMAP runs
+    THEN its feature extractor is pointed at the mask directory
+    """
+    job_dir = panning_scan.parent.parent
+    compute_dynamic_masks(panning_scan, panning_scan.parent / DYNAMIC_MASK_DIRNAME)
+    commands = []
+    monkeypatch.setattr(
+        src.colmap.colmap, "run_command", lambda cmd, **kwargs: commands.append(cmd)
+    )
+
+    reconstruct_cameras(job_dir, None, JobEvents(job_dir))
+
+    (feature_extractor,) = [cmd for cmd in commands if " feature_extractor " in cmd]
+    assert f"--ImageReader.mask_path {panning_scan.parent / DYNAMIC_MASK_DIRNAME}" in (
+        feature_extractor
+    )
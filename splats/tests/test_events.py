@@ -0,0 +1,79 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import src.main
+from src.colmap.colmap import _step_progress
+from src.events import JobEvents
+from src.jobs import update_job
+from src.main import app
+
+client = TestClient(app)
+
+
+def parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in block.splitlines() if ": " in line
+        )
+        if "data" in fields:
+            events.append((fields.get("id"), json.loads(fields["data"])))
+    return events
+
+
+def test_event_stream_replays_and_resumes(tmp_path, monkeypatch):
+    """GIVEN a job that ran through a stage and finished
+    WHEN its event stream is requested
+    THEN every status, stage and progress event is sent and the stream ends with
+    the artifact URLs,
+    AND a reconnect with Last-Event-ID only gets the events after that ID."""
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+    events = JobEvents(job_dir)
+    update_job(job_dir, status="running")
+    events.stage("colmap", "started")
+    events.progress("colmap", 40.0, "matching")
+    events.progress("colmap", 40.2, "matching")  # throttled
+    events.stage("colmap", "finished", seconds=1.0)
+    update_job(job_dir, status="done")
+
+    response = client.get("/splats/job/events")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    received = parse_sse(response.text)
+    assert [e["type"] for _, e in received] == [
+        "status",
+        "stage",
+        "progress",
+        "stage",
+        "status",
+    ]
+    assert received[2][1]["percent"] == 40.0
+    assert received[-1][1]["artifacts"]["ksplat"] == "/splats/job"
+
+    response = client.get(
+        "/splats/job/events", headers={"Last-Event-ID": received[2][0]}
+    )
+    assert [e["type"] for _, e in parse_sse(response.text)] == ["stage", "status"]
+    assert client.get("/splats/missing/events").status_code == 404
+
+
+def test_colmap_output_is_parsed_into_progress():
+    """GIVEN COLMAP log lines of feature extraction and mapping
+    WHEN they are fed to the step progress parsers
+    THEN they map to percentages within each step's share of the run."""
+    reported = []
+    on_output = _step_progress(
+        "feature_extraction", 200, lambda *args: reported.append(args)
+    )
+    on_output("I0101 Processed file [50/200]")
+    on_output("I0101 Name: frame_00050.png")
+    on_output = _step_progress("mapping", 200, lambda *args: reported.append(args))
+    on_output("I0101 Registering image #12 (100)")
+    assert reported == [
+        (0.0, "feature_extraction"),
+        (7.5, "feature_extraction"),
+        (60.0, "mapping"),
+        (77.5, "mapping"),
+    ]
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from src.ksplat_layout import compute_layout
+
+
+def test_layout_centers_on_the_trimmed_scene():
+    """GIVEN an off-center scene with a few far away floaters
+    WHEN the ksplat layout is computed
+    THEN the center and extent ignore the floaters
+    """
+    rng = np.random.default_rng(0)
+    positions = rng.uniform([40, -10, 5], [60, 10, 7], size=(20_000, 3))
+    positions[:50] = [1e4, -1e4, 1e4]
+
+    layout = compute_layout(positions)
+
+    assert layout.scene_center == pytest.approx((50, 0, 6), abs=0.5)
+    assert layout.extent == pytest.approx(20, rel=0.05)
+
+
+@pytest.mark.parametrize("count", [20_000, 200_000])
+def test_block_size_targets_the_bucket_size(count):
+    """GIVEN scenes of the same size but different densities
+    WHEN the ksplat layout is computed
+    THEN denser scenes get smaller blocks of about one bucket each
+    """
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(0, 10, size=(count, 3))
+
+    layout = compute_layout(positions)
+
+    assert layout.bucket_size == 256
+    assert 256 / 8 <= layout.splats_per_block <= 256 * 8
+    assert layout.block_size == pytest.approx(10 * (256 / count) ** (1 / 3), rel=1.0)
+    assert layout.conversion_options()["bucketSize"] == 256
+
+
+def test_layout_of_a_tiny_scene():
+    layout = compute_layout(np.zeros((3, 3)))
+    assert layout.block_size > 0
@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import src.main
+
+from src.lod import SPLAT_ROW_DTYPE, build_lod
+from src.ply import write_ply
+from tests.test_pruning import make_vertices
+
+
+def test_build_lod_writes_coarse_levels_first(tmp_path):
+    """GIVEN a pruned splat PLY
+    WHEN the LOD chunks are built
+    THEN the chunks tile the chunk file in order, coarsest level first
+    AND the finest level holds every original splat."""
+    vertices = make_vertices(5000, sh_degree=0)
+    ply_path = tmp_path / "scene.ply"
+    write_ply(ply_path, vertices)
+
+    manifest_path = build_lod(ply_path, tmp_path, "scene", voxel_divisions=(4, 16))
+
+    manifest = json.loads(manifest_path.read_text())
+    chunks = manifest["chunks"]
+    assert manifest["levels"] == 3
+    assert [c["level"] for c in chunks] == sorted(c["level"] for c in chunks)
+    offset = 0
+    for chunk in chunks:
+        assert chunk["offset"] == offset
+        assert chunk["length"] == chunk["count"] * SPLAT_ROW_DTYPE.itemsize
+        offset += chunk["length"]
+    assert (tmp_path / manifest["file"]).stat().st_size == offset
+
+    counts = [
+        sum(c["count"] for c in chunks if c["level"] == level) for level in range(3)
+    ]
+    assert counts[0] < counts[1] < counts[2] == 5000
+
+    rows = np.fromfile(tmp_path / manifest["file"], dtype=SPLAT_ROW_DTYPE)
+    assert np.isfinite(rows["position"]).all()
+
+
+def test_lod_chunk_is_served_as_a_range_of_the_chunk_file(tmp_path, monkeypatch):
+    """GIVEN a job with LOD chunks
+    WHEN a chunk is downloaded, in part and conditionally
+    THEN its own bytes, ETag and Content-Range relative to the chunk are returned."""
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+    write_ply(job_dir / "job.ply", make_vertices(2000, sh_degree=0))
+    manifest = json.loads(build_lod(job_dir / "job.ply", job_dir, "job").read_text())
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    client = TestClient(src.main.app)
+    chunk = manifest["chunks"][1]
+    data = (job_dir / manifest["file"]).read_bytes()
+    expected = data[chunk["offset"] : chunk["offset"] + chunk["length"]]
+
+    response = client.get("/splats/job/lod/1")
+    assert response.status_code == 200
+    assert response.content == expected
+    assert response.headers["x-lod-level"] == str(chunk["level"])
+    etag = response.headers["etag"]
+    assert etag != client.get("/splats/job/lod/0").headers["etag"]
+
+    response = client.get("/splats/job/lod/1", headers={"Range": "bytes=4-11"})
+    assert response.status_code == 206
+    assert response.content == expected[4:12]
+    assert response.headers["content-range"] == f"bytes 4-11/{chunk['length']}"
+
+    assert (
+        client.get("/splats/job/lod/1", headers={"If-None-Match": etag}).status_code
+        == 304
+    )
+    assert client.get(f"/splats/job/lod/{len(manifest['chunks'])}").status_code == 404
@@ -0,0 +1,195 @@
+import json
+import os
+import struct
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+import src.colmap.colmap
+import src.stage_pool
+from src.colmap.colmap import is_single_camera
+from src.frame_extraction.normalize import (
+    MANIFEST_FILENAME,
+    normalize_archive,
+    read_manifest,
+)
+from src.events import JobEvents
+from src.pipeline import reconstruct_cameras
+from src.stage_pool import map_in_stage_pool, shutdown_stage_pool
+
+
+def encode(ext: str, width: int, height: int, seed: int = 0) -> bytes:
+    image = np.random.default_rng(seed).integers(
+        0, 255, (height, width, 3), dtype=np.uint8
+    )
+    return cv2.imencode(ext, image)[1].tobytes()
+
+
+def with_orientation(jpeg: bytes, orientation: int) -> bytes:
+    """Inserts an EXIF segment holding only the orientation after the SOI marker."""
+    tiff = (
+        b"MM\x00*"
+        + struct.pack(">IHHHIHH", 8, 1, 0x0112, 3, 1, orientation, 0)
+        + b"\0" * 4
+    )
+    payload = b"Exif\x00\x00" + tiff
+    return (
+        jpeg[:2]
+        + b"\xff\xe1"
+        + struct.pack(">H", len(payload) + 2)
+        + payload
+        + jpeg[2:]
+    )
+
+
+@pytest.fixture()
+def images_dir(tmp_path):
+    images_dir = tmp_path / "colmap" / "images"
+    images_dir.mkdir(parents=True)
+    return images_dir
+
+
+def write_archive(path, members):
+    with zipfile.ZipFile(path, "w") as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    return path
+
+
+def test_normalize_archive_downscales_and_drops_bad_files(tmp_path, images_dir):
+    """GIVEN an archive of a large PNG, a JPEG, a copy of it in a folder and a
+    file that is not an image
+    WHEN it is normalized to a 100 pixel long edge
+    THEN two JPEGs are written, the PNG downscaled, and the copy and the broken
+    file are dropped
+    """
+    jpeg = encode(".jpg", 80, 60)
+    archive = write_archive(
+        tmp_path / "upload.zip",
+        {
+            "a.png": encode(".png", 400, 300, seed=1),
+            "b.jpg": jpeg,
+            "nested/c.jpg": jpeg,
+            "broken.jpg": b"not an image",
+        },
+    )
+
+    manifest = normalize_archive(archive, images_dir, max_edge=100)
+
+    assert [(i["source"], i["width"], i["height"]) for i in manifest["images"]] == [
+        ("a.png", 100, 75),
+        ("b.jpg", 80, 60),
+    ]
+    assert sorted(p.name for p in images_dir.iterdir()) == [
+        i["name"] for i in manifest["images"]
+    ]
+    assert all(
+        name.endswith(".jpg") for name in (i["name"] for i in manifest["images"])
+    )
+    assert {d["source"]: d["reason"] for d in manifest["dropped"]} == {
+        "broken.jpg": "undecodable",
+        "nested/c.jpg": "duplicate of b.jpg",
+    }
+    assert not manifest["single_camera"]
+    assert read_manifest(images_dir) == json.loads(
+        (images_dir.parent / MANIFEST_FILENAME).read_text()
+    )
+
+
+def test_normalize_archive_applies_exif_orientation(tmp_path, images_dir):
+    """GIVEN a landscape JPEG tagged to be rotated 90 degrees
+    WHEN it is normalized
+    THEN it is written upright, as a portrait image
+    """
+    archive = write_archive(
+        tmp_path / "upload.zip",
+        {"rotated.jpg": with_orientation(encode(".jpg", 64, 32), 6)},
+    )
+
+    manifest = normalize_archive(archive, images_dir, max_edge=0)
+
+    (image,) = manifest["images"]
+    assert (image["width"], image["height"]) == (32, 64)
+    assert cv2.imread(str(images_dir / image["name"])).shape[:2] == (64, 32)
+
+
+def test_normalize_archive_on_stage_pool(tmp_path, images_dir, monkeypatch):
+    """GIVEN an archive of same sized images
+    WHEN it is normalized in the stage processes
+    THEN every image is kept, in order, and they may share a camera
+    """
+    monkeypatch.setattr(src.stage_pool, "STAGE_PROCESSES", 2)
+    archive = write_archive(
+        tmp_path / "upload.zip",
+        {f"{i:02d}.jpg": encode(".jpg", 48, 36, seed=i) for i in range(20)},
+    )
+
+    try:
+        manifest = normalize_archive(archive, images_dir, map_fn=map_in_stage_pool)
+    finally:
+        shutdown_stage_pool()
+
+    assert [i["source"] for i in manifest["images"]] == [
+        f"{i:02d}.jpg" for i in range(20)
+    ]
+    assert manifest["single_camera"]
+
+
+def test_cameras_are_told_apart_by_their_source_size(tmp_path, images_dir):
+    """GIVEN images of two cameras with the same aspect ratio
+    WHEN they are downscaled to the same size
+    THEN they are not put in one camera, and the archive is closed afterwards
+    """
+    archive = write_archive(
+        tmp_path / "upload.zip",
+        {
+            "large.jpg": encode(".jpg", 400, 300, seed=1),
+            "small.jpg": encode(".jpg", 200, 150),
+        },
+    )
+
+    manifest = normalize_archive(archive, images_dir, max_edge=100)
+
+    assert {(i["width"], i["height"]) for i in manifest["images"]} == {(100, 75)}
+    assert not manifest["single_camera"]
+    open_files = [
+        os.path.realpath(f"/proc/self/fd/{fd}") for fd in os.listdir("/proc/self/fd")
+    ]
+    assert str(archive.resolve()) not in open_files
+
+
+@pytest.mark.parametrize(
+    "small_size, single_camera", [((400, 300), 1), ((200, 150), 0)]
+)
+def test_colmap_camera_model_follows_the_source_sizes(
+    tmp_path, images_dir, monkeypatch, small_size, single_camera
+):
+    """GIVEN a normalized archive of images from one camera, or two
+    WHEN COLMAP runs on it
+    THEN its feature extractor shares one camera only between same sized sources
+    """
+    archive = write_archive(
+        tmp_path / "upload.zip",
+        {
+            "a.jpg": encode(".jpg", 400, 300, seed=1),
+            "b.jpg": encode(".jpg", *small_size),
+        },
+    )
+    normalize_archive(archive, images_dir, max_edge=100)
+    commands = []
+    monkeypatch.setattr(
+        src.colmap.colmap, "run_command", lambda cmd, **kwargs: commands.append(cmd)
+    )
+
+    reconstruct_cameras(tmp_path, None, JobEvents(tmp_path))
+
+    (feature_extractor,) = [cmd for cmd in commands if " feature_extractor " in cmd]
+    assert f"--ImageReader.single_camera {single_camera}" in feature_extractor
+
+
+def test_is_single_camera():
+    assert is_single_camera([])
+    assert is_single_camera([(640, 480), (640, 480)])
+    assert not is_single_camera([(640, 480), (480, 640)])
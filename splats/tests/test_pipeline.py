@@ -0,0 +1,32 @@
+import src.pipeline
+from src.pipeline import postprocess_splat
+from src.ply import write_ply
+from tests.test_pruning import make_vertices
+
+
+def test_postprocess_keeps_the_brush_export(tmp_path, monkeypatch):
+    """GIVEN a brush export of a finished job
+    WHEN it is post-processed
+    THEN the ksplat is made from a pruned copy
+    AND the full-precision export is left untouched."""
+    ply_path = tmp_path / "job.ply"
+    write_ply(ply_path, make_vertices(500))
+    original = ply_path.read_bytes()
+    converted = []
+
+    def fake_compress(request_uuid, variant=None, **kwargs):
+        converted.append(variant)
+        assert (tmp_path / f"{request_uuid}.{variant}.ply").is_file()
+        (tmp_path / f"{request_uuid}.{variant}.ksplat").write_bytes(b"ksplat")
+
+    monkeypatch.setattr(src.pipeline, "compress_splat_to_ksplat", fake_compress)
+    monkeypatch.setattr(src.pipeline, "build_lod", lambda *args: None)
+    monkeypatch.setattr(src.pipeline, "write_precompressed_variants", lambda path: None)
+
+    stats = postprocess_splat("job", tmp_path, "web")
+
+    assert converted == ["pruned"]
+    assert stats.count_after < stats.count_before
+    assert ply_path.read_bytes() == original
+    assert (tmp_path / "job.ksplat").read_bytes() == b"ksplat"
+    assert not (tmp_path / "job.pruned.ply").exists()
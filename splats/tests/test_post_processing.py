@@ -0,0 +1,122 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import src.main
+from src.jobs import read_job, update_job
+from src.post_processing import (
+    MESH_OWNER,
+    MESH_STALE_SECONDS,
+    fail_stale_meshes,
+    mesh_is_stale,
+    poisson_depth,
+    run_in_subprocess,
+)
+
+
+@pytest.mark.parametrize(
+    "num_points, expected", [(0, 6), (1_000, 6), (50_000, 8), (500_000, 9), (10**8, 10)]
+)
+def test_poisson_depth(num_points, expected):
+    assert poisson_depth(num_points) == expected
+
+
+def test_run_in_subprocess_returns_result():
+    assert run_in_subprocess(sum, ([1, 2, 3],)) == 6
+
+
+def test_run_in_subprocess_caps_memory():
+    """GIVEN a call allocating more than the memory cap
+    WHEN it runs in a capped subprocess
+    THEN it fails with an error instead of taking the caller down
+    """
+    with pytest.raises(RuntimeError, match="MemoryError"):
+        run_in_subprocess(bytearray, (2**31,), memory_limit_bytes=512 * 2**20)
+
+
+def test_run_in_subprocess_times_out():
+    with pytest.raises(RuntimeError, match="Timed out"):
+        run_in_subprocess(time.sleep, (30,), timeout=2.0)
+
+
+def test_read_mesh(tmp_path, monkeypatch):
+    """GIVEN a job whose mesh is still being exported
+    WHEN the mesh is requested before and after the export lands
+    THEN it is reported not ready, then served as binary glTF
+    """
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    client = TestClient(src.main.app)
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+    update_job(job_dir, status="done", mesh={"status": "running"})
+
+    response = client.get("/splats/job/mesh.glb")
+    assert response.status_code == 404
+    assert response.headers["retry-after"] == "30"
+
+    (job_dir / "job.glb").write_bytes(b"glTF")
+    response = client.get("/splats/job/mesh.glb")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "model/gltf-binary"
+    assert response.content == b"glTF"
+
+
+def test_mesh_lost_with_its_process_is_failed(tmp_path, monkeypatch):
+    """GIVEN a job whose mesh was running in a process that has since exited
+    WHEN the mesh and the job status are requested, and stale meshes are failed on startup
+    THEN the mesh is reported failed instead of not ready
+    """
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    client = TestClient(src.main.app)
+    exited = subprocess.run(
+        [sys.executable, "-c", "import os; print(os.getpid())"],
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    owner = f"{socket.gethostname()}:{exited}:0"
+    lost = {"status": "running", "owner": owner, "updated_at": time.time()}
+    for name in ("job", "other"):
+        (tmp_path / name).mkdir()
+        update_job(tmp_path / name, status="done", mesh=lost)
+
+    response = client.get("/splats/job/mesh.glb")
+    assert response.status_code == 404
+    assert "retry-after" not in response.headers
+    assert client.get("/splats/job/status").json()["mesh"]["status"] == "failed"
+    assert fail_stale_meshes(tmp_path) == 1
+    assert read_job(tmp_path / "other")["mesh"]["status"] == "failed"
+
+
+def test_mesh_is_stale():
+    """GIVEN meshes pending in this process, in a live process and on another host
+    WHEN they are checked
+    THEN only those of a missing process, or silent for too long elsewhere, are stale
+    """
+    now = time.time()
+    host = socket.gethostname()
+    this_pid_restarted = f"{host}:{os.getpid()}:restarted"
+    live = f"{host}:{os.getppid()}:0"
+
+    assert not mesh_is_stale(
+        {"status": "queued", "owner": MESH_OWNER, "updated_at": 0.0}
+    )
+    assert not mesh_is_stale({"status": "running", "owner": live, "updated_at": now})
+    assert mesh_is_stale(
+        {"status": "running", "owner": this_pid_restarted, "updated_at": now}
+    )
+    assert not mesh_is_stale(
+        {"status": "queued", "owner": "elsewhere:1:0", "updated_at": now}
+    )
+    assert mesh_is_stale(
+        {
+            "status": "queued",
+            "owner": "elsewhere:1:0",
+            "updated_at": now - MESH_STALE_SECONDS - 1,
+        }
+    )
+    assert not mesh_is_stale({"status": "done", "owner": this_pid_restarted})
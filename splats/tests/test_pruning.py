@@ -0,0 +1,92 @@
+import numpy as np
+
+from src.ply import read_ply, write_ply
+from src.pruning import (
+    PRUNE_PRESETS,
+    PrunePreset,
+    prune_splat,
+    quantize,
+    quantized_size,
+    truncate_sh,
+)
+
+
+def make_vertices(count: int, sh_degree: int = 2) -> np.ndarray:
+    rest = 3 * ((sh_degree + 1) ** 2 - 1)
+    names = (
+        ["x", "y", "z", "f_dc_0", "f_dc_1", "f_dc_2"]
+        + [f"f_rest_{i}" for i in range(rest)]
+        + ["opacity", "scale_0", "scale_1", "scale_2"]
+        + [f"rot_{i}" for i in range(4)]
+    )
+    vertices = np.zeros(count, dtype=[(n, "<f4") for n in names])
+    rng = np.random.default_rng(0)
+    for name in names:
+        vertices[name] = rng.normal(size=count)
+    for i in range(rest):
+        vertices[f"f_rest_{i}"] = i
+    return vertices
+
+
+def test_prune_splat_drops_transparent_and_outlying_splats(tmp_path):
+    """GIVEN a brush PLY export
+    WHEN it is pruned with an opacity threshold and a percentile bounding volume
+    THEN transparent and outlying splats are removed
+    AND the before/after counts and bytes are reported."""
+    vertices = make_vertices(1000)
+    vertices["opacity"][:100] = -10.0  # sigmoid ~ 0
+    vertices["x"][100] = 1e6
+    ply_path = tmp_path / "splat.ply"
+    write_ply(ply_path, vertices)
+
+    preset = PrunePreset(
+        min_opacity=0.01, bounds_percentile=0.5, sh_degree=None, quantization="half"
+    )
+    stats = prune_splat(ply_path, ply_path, preset)
+
+    pruned = read_ply(ply_path)
+    assert stats.count_before == 1000
+    assert stats.count_after == len(pruned)
+    assert stats.count_after < 900
+    assert (pruned["x"] < 1e6).all()
+    assert stats.bytes_after < stats.bytes_before
+    assert stats.sh_degree == 2
+
+
+def test_truncate_sh_keeps_lower_degree_coefficients_per_channel():
+    """GIVEN a splat with SH degree 2 (8 rest coefficients per channel)
+    WHEN it is truncated to degree 1
+    THEN the first 3 coefficients of every channel are kept and renumbered."""
+    vertices = make_vertices(4, sh_degree=2)
+    truncated = truncate_sh(vertices, 1)
+
+    rest = [n for n in truncated.dtype.names if n.startswith("f_rest_")]
+    assert rest == [f"f_rest_{i}" for i in range(9)]
+    assert [truncated[n][0] for n in rest] == [0, 1, 2, 8, 9, 10, 16, 17, 18]
+
+
+def test_web_preset_is_smaller_than_archive_preset(tmp_path):
+    """GIVEN a brush PLY export
+    WHEN it is pruned with the web and archive presets
+    THEN the web output is smaller."""
+    vertices = make_vertices(500)
+    sizes = {}
+    for name in ("web", "archive"):
+        ply_path = tmp_path / f"{name}.ply"
+        write_ply(ply_path, vertices)
+        sizes[name] = prune_splat(
+            ply_path, ply_path, PRUNE_PRESETS[name]
+        ).quantized_bytes
+    assert sizes["web"] < sizes["archive"]
+
+
+def test_quantized_size_matches_packed_arrays():
+    """GIVEN splats with SH degree 1
+    WHEN their quantized size is computed for every precision
+    THEN it equals the bytes of the arrays quantize packs them into."""
+    vertices = truncate_sh(make_vertices(10), 1)
+    for quantization in ("none", "half", "8bit"):
+        packed = quantize(vertices, quantization)
+        assert quantized_size(10, 9, quantization) == sum(
+            a.nbytes for a in packed.values()
+        )
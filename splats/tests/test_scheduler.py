@@ -0,0 +1,201 @@
+import time
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import src.database
+import src.worker
+from src.events import read_events
+from src.job_store import MAX_ATTEMPTS, JobStore
+from src.jobs import read_job
+from src.scheduler import MIN_FIT_SAMPLES, PRIORITIES, CostModel, JobFeatures, Scheduler
+from src.worker import Worker
+
+FEATURES = JobFeatures(images=100, megapixels=2.0)
+
+
+def make_scheduler(tmp_path, **kwargs) -> Scheduler:
+    return Scheduler(
+        JobStore(tmp_path / "jobs.sqlite3"),
+        CostModel(tmp_path / "timings.jsonl"),
+        **kwargs,
+    )
+
+
+def submit(scheduler, tmp_path, name, client_id, *args, priority=0):
+    job_dir = tmp_path / name
+    job_dir.mkdir()
+    return scheduler.submit(
+        job_dir,
+        "test",
+        *args,
+        client_id=client_id,
+        features=FEATURES,
+        priority=priority,
+    )
+
+
+def test_job_database_is_created_on_first_use_with_a_journal_for_its_filesystem(
+    tmp_path, monkeypatch
+):
+    """GIVEN job databases on a local disk and on an NFS mount
+    WHEN their stores are created and then first used
+    THEN nothing is written until first use, and only the local one uses WAL."""
+    mounts = tmp_path / "mounts"
+    mounts.write_text(
+        f"/dev/sda1 / ext4 rw 0 0\nserver:/export {tmp_path / 'nfs'} nfs4 rw 0 0\n"
+    )
+    monkeypatch.setattr(src.database, "MOUNTS_PATH", mounts)
+    local = JobStore(tmp_path / "local" / "jobs.sqlite3")
+    shared = JobStore(tmp_path / "nfs" / "jobs.sqlite3")
+
+    assert not local.db_path.parent.exists() and not shared.db_path.parent.exists()
+    assert local.get("missing") is None and shared.get("missing") is None
+    with local._connect() as db:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    with shared._connect() as db:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+
+
+def test_cost_model_fits_stage_timings(tmp_path):
+    """GIVEN stage timings of finished jobs that grow linearly with their images
+    WHEN the cost model is reloaded from its history file
+    THEN its estimates follow the recorded timings."""
+    history_path = tmp_path / "timings.jsonl"
+    model = CostModel(history_path)
+    for images in np.linspace(50, 500, MIN_FIT_SAMPLES):
+        features = JobFeatures(images=int(images), megapixels=2.0)
+        model.record(features, {"colmap": 10 + 2 * int(images), "brush": 900.0})
+
+    reloaded = CostModel(history_path)
+    features = JobFeatures(images=1000, megapixels=2.0)
+    assert reloaded.estimate(features, ["colmap"]) == pytest.approx(2010, rel=1e-6)
+    assert reloaded.estimate(features, ["colmap", "brush"]) == pytest.approx(
+        2910, rel=1e-6
+    )
+
+
+def test_scheduler_fair_share_and_admission(tmp_path):
+    """GIVEN one client with a running job and two more queued
+    WHEN a second client submits a job
+    THEN it is scheduled next, its ETA follows the running job,
+    AND a job that would overflow the backlog budget is refused with a Retry-After."""
+    estimate = CostModel(tmp_path / "timings.jsonl").estimate(FEATURES)
+    scheduler = make_scheduler(tmp_path, max_backlog_seconds=4.5 * estimate)
+
+    submit(scheduler, tmp_path, "a1", "a")
+    assert scheduler.claim("worker").id == "a1"
+    for name, client_id in (("a2", "a"), ("a3", "a"), ("b1", "b")):
+        submit(scheduler, tmp_path, name, client_id)
+
+    assert scheduler.eta("a1")["queue_position"] == 0
+    eta = scheduler.eta("b1")
+    assert eta["queue_position"] == 1
+    assert eta["estimated_completion_at"] - eta["estimated_start_at"] == pytest.approx(
+        estimate
+    )
+    assert scheduler.eta("a3")["queue_position"] == 3
+
+    with pytest.raises(HTTPException) as e:
+        submit(scheduler, tmp_path, "c1", "c")
+    assert e.value.status_code == 429
+    assert int(e.value.headers["Retry-After"]) > 0
+    assert read_job(tmp_path / "b1")["status"] == "queued"
+
+
+def test_admitted_job_is_queued_without_a_second_check(tmp_path):
+    """GIVEN a job admitted while the backlog had room
+    WHEN another job fills the backlog before the first is submitted with its estimate
+    THEN the first is still queued, with the estimate it was admitted with."""
+    estimate = CostModel(tmp_path / "timings.jsonl").estimate(FEATURES)
+    scheduler = make_scheduler(tmp_path, max_backlog_seconds=2.5 * estimate)
+    submit(scheduler, tmp_path, "a1", "a")
+    assert scheduler.claim("worker").id == "a1"
+
+    admitted = scheduler.admit(FEATURES)
+    submit(scheduler, tmp_path, "b1", "b")
+    with pytest.raises(HTTPException):
+        scheduler.admit(FEATURES)
+    (tmp_path / "c1").mkdir()
+    scheduler.submit(
+        tmp_path / "c1", "test", client_id="c", features=FEATURES, estimate=admitted
+    )
+
+    job = read_job(tmp_path / "c1")
+    assert job["status"] == "queued" and job["estimated_seconds"] == admitted
+
+
+def test_high_priority_jobs_run_first(tmp_path):
+    """GIVEN normal jobs queued by two clients without usage
+    WHEN a new client, and one of the two, each submit a high priority job
+    THEN both high priority jobs are scheduled before the normal ones."""
+    scheduler = make_scheduler(tmp_path)
+    submit(scheduler, tmp_path, "a1", "a")
+    submit(scheduler, tmp_path, "b1", "b")
+    submit(scheduler, tmp_path, "c1", "c", priority=PRIORITIES["high"])
+    submit(scheduler, tmp_path, "a2", "a", priority=PRIORITIES["high"])
+
+    positions = [
+        scheduler.eta(job)["queue_position"] for job in ("c1", "a2", "b1", "a1")
+    ]
+    assert positions == [1, 2, 3, 4]
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    """GIVEN a job claimed by a worker that stops heartbeating
+    WHEN its lease expires and another worker claims work
+    THEN the job is handed to the second worker
+    AND the first worker can no longer finish it."""
+    scheduler = make_scheduler(tmp_path, lease_seconds=0.05)
+    submit(scheduler, tmp_path, "job", "a")
+    assert scheduler.claim("crashed").id == "job"
+    assert scheduler.claim("other") is None
+
+    time.sleep(0.1)
+    job = scheduler.claim("other")
+    assert (job.id, job.attempts) == ("job", 2)
+    assert not scheduler.store.finish("job", "crashed", result={})
+    assert scheduler.store.finish("job", "other", result={"ok": True})
+    assert scheduler.wait("job") == {"ok": True}
+
+
+def test_job_losing_its_worker_too_often_is_failed(tmp_path):
+    """GIVEN a job whose workers keep disappearing
+    WHEN its lease expires for the last allowed time
+    THEN it is failed in the queue and in its metadata, ending its event stream."""
+    scheduler = make_scheduler(tmp_path, lease_seconds=0.01)
+    submit(scheduler, tmp_path, "job", "a")
+    for attempt in range(MAX_ATTEMPTS):
+        assert scheduler.claim(f"crashed-{attempt}").id == "job"
+        time.sleep(0.02)
+
+    assert scheduler.claim("other") is None
+    assert scheduler.store.get("job").status == "failed"
+    job = read_job(tmp_path / "job")
+    assert (
+        job["status"] == "failed"
+        and job["error"] == f"Worker lost {MAX_ATTEMPTS} times"
+    )
+    _, event = read_events(tmp_path / "job")[-1]
+    assert event["type"] == "status" and event["status"] == "failed"
+
+
+def test_worker_runs_job(tmp_path, monkeypatch):
+    """GIVEN a queued job
+    WHEN a worker polls the store
+    THEN it runs the job's task with its arguments and records the result and timings.
+    """
+    monkeypatch.setitem(
+        src.worker.TASKS,
+        "test",
+        lambda name, **kwargs: {"name": name, "timings": {"colmap": 1.0}},
+    )
+    scheduler = make_scheduler(tmp_path)
+    submit(scheduler, tmp_path, "job", "a", "scan")
+
+    assert Worker(scheduler).run_once()
+    assert scheduler.wait("job") == {"name": "scan", "timings": {"colmap": 1.0}}
+    assert read_job(tmp_path / "job")["status"] == "done"
+    assert (tmp_path / "timings.jsonl").read_text().count("\n") == 1
+    assert not Worker(scheduler).run_once()
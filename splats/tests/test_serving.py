@@ -0,0 +1,185 @@
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import src.main
+import src.serving
+from src.compression import write_precompressed_variants
+from src.serving import (
+    PRECOMPRESSED_SUFFIXES,
+    CachedFile,
+    RangeNotSatisfiable,
+    acceptable_encodings,
+    file_response,
+    parse_range_header,
+)
+
+CONTENT = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.fixture()
+def client(tmp_path):
+    path = tmp_path / "scene.ksplat"
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+
+    @app.get("/file")
+    async def read_file(request: Request):
+        return file_response(request, path)
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", [(0, 99)]),
+        ("bytes=1000-", [(1000, 1023)]),
+        ("bytes=-24", [(1000, 1023)]),
+        ("bytes=0-9,5-19,100-109", [(0, 19), (100, 109)]),
+        ("bytes=1000-5000", [(1000, 1023)]),
+        ("items=0-1", None),
+        ("bytes=9-1", None),
+    ],
+)
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, len(CONTENT)) == expected
+
+
+def test_parse_range_header_unsatisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=2000-", len(CONTENT))
+
+
+def test_single_range(client):
+    """GIVEN a splat download
+    WHEN a single byte range is requested
+    THEN a 206 with the requested bytes and Content-Range is returned."""
+    response = client.get("/file", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[10:20]
+    assert response.headers["content-range"] == "bytes 10-19/1024"
+    assert response.headers["content-length"] == "10"
+
+
+def test_multi_range(client):
+    """GIVEN a splat download
+    WHEN several byte ranges are requested
+    THEN a multipart/byteranges 206 containing every range is returned."""
+    response = client.get("/file", headers={"Range": "bytes=0-1,-2"})
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges")
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert b"Content-Range: bytes 0-1/1024" in response.content
+    assert b"Content-Range: bytes 1022-1023/1024" in response.content
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/file", headers={"Range": "bytes=4096-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_conditional_requests(client):
+    """GIVEN a splat download with an ETag
+    WHEN the client revalidates with If-None-Match
+    THEN a 304 is returned
+    AND a Range with a stale If-Range returns the full file."""
+    etag = client.get("/file").headers["etag"]
+
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.get(
+        "/file", headers={"Range": "bytes=0-9", "If-Range": '"stale"'}
+    )
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+    response = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+
+
+def test_open_ended_range_is_capped(tmp_path):
+    """GIVEN a video served from a cached file with an open-ended range cap
+    WHEN the browser asks for `bytes=N-`
+    THEN at most the capped number of bytes is returned."""
+    path = tmp_path / "video.mp4"
+    path.write_bytes(CONTENT)
+    cached = CachedFile(path)
+    app = FastAPI()
+
+    @app.get("/video")
+    async def stream_video(request: Request):
+        f, stat_result = cached.get()
+        return file_response(
+            request,
+            path,
+            "video/mp4",
+            stat_result=stat_result,
+            file=f,
+            open_ended_limit=100,
+        )
+
+    client = TestClient(app)
+    response = client.get("/video", headers={"Range": "bytes=1000-"})
+    assert response.content == CONTENT[1000:]
+    response = client.get("/video", headers={"Range": "bytes=0-"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 0-99/1024"
+    assert response.content == CONTENT[:100]
+    # the cached file object stays open for the next request
+    assert not cached.get()[0].closed
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, []),
+        ("gzip, deflate, br, zstd", ["br", "zstd", "gzip"]),
+        ("gzip;q=1.0, br;q=0.5", ["gzip", "br"]),
+        ("br;q=0, *", ["zstd", "gzip"]),
+        ("identity", []),
+    ],
+)
+def test_acceptable_encodings(accept_encoding, expected):
+    assert acceptable_encodings(accept_encoding, PRECOMPRESSED_SUFFIXES) == expected
+
+
+def test_precompressed_variant_is_negotiated(tmp_path, monkeypatch):
+    """GIVEN a finished splat with precompressed siblings
+    WHEN a client that accepts gzip downloads it
+    THEN the gzip variant is sent with Content-Encoding and Vary headers."""
+    path = tmp_path / "scene" / "scene.ksplat"
+    path.parent.mkdir()
+    path.write_bytes(bytes(4096))
+    sizes = write_precompressed_variants(path)
+    assert sizes["gzip"] < 4096
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    client = TestClient(src.main.app)
+
+    response = client.get("/splats/scene", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"].split(", ")
+    assert response.content == bytes(4096)
+
+    identity = client.get("/splats/scene", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    assert "Accept-Encoding" in identity.headers["vary"].split(", ")
+    assert identity.headers["etag"] != response.headers["etag"]
+    assert identity.content == bytes(4096)
+
+
+ARK_SERVING = Path(__file__).parents[2] / "ark" / "src" / "ark" / "serving.py"
+
+
+@pytest.mark.skipif(
+    not ARK_SERVING.is_file(), reason="ark is not part of this checkout"
+)
+def test_ark_serving_is_this_module():
+    """GIVEN the serving module both the splats API and ark ship
+    WHEN ark's is resolved
+    THEN it is this very file, not a copy that can drift."""
+    assert ARK_SERVING.is_symlink()
+    assert ARK_SERVING.resolve() == Path(src.serving.__file__).resolve()
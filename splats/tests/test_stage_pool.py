@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import src.stage_pool
+from src.stage_pool import run_in_stage_pool, shutdown_stage_pool, warm_stage_pool
+
+
+@pytest.fixture()
+def one_process(monkeypatch):
+    monkeypatch.setattr(src.stage_pool, "STAGE_PROCESSES", 1)
+    yield
+    shutdown_stage_pool()
+
+
+def test_stage_processes_are_reused(one_process):
+    """GIVEN a warmed stage pool
+    WHEN several stage functions run in it
+    THEN they share a process other than the caller's, with cv2 already loaded
+    """
+    warm_stage_pool()
+
+    pids = {run_in_stage_pool(os.getpid) for _ in range(3)}
+
+    assert len(pids) == 1 and os.getpid() not in pids
+    assert run_in_stage_pool(eval, "'cv2' in __import__('sys').modules")
+
+
+def test_stage_errors_propagate(one_process):
+    with pytest.raises(ValueError):
+        run_in_stage_pool(int, "not a number")
+
+
+def test_api_import_skips_vision_modules():
+    """GIVEN a fresh interpreter
+    WHEN the API is imported
+    THEN neither cv2 nor open3d is loaded
+    """
+    loaded = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, src.main; print(sorted({'cv2', 'open3d'} & set(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+    assert loaded == "[]"
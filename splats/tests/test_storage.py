@@ -0,0 +1,163 @@
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+import src.main
+import src.post_processing
+from src.jobs import read_job, update_job
+from src.serving import ACCESS_MARKER_FILENAME, AccessRecorder
+from src.storage import RetentionPolicy, StorageIndex, StorageManager
+
+DAY = 24 * 60 * 60
+
+
+def make_job(storage_dir, job_id, finished_at, size=1000):
+    """Lays out a finished job directory like the pipeline leaves it."""
+    job_dir = storage_dir / job_id
+    (job_dir / "colmap" / "images").mkdir(parents=True)
+    (job_dir / "colmap" / "sparse" / "0").mkdir(parents=True)
+    (job_dir / "colmap" / "images" / "frame_00001.png").write_bytes(b"p" * size)
+    (job_dir / "colmap" / "sparse" / "0" / "points3D.bin").write_bytes(b"s" * size)
+    (job_dir / "colmap" / "database.db").write_bytes(b"d" * size)
+    (job_dir / "video.mp4").write_bytes(b"v" * size)
+    (job_dir / f"{job_id}.ply").write_bytes(b"y" * size)
+    (job_dir / f"{job_id}.ksplat").write_bytes(b"k" * size)
+    (job_dir / f"{job_id}.lod.json").write_text("{}")
+    update_job(job_dir, status="done", finished_at=finished_at)
+    return job_dir
+
+
+def make_manager(tmp_path, **policy):
+    storage_dir = tmp_path / "storage"
+    (storage_dir / "uploads" / "session").mkdir(parents=True)
+    (storage_dir / "uploads" / "session" / "data").write_bytes(b"u" * 10_000)
+    index = StorageIndex(tmp_path / "jobs.sqlite3")
+    return storage_dir, StorageManager(storage_dir, index, RetentionPolicy(**policy))
+
+
+def test_sweep_compacts_then_removes_inputs(tmp_path):
+    """GIVEN a finished job
+    WHEN it is swept right away and again after the input retention
+    THEN intermediates go first, inputs later, and the artifacts and the
+    archived sparse model stay
+    """
+    storage_dir, manager = make_manager(tmp_path, keep_inputs_seconds=7 * DAY)
+    now = 1_000_000.0
+    job_dir = make_job(storage_dir, "a", finished_at=now)
+
+    manager.sweep(now=now)
+    assert not (job_dir / "colmap" / "database.db").exists()
+    assert not (job_dir / "colmap" / "sparse").exists()
+    assert not (job_dir / "a.ply").exists()
+    assert (job_dir / "colmap" / "sparse.tar.gz").is_file()
+    assert (job_dir / "colmap" / "images" / "frame_00001.png").is_file()
+    assert (job_dir / "video.mp4").is_file()
+
+    metrics = manager.sweep(now=now + 8 * DAY)
+    assert sorted(os.listdir(job_dir)) == [
+        "a.ksplat",
+        "a.lod.json",
+        "colmap",
+        "events.jsonl",
+        "job.json",
+    ]
+    assert os.listdir(job_dir / "colmap") == ["sparse.tar.gz"]
+    assert metrics["jobs_by_state"]["compacted"] == 1
+    assert metrics["total_bytes"] < 1000 + 1000  # the ksplat plus small metadata
+    assert (storage_dir / "uploads" / "session" / "data").is_file()
+
+
+def test_sweep_leaves_active_jobs(tmp_path):
+    """GIVEN a running job and one still exporting its mesh
+    WHEN storage is swept
+    THEN neither is compacted
+    """
+    storage_dir, manager = make_manager(tmp_path)
+    running = make_job(storage_dir, "running", finished_at=None)
+    update_job(running, status="running")
+    meshing = make_job(storage_dir, "meshing", finished_at=1.0)
+    update_job(meshing, mesh={"status": "running"})
+
+    manager.sweep(now=10 * DAY)
+
+    assert (running / "colmap" / "database.db").is_file()
+    assert (meshing / "meshing.ply").is_file()
+
+
+def test_sweep_compacts_job_whose_mesh_was_lost(tmp_path, monkeypatch):
+    """GIVEN a job swept while another host exports its mesh
+    WHEN storage is swept again once the export is given up
+    THEN the mesh is marked failed and the job is compacted
+    """
+    storage_dir, manager = make_manager(tmp_path)
+    job_dir = make_job(storage_dir, "meshing", finished_at=1.0)
+    update_job(
+        job_dir,
+        mesh={"status": "running", "owner": "elsewhere:1:0", "updated_at": time.time()},
+    )
+    manager.sweep(now=10 * DAY)
+    assert (job_dir / "meshing.ply").is_file()
+
+    monkeypatch.setattr(src.post_processing, "MESH_STALE_SECONDS", 0.0)
+    manager.sweep(now=10 * DAY)
+
+    assert read_job(job_dir)["mesh"]["status"] == "failed"
+    assert not (job_dir / "meshing.ply").exists()
+
+
+def test_quota_evicts_least_recently_downloaded(tmp_path):
+    """GIVEN three compacted jobs over the quota, one of them recently downloaded
+    WHEN storage is swept
+    THEN the least recently used job is evicted down to its metadata
+    """
+    storage_dir, manager = make_manager(tmp_path)
+    for job_id, finished_at in (("old", 1.0), ("downloaded", 2.0), ("new", 3.0)):
+        make_job(storage_dir, job_id, finished_at=finished_at, size=1000)
+    manager.sweep(now=10.0)
+    manager.record_access("old")
+
+    # each compacted job keeps about 3300 bytes
+    manager.policy = RetentionPolicy(quota_bytes=8000)
+    metrics = manager.sweep(now=11.0)
+
+    assert read_job(storage_dir / "downloaded")["evicted_at"] == 11.0
+    assert sorted(os.listdir(storage_dir / "downloaded")) == [
+        "events.jsonl",
+        "job.json",
+    ]
+    assert "evicted_at" not in read_job(storage_dir / "old")
+    assert "evicted_at" not in read_job(storage_dir / "new")
+    assert metrics["evicted_jobs"] == 1
+
+
+def test_quota_counts_downloads_recorded_by_another_server(tmp_path):
+    """GIVEN two indexed jobs, the older one then downloaded through ark
+    WHEN storage is swept over the quota
+    THEN the job ark served is kept and the other is evicted
+    """
+    storage_dir, manager = make_manager(tmp_path)
+    for job_id, finished_at in (("old", 1.0), ("new", 2.0)):
+        make_job(storage_dir, job_id, finished_at=finished_at, size=1000)
+    manager.sweep(now=10.0)
+    ark = AccessRecorder(storage_dir)
+
+    ark.record("old", now=20.0)
+    os.utime(storage_dir / "old" / ACCESS_MARKER_FILENAME, (20.0, 20.0))
+    ark.record("old", now=30.0)
+    manager.policy = RetentionPolicy(quota_bytes=5000)
+    manager.sweep(now=40.0)
+
+    assert os.stat(storage_dir / "old" / ACCESS_MARKER_FILENAME).st_mtime == 20.0
+    assert "evicted_at" not in read_job(storage_dir / "old")
+    assert read_job(storage_dir / "new")["evicted_at"] == 40.0
+
+
+def test_evicted_splat_is_gone(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    (tmp_path / "job").mkdir()
+    update_job(tmp_path / "job", status="done", evicted_at=1.0)
+
+    response = TestClient(src.main.app).get("/splats/job")
+
+    assert response.status_code == 410
@@ -0,0 +1,57 @@
+import struct
+
+import src.training_budget
+from src.training_budget import choose_budget, scale_checkpoints
+
+
+def write_model(sparse_dir, images, points):
+    sparse_dir.mkdir(parents=True)
+    (sparse_dir / "images.bin").write_bytes(struct.pack("<Q", images))
+    (sparse_dir / "points3D.bin").write_bytes(struct.pack("<Q", points))
+
+
+def test_choose_budget_follows_scene_size(tmp_path):
+    """GIVEN COLMAP models of a small and a large scene
+    WHEN a training budget is chosen
+    THEN the small scene trains fewer steps with a lower SH degree
+    """
+    write_model(tmp_path / "small", images=40, points=20_000)
+    write_model(tmp_path / "large", images=350, points=100_000)
+
+    small = choose_budget(tmp_path / "small")
+    large = choose_budget(tmp_path / "large")
+
+    assert (small.tier, small.total_steps, small.sh_degree) == ("small", 7000, 1)
+    assert (large.tier, large.total_steps, large.sh_degree) == ("large", 30000, 2)
+    assert small.checkpoint_steps[-1] == 7000
+
+
+def test_choose_budget_downgrades_under_backlog(tmp_path, monkeypatch):
+    """GIVEN a medium scene and a long queue backlog
+    WHEN a training budget is chosen
+    THEN it drops one tier per backlog step, never below the cheapest tier
+    """
+    monkeypatch.setattr(src.training_budget, "BACKLOG_SECONDS_PER_DOWNGRADE", 3600.0)
+    write_model(tmp_path / "0", images=100, points=10_000)
+
+    assert choose_budget(tmp_path / "0", backlog_seconds=1800).tier == "medium"
+    assert choose_budget(tmp_path / "0", backlog_seconds=3600).tier == "small"
+    budget = choose_budget(tmp_path / "0", backlog_seconds=10 * 3600)
+    assert (budget.tier, budget.downgrades) == ("draft", 2)
+
+
+def test_choose_budget_without_model(tmp_path):
+    """GIVEN no readable COLMAP model
+    WHEN a training budget is chosen
+    THEN the full budget is kept
+    """
+    assert choose_budget(tmp_path / "missing").total_steps == 30000
+
+
+def test_scale_checkpoints():
+    """GIVEN the default checkpoints of a 30000 step run
+    WHEN they are scaled to a shorter run
+    THEN they keep their relative position and end at the last step
+    """
+    assert scale_checkpoints(30000) == (2000, 7000, 15000, 30000)
+    assert scale_checkpoints(7000) == (500, 1500, 3500, 7000)
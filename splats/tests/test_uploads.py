@@ -0,0 +1,191 @@
+import hashlib
+import io
+import json
+import os
+import time
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import src.main
+import src.uploads
+from src.main import app
+from src.storage import RetentionPolicy, StorageIndex, StorageManager
+from src.uploads import (
+    MIN_CHUNK_SIZE,
+    UploadSessionRequest,
+    create_session,
+    expire_sessions,
+    list_sessions,
+)
+
+client = TestClient(app)
+
+
+def test_resumable_upload_out_of_order(tmp_path, monkeypatch):
+    """GIVEN a resumable upload session for a video
+    WHEN its chunks are PUT out of order, one of them with a bad checksum
+    THEN the bad chunk is rejected and reported as missing
+    AND once every chunk is received, finalize moves the file into a job and queues it.
+    """
+    monkeypatch.setattr(src.main, "UPLOADS_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(src.main, "SPLAT_STORAGE_DIR", tmp_path)
+    submitted = []
+    monkeypatch.setattr(
+        src.main.SCHEDULER, "submit", lambda *args, **kwargs: submitted.append(args)
+    )
+    (tmp_path / "uploads").mkdir()
+
+    content = b"\x00\x00\x00\x18ftypmp42" + os.urandom(2 * MIN_CHUNK_SIZE + 111)
+    response = client.post(
+        "/uploads",
+        json={
+            "filename": "scan.mp4",
+            "size": len(content),
+            "kind": "video",
+            "chunk_size": MIN_CHUNK_SIZE,
+        },
+    )
+    assert response.status_code == 201
+    upload_id = response.json()["upload_id"]
+    assert response.json()["chunk_count"] == 3
+
+    chunks = [
+        content[i : i + MIN_CHUNK_SIZE] for i in range(0, len(content), MIN_CHUNK_SIZE)
+    ]
+    for index in (2, 0):
+        response = client.put(
+            f"/uploads/{upload_id}/chunks/{index}",
+            content=chunks[index],
+            headers={"X-Chunk-SHA256": hashlib.sha256(chunks[index]).hexdigest()},
+        )
+        assert response.status_code == 200
+    response = client.put(
+        f"/uploads/{upload_id}/chunks/1",
+        content=chunks[1],
+        headers={"X-Chunk-SHA256": "0" * 64},
+    )
+    assert response.status_code == 400
+
+    progress = client.get(f"/uploads/{upload_id}").json()
+    assert progress["received"] == [0, 2]
+    assert progress["received_ranges"] == [
+        [0, MIN_CHUNK_SIZE - 1],
+        [2 * MIN_CHUNK_SIZE, len(content) - 1],
+    ]
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 409
+
+    client.put(f"/uploads/{upload_id}/chunks/1", content=chunks[1])
+    response = client.post(f"/uploads/{upload_id}/finalize")
+    assert response.status_code == 202
+    request_uuid = response.json()["uuid"]
+    assert (tmp_path / request_uuid / "scan.mp4").read_bytes() == content
+    assert submitted[0][0] == tmp_path / request_uuid
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_upload_is_rejected_from_its_first_chunk(tmp_path, monkeypatch):
+    """GIVEN a resumable upload session for a video
+    WHEN the first chunk is not a video container
+    THEN the chunk is rejected with a 400 and the session is dropped."""
+    monkeypatch.setattr(src.main, "UPLOADS_DIR", tmp_path)
+    size = 4 * MIN_CHUNK_SIZE
+    upload_id = client.post(
+        "/uploads",
+        json={
+            "filename": "scan.mp4",
+            "size": size,
+            "kind": "video",
+            "chunk_size": MIN_CHUNK_SIZE,
+        },
+    ).json()["upload_id"]
+
+    response = client.put(
+        f"/uploads/{upload_id}/chunks/0", content=b"GIF89a" + bytes(MIN_CHUNK_SIZE - 6)
+    )
+    assert response.status_code == 400
+    assert "container" in response.headers["x-error-detail"]
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_archive_is_validated_once_its_central_directory_arrives(tmp_path, monkeypatch):
+    """GIVEN a resumable upload of a ZIP with too few images
+    WHEN only the chunk holding the central directory has been uploaded
+    THEN the archive is already rejected."""
+    monkeypatch.setattr(src.main, "UPLOADS_DIR", tmp_path)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        z.writestr("padding.bin", os.urandom(MIN_CHUNK_SIZE + 10))
+        z.writestr("only.jpg", b"jpeg")
+    content = buffer.getvalue()
+    upload_id = client.post(
+        "/uploads",
+        json={
+            "filename": "images.zip",
+            "size": len(content),
+            "kind": "images_archive",
+            "chunk_size": MIN_CHUNK_SIZE,
+        },
+    ).json()["upload_id"]
+
+    last = (len(content) - 1) // MIN_CHUNK_SIZE
+    response = client.put(
+        f"/uploads/{upload_id}/chunks/{last}", content=content[last * MIN_CHUNK_SIZE :]
+    )
+    assert response.status_code == 400
+    assert "image_count" in response.headers["x-error-detail"]
+
+
+def test_abandoned_sessions_expire(tmp_path):
+    """GIVEN an abandoned upload session and a fresh one
+    WHEN the storage sweep runs past the upload TTL of the first
+    THEN only the abandoned session and its reserved space are removed."""
+    uploads_dir = tmp_path / "uploads"
+    uploads_dir.mkdir()
+    request = UploadSessionRequest(filename="scan.mp4", size=1000, kind="video")
+    abandoned = create_session(uploads_dir, request)
+    fresh = create_session(uploads_dir, request)
+    session_path = uploads_dir / abandoned["upload_id"] / "session.json"
+    session_path.write_text(
+        json.dumps({**abandoned, "created_at": time.time() - 2 * 3600})
+    )
+    manager = StorageManager(
+        tmp_path,
+        StorageIndex(tmp_path / "jobs.sqlite3"),
+        RetentionPolicy(upload_ttl_seconds=3600),
+        uploads_dir=uploads_dir,
+    )
+
+    metrics = manager.sweep()
+
+    assert [s["upload_id"] for s in list_sessions(uploads_dir)] == [fresh["upload_id"]]
+    assert metrics["expired_uploads"] == 1
+    assert metrics["freed_bytes"] == 1000
+
+
+def test_open_sessions_are_capped(tmp_path, monkeypatch):
+    """GIVEN limits on open upload sessions and on the space they reserve
+    WHEN more sessions are created than either allows
+    THEN they are refused with 429 or 507 until older ones go away."""
+    monkeypatch.setattr(src.uploads, "MAX_OPEN_UPLOADS", 2)
+    monkeypatch.setattr(src.uploads, "MAX_RESERVED_UPLOAD_BYTES", 3000)
+    uploads_dir = tmp_path / "uploads"
+    uploads_dir.mkdir()
+
+    def create(size):
+        request = UploadSessionRequest(filename="scan.mp4", size=size, kind="video")
+        return create_session(uploads_dir, request)
+
+    first = create(1000)
+    with pytest.raises(HTTPException) as refused:
+        create(2500)
+    assert refused.value.status_code == 507
+    create(2000)
+    with pytest.raises(HTTPException) as refused:
+        create(10)
+    assert refused.value.status_code == 429
+
+    expire_sessions(uploads_dir, ttl=0, now=first["created_at"] + 1)
+    assert create(10)["size"] == 10